@@ -23,7 +23,7 @@
     # Check https://github.com/odoo/odoo/blob/18.0/odoo/addons/base/data/ir_module_category_data.xml
     # for the full list
     'category': 'Accounting',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.4.0',
 
     # any module necessary for this one to work correctly
     'depends': ['base', 'account', 'sale', 'stock', 'web', 'sale_stock', 'account_reports'],
@@ -32,6 +32,7 @@
     'data': [
         'security/ir.model.access.csv',
         'data/fiscal_data.xml',
+        'data/ir_cron.xml',
         #'views/res_partner.xml',
         'views/account_invoice_view.xml',
         'views/account_journal.xml',
@@ -40,6 +41,7 @@
         'views/account_payment.xml',
         'views/ir_sequence.xml',
         'views/account_move_menu_debit_note.xml',
+        'views/account_move_preflight.xml',
         'wizard/report_dmc_excel.xml',
         'wizard/report_invoice_details_excel.xml',
         'wizard/report_sales_excel.xml',
@@ -52,8 +54,14 @@
         'wizard/report_exemptions_sar.xml',
         'wizard/reset_sequence.xml',
         'wizard/resolve_alert.xml',
+        'wizard/resequence_fiscal.xml',
+        'wizard/recompute_fiscal_totals.xml',
         'views/sequence_alert.xml',
         'views/sequence_audit.xml',
+        'views/fiscal_ledger.xml',
+        'views/fiscal_range_check.xml',
+        'views/fiscal_lease.xml',
+        'views/emission_point.xml',
         'views/menu.xml',
         'views/product_template.xml',
         'views/stock_move_line.xml',
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de concurrencia del asignador de números fiscales.
+
+Compara el camino actual (next_by_id sobre una secuencia no_gap, que hace
+SELECT ... FOR UPDATE NOWAIT sobre ir_sequence_date_range) contra el contador
+fiscal dedicado (reserva en un cursor propio que confirma de inmediato).
+
+Cada proceso trabajador abre su propio cursor, toma un número por transacción,
+mantiene la transacción abierta `--hold-ms` milisegundos (simulando el resto de
+la publicación de una factura) y confirma. Los errores de concurrencia se
+cuentan y se reintentan igual que lo haría Odoo.
+
+Uso:
+    python3 bench_fiscal_allocator.py -c /etc/odoo/odoo.conf -d base_pruebas \\
+        --workers 8 --allocations 200 --hold-ms 20
+"""
+
+import argparse
+import logging
+import multiprocessing
+import statistics
+import time
+
+_logger = logging.getLogger(__name__)
+
+CONCURRENCY_ERRORS = ('40001', '40P01', '55P03')
+
+
+def _load_registry(config_file, database):
+    import odoo
+    odoo.tools.config.parse_config(['-c', config_file, '-d', database])
+    return odoo.modules.registry.Registry(database)
+
+
+def setup_sequence(registry, allocator):
+    """Crear una secuencia fiscal de prueba con un rango de fecha amplio"""
+    from odoo import api, fields, SUPERUSER_ID
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        today = fields.Date.today()
+        sequence = env['ir.sequence'].create({
+            'name': 'Benchmark asignador fiscal (%s)' % allocator,
+            'prefix': 'BCH-',
+            'padding': 8,
+            'implementation': 'no_gap',
+            'use_date_range': True,
+            'is_fiscal': True,
+            'fiscal_allocator': allocator,
+            'date_range_ids': [(0, 0, {
+                'date_from': fields.Date.subtract(today, days=1),
+                'date_to': fields.Date.add(today, days=30),
+                'number_next': 1,
+                'cai': 'BENCHMARK',
+                'rangoInicial': 1,
+                'rangoFinal': 99999999,
+            })],
+        })
+        return sequence.id
+
+
+def teardown_sequence(registry, sequence_id):
+    from odoo import api, SUPERUSER_ID
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        env['ir.sequence'].browse(sequence_id).unlink()
+
+
+def worker(args):
+    """Tomar `allocations` números, uno por transacción, y devolver las métricas"""
+    config_file, database, sequence_id, allocations, hold_ms = args
+    from psycopg2 import errors
+    from odoo import api, fields, SUPERUSER_ID
+
+    registry = _load_registry(config_file, database)
+    latencies, retries, lock_wait = [], 0, 0.0
+    for _i in range(allocations):
+        started = time.perf_counter()
+        while True:
+            try:
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {'ir_sequence_date': fields.Date.today()})
+                    before = time.perf_counter()
+                    env['ir.sequence'].browse(sequence_id).next_by_id()
+                    lock_wait += time.perf_counter() - before
+                    time.sleep(hold_ms / 1000.0)
+                break
+            except errors.OperationalError as e:
+                if e.pgcode not in CONCURRENCY_ERRORS:
+                    raise
+                retries += 1
+                time.sleep(0.005)
+        latencies.append(time.perf_counter() - started)
+    return latencies, retries, lock_wait
+
+
+def run(config_file, database, allocator, workers, allocations, hold_ms):
+    registry = _load_registry(config_file, database)
+    sequence_id = setup_sequence(registry, allocator)
+    try:
+        started = time.perf_counter()
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(workers) as pool:
+            results = pool.map(worker, [(config_file, database, sequence_id, allocations, hold_ms)] * workers)
+        elapsed = time.perf_counter() - started
+    finally:
+        teardown_sequence(registry, sequence_id)
+
+    latencies = sorted(lat for result in results for lat in result[0])
+    total = len(latencies)
+    return {
+        'allocator': allocator,
+        'numbers': total,
+        'numbers_per_sec': total / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(total - 1, int(total * 0.99))] * 1000,
+        'retries': sum(result[1] for result in results),
+        'lock_wait_s': sum(result[2] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', required=True, help='Archivo de configuración de Odoo')
+    parser.add_argument('-d', '--database', required=True, help='Base de datos con kc_fiscal_hn instalado')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--allocations', type=int, default=200, help='Números por trabajador')
+    parser.add_argument('--hold-ms', type=int, default=20, help='Duración simulada del resto de la transacción')
+    args = parser.parse_args()
+
+    print('%-10s %10s %10s %10s %10s %10s %12s' % (
+        'asignador', 'números', 'núm/s', 'p50 ms', 'p99 ms', 'reintentos', 'espera s'))
+    for allocator in ('sequence', 'counter'):
+        res = run(args.config, args.database, allocator, args.workers, args.allocations, args.hold_ms)
+        print('%-10s %10d %10.1f %10.1f %10.1f %10d %12.2f' % (
+            res['allocator'], res['numbers'], res['numbers_per_sec'],
+            res['p50_ms'], res['p99_ms'], res['retries'], res['lock_wait_s']))
+
+
+if __name__ == '__main__':
+    main()
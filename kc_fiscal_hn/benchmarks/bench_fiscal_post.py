@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de publicación concurrente de facturas fiscales.
+
+Lanza N procesos trabajadores que publican M facturas cada uno con action_post,
+una factura por transacción, sobre diarios configurados como en producción
+(secuencia no_gap, use_date_range y rango CAI). Las facturas en borrador se crean
+y confirman antes de medir, así que solo se mide la publicación.
+
+Las facturas publicadas quedan en el libro fiscal y no se eliminan: use una base
+de datos desechable. Los diarios BPnnn se reutilizan entre corridas.
+
+Métricas:
+- facturas/s sobre el tiempo total de la fase de publicación;
+- latencia p50/p99 por factura, reintentos incluidos;
+- tiempo de espera por bloqueos, muestreado en pg_stat_activity por un proceso
+  monitor (backends del benchmark con wait_event_type = 'Lock');
+- reintentos por errores de serialización, interbloqueo o NOWAIT, que se
+  reintentan igual que lo haría Odoo.
+
+Uso:
+    python3 bench_fiscal_post.py -c /etc/odoo/odoo.conf -d base_pruebas \\
+        --workers 8 --invoices 100 --journals 1 --allocator sequence
+"""
+
+import argparse
+import logging
+import multiprocessing
+import statistics
+import time
+
+_logger = logging.getLogger(__name__)
+
+CONCURRENCY_ERRORS = ('40001', '40P01', '55P03')
+APPLICATION_NAME = 'kc_fiscal_bench_post'
+MONITOR_INTERVAL = 0.01
+
+
+def _load_registry(config_file, database):
+    import odoo
+    odoo.tools.config.parse_config(['-c', config_file, '-d', database])
+    return odoo.modules.registry.Registry(database)
+
+
+def setup_journals(registry, count, allocator, mode):
+    """
+    Preparar `count` diarios de venta fiscales, cada uno con su secuencia y rango CAI.
+    Los diarios de corridas anteriores se reutilizan: su numeración simplemente continúa.
+    """
+    from odoo import api, fields, SUPERUSER_ID
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        today = fields.Date.today()
+        journal_ids = []
+        for index in range(count):
+            code = 'BP%03d' % index
+            journal = env['account.journal'].search([('code', '=', code)], limit=1)
+            if not journal:
+                sequence = env['ir.sequence'].create({
+                    'name': 'Benchmark publicación %d' % index,
+                    'prefix': '%03d-001-01-' % index,
+                    'padding': 8,
+                    'implementation': 'no_gap',
+                    'use_date_range': True,
+                    'is_fiscal': True,
+                    'date_range_ids': [(0, 0, {
+                        'date_from': fields.Date.subtract(today, days=1),
+                        'date_to': fields.Date.add(today, days=365),
+                        'number_next': 1,
+                        'cai': 'BENCHMARK-%03d' % index,
+                        'rangoInicial': 1,
+                        'rangoFinal': 99999999,
+                    })],
+                })
+                journal = env['account.journal'].create({
+                    'name': 'Benchmark publicación %d' % index,
+                    'code': code,
+                    'type': 'sale',
+                    'document_fiscal': 'client',
+                    'sequence_id': sequence.id,
+                })
+            journal.sequence_id.write({'fiscal_allocator': allocator, 'fiscal_numbering_mode': mode})
+            journal_ids.append(journal.id)
+        return journal_ids
+
+
+def create_drafts(registry, journal_id, count):
+    """Crear y confirmar `count` facturas en borrador; devuelve sus ids"""
+    from odoo import api, fields, SUPERUSER_ID
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        partner = env['res.partner'].search([('customer_rank', '>', 0)], limit=1) \
+            or env['res.partner'].create({'name': 'Cliente Benchmark'})
+        account = env['account.account'].search([('account_type', '=', 'income')], limit=1)
+        moves = env['account.move'].create([{
+            'move_type': 'out_invoice',
+            'journal_id': journal_id,
+            'partner_id': partner.id,
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, {
+                'name': 'Benchmark',
+                'account_id': account.id,
+                'price_unit': 1000.0,
+                'quantity': 1,
+                'tax_ids': [],
+            })],
+        } for _i in range(count)])
+        return moves.ids
+
+
+def monitor(args):
+    """Muestrear los backends del benchmark que esperan un bloqueo hasta recibir la señal de fin"""
+    config_file, database, stop = args
+    registry = _load_registry(config_file, database)
+    samples = 0
+    with registry.cursor() as cr:
+        while not stop.is_set():
+            cr.execute("""
+                SELECT count(*) FROM pg_stat_activity
+                 WHERE application_name = %s AND wait_event_type = 'Lock'
+            """, [APPLICATION_NAME])
+            samples += cr.fetchone()[0]
+            # pg_stat_activity se congela durante la transacción: una por muestra
+            cr.rollback()
+            time.sleep(MONITOR_INTERVAL)
+    return samples * MONITOR_INTERVAL
+
+
+def worker(args):
+    """Publicar las facturas recibidas, una por transacción, y devolver las métricas"""
+    config_file, database, move_ids = args
+    from psycopg2 import errors
+    from odoo import api, SUPERUSER_ID
+
+    registry = _load_registry(config_file, database)
+    latencies, retries = [], 0
+    for move_id in move_ids:
+        started = time.perf_counter()
+        while True:
+            try:
+                with registry.cursor() as cr:
+                    cr.execute("SET LOCAL application_name = %s", [APPLICATION_NAME])
+                    env = api.Environment(cr, SUPERUSER_ID, {'skip_fiscal_warning': True})
+                    env['account.move'].browse(move_id).action_post()
+                break
+            except errors.OperationalError as e:
+                if e.pgcode not in CONCURRENCY_ERRORS:
+                    raise
+                retries += 1
+                time.sleep(0.005)
+        latencies.append(time.perf_counter() - started)
+    return latencies, retries
+
+
+def run(config_file, database, workers, invoices, journals, allocator, mode):
+    registry = _load_registry(config_file, database)
+    journal_ids = setup_journals(registry, journals, allocator, mode)
+    # Los trabajadores se reparten los diarios en turno rotativo
+    batches = [create_drafts(registry, journal_ids[index % len(journal_ids)], invoices)
+               for index in range(workers)]
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Manager() as manager, ctx.Pool(workers + 1) as pool:
+        stop = manager.Event()
+        lock_wait = pool.apply_async(monitor, [(config_file, database, stop)])
+        started = time.perf_counter()
+        results = pool.map(worker, [(config_file, database, batch) for batch in batches], chunksize=1)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        lock_wait_s = lock_wait.get()
+
+    latencies = sorted(lat for result in results for lat in result[0])
+    total = len(latencies)
+    return {
+        'allocator': allocator,
+        'mode': mode,
+        'journals': journals,
+        'invoices': total,
+        'invoices_per_sec': total / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(total - 1, int(total * 0.99))] * 1000,
+        'retries': sum(result[1] for result in results),
+        'lock_wait_s': lock_wait_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', required=True, help='Archivo de configuración de Odoo')
+    parser.add_argument('-d', '--database', required=True, help='Base de datos con kc_fiscal_hn instalado')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--invoices', type=int, default=100, help='Facturas por trabajador')
+    parser.add_argument('--journals', type=int, default=1, help='Diarios (secuencias) independientes')
+    parser.add_argument('--allocator', choices=('sequence', 'counter', 'both'), default='both')
+    parser.add_argument('--mode', choices=('immediate', 'deferred'), default='immediate')
+    args = parser.parse_args()
+
+    allocators = ('sequence', 'counter') if args.allocator == 'both' else (args.allocator,)
+    print('%-10s %-10s %8s %9s %10s %10s %10s %10s %12s' % (
+        'asignador', 'modo', 'diarios', 'facturas', 'fact/s', 'p50 ms', 'p99 ms', 'reintentos', 'espera s'))
+    for allocator in allocators:
+        res = run(args.config, args.database, args.workers, args.invoices, args.journals, allocator, args.mode)
+        print('%-10s %-10s %8d %9d %10.1f %10.1f %10.1f %10d %12.2f' % (
+            res['allocator'], res['mode'], res['journals'], res['invoices'], res['invoices_per_sec'],
+            res['p50_ms'], res['p99_ms'], res['retries'], res['lock_wait_s']))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,13 +24,10 @@ class FiscalController(http.Controller):
             if not date:
                 date = fields.Date.today()
             
-            # Verificar si hay rango de fecha disponible
+            # Verificar si hay rango de fecha disponible (mismo estado que usa la publicación)
             if sequence.use_date_range:
-                seq_date = request.env['ir.sequence.date_range'].sudo().search([
-                    ('sequence_id', '=', sequence.id),
-                    ('date_from', '<=', date),
-                    ('date_to', '>=', date)
-                ], limit=1)
+                status = sequence.get_status_snapshot(fields.Date.to_date(date))
+                seq_date = status['current_range']
                 
                 if not seq_date:
                     return {'success': False, 'error': 'No hay rango de fecha disponible.'}
@@ -39,7 +36,8 @@ class FiscalController(http.Controller):
                     return {'success': False, 'error': 'No hay CAI configurado para este rango.'}
                 
                 # Verificar si hay números disponibles
-                if seq_date.number_next_actual > seq_date.rangoFinal:
+                remaining = status['remaining_numbers']
+                if remaining is not None and remaining <= 0:
                     return {'success': False, 'error': 'Rango de numeración agotado.'}
                 
                 return {
@@ -47,7 +45,10 @@ class FiscalController(http.Controller):
                     'cai': seq_date.cai,
                     'rango_inicial': seq_date.rangoInicial,
                     'rango_final': seq_date.rangoFinal,
-                    'siguiente_numero': seq_date.number_next_actual
+                    'siguiente_numero': seq_date.number_next_actual,
+                    'numeros_restantes': remaining,
+                    'dias_restantes': status['days_left'],
+                    'puede_continuar': status['can_continue'],
                 }
             else:
                 return {'success': True, 'message': 'Secuencia válida (sin rango de fecha)'}
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Cargar en el libro de números fiscales los documentos publicados antes de su creación
+    y verificar la configuración de secuencias de nota de crédito.
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    count = env['kc_fiscal_hn.fiscal.ledger']._backfill_from_moves()
+    _logger.info("Libro de números fiscales: %d documentos históricos registrados", count)
+    # Corrección de secuencias de nota de crédito que antes se hacía al publicar
+    env['account.journal'].search([('document_fiscal', '=', 'credit')])._check_refund_fiscal_sequences()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Enlazar facturas y guías con su rango CAI y descartar el texto copiado que coincide con él.
+    Primero por el libro de números fiscales; si no, por el CAI cuando pertenece a un solo rango.
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    date_ranges = env['ir.sequence.date_range'].search([])
+    date_ranges._compute_numero_range()
+    env.flush_all()
+
+    cr.execute("""
+        UPDATE account_move m
+           SET fiscal_date_range_id = l.date_range_id
+          FROM kc_fiscal_hn_fiscal_ledger l
+          JOIN ir_sequence_date_range dr ON dr.id = l.date_range_id
+         WHERE l.move_id = m.id
+           AND m.fiscal_date_range_id IS NULL
+           AND m.cai_manual = dr.cai
+    """)
+    _logger.info("Rango CAI enlazado desde el libro fiscal en %d facturas", cr.rowcount)
+
+    for table in ('account_move', 'stock_picking'):
+        cr.execute("""
+            UPDATE "%s" d
+               SET fiscal_date_range_id = dr.id
+              FROM (SELECT cai, min(id) AS id
+                      FROM ir_sequence_date_range
+                     WHERE COALESCE(cai, '') != ''
+                  GROUP BY cai
+                    HAVING count(*) = 1) dr
+             WHERE d.fiscal_date_range_id IS NULL
+               AND d.cai_manual = dr.cai
+        """ % table)
+        _logger.info("Rango CAI enlazado por CAI en %d registros de %s", cr.rowcount, table)
+
+        # Solo se conserva el texto que difiere del rango enlazado
+        cr.execute("""
+            UPDATE "%s" d
+               SET cai_manual = NULLIF(d.cai_manual, dr.cai),
+                   fecha_limite_manual = CASE WHEN d.fecha_limite_manual::date = dr.date_to
+                                              THEN NULL ELSE d.fecha_limite_manual END,
+                   numero_inicial_manual = NULLIF(d.numero_inicial_manual, dr."numeroInicial"),
+                   numero_final_manual = NULLIF(d.numero_final_manual, dr."numeroFinal")
+              FROM ir_sequence_date_range dr
+             WHERE dr.id = d.fiscal_date_range_id
+        """ % table)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Las columnas con el texto del CAI pasan a guardar solo los valores manuales
+RENAMED_COLUMNS = [
+    ('cai', 'cai_manual'),
+    ('fechaLimiteEmision', 'fecha_limite_manual'),
+    ('numeroInicial', 'numero_inicial_manual'),
+    ('numeroFinal', 'numero_final_manual'),
+]
+
+
+def migrate(cr, version):
+    """Conservar el CAI copiado en facturas y guías como valor manual antes de leerlo del rango"""
+    for table in ('account_move', 'stock_picking'):
+        for old_name, new_name in RENAMED_COLUMNS:
+            cr.execute("""
+                SELECT 1 FROM information_schema.columns
+                 WHERE table_name = %s AND column_name = %s
+            """, [table, old_name])
+            if cr.fetchone():
+                cr.execute('ALTER TABLE "%s" RENAME COLUMN "%s" TO "%s"' % (table, old_name, new_name))
+                _logger.info("Columna %s.%s renombrada a %s", table, old_name, new_name)
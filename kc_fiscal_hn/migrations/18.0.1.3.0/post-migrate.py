@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Los totales fiscales ahora clasifican impuestos por tipo_impuesto/codigo_sar en lugar del nombre
+    del grupo. Se traslada una sola vez esa clasificación implícita a los campos del impuesto para que
+    los totales no cambien al actualizar.
+    """
+    for tipo in ('exento', 'exonerado'):
+        cr.execute("""
+            UPDATE account_tax t
+               SET tipo_impuesto = %s
+              FROM account_tax_group g
+             WHERE g.id = t.tax_group_id
+               AND COALESCE(t.tipo_impuesto, 'isv') IN ('isv', 'otros')
+               AND NOT COALESCE(t.is_retention, FALSE)
+               AND g.name::text ILIKE %s
+        """, (tipo, '%%%s%%' % tipo))
+        _logger.info("%d impuestos clasificados como %s por su grupo", cr.rowcount, tipo)
+
+    cr.execute("""
+        UPDATE account_tax
+           SET retencion_tipo = 'isr'
+         WHERE (tipo_impuesto = 'retencion' OR is_retention)
+           AND name::text ILIKE '%ISR%'
+    """)
+    _logger.info("%d impuestos de retención marcados como ISR", cr.rowcount)
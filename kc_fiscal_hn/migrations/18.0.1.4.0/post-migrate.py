@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.addons.kc_fiscal_hn.models.account_move_line import FISCAL_INVOICE_LINE_TYPES
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Rellenar en SQL los hechos fiscales de las líneas de factura existentes y recalcular desde ellos
+    los totales SAR almacenados. Desde esta versión los montos SAR se redondean a 2 decimales con la
+    mitad hacia arriba (float_round, igual que ROUND de PostgreSQL) en lugar del round() de Python,
+    que en los empates podía dejar el centavo inferior: los totales guardados se alinean aquí una vez.
+    Además cada línea tiene una sola clase fiscal: una línea con ISV 15% y 18% a la vez ya no se suma
+    a ambos totales sino solo a los del 15%, por lo que esas facturas también cambian aquí.
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    updated = env['account.move.line']._backfill_fiscal_facts()
+    _logger.info("Hechos fiscales rellenados en %d líneas de factura", updated)
+    cr.execute("""
+        SELECT DISTINCT move_id FROM account_move_line WHERE display_type IN %s ORDER BY move_id
+    """, [FISCAL_INVOICE_LINE_TYPES])
+    move_ids = [row[0] for row in cr.fetchall()]
+    changed = env['account.move']._recompute_fiscal_totals_sql(move_ids, refresh_lines=False)
+    _logger.info("Totales SAR recalculados con el nuevo redondeo: %d de %d facturas cambiaron",
+                 changed, len(move_ids))
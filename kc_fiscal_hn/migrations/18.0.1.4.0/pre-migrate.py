@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Crear las columnas de hechos fiscales por línea antes de cargar el módulo, para que el ORM no las
+    calcule línea por línea sobre todo el histórico; post-migrate las rellena en SQL por bloques.
+    """
+    cr.execute("""
+        ALTER TABLE account_move_line
+            ADD COLUMN IF NOT EXISTS fiscal_gross double precision,
+            ADD COLUMN IF NOT EXISTS fiscal_discount double precision,
+            ADD COLUMN IF NOT EXISTS fiscal_class varchar,
+            ADD COLUMN IF NOT EXISTS fiscal_isv_amount double precision,
+            ADD COLUMN IF NOT EXISTS fiscal_exento_base double precision,
+            ADD COLUMN IF NOT EXISTS fiscal_exonerado_base double precision,
+            ADD COLUMN IF NOT EXISTS fiscal_gravado_base double precision
+    """)
+    _logger.info("Columnas de hechos fiscales creadas en account_move_line")
@@ -4,6 +4,7 @@ from . import account_journal
 from . import account_move
 from . import account_move_line
 from . import account_tax
+from . import cache_version
 from . import ir_sequence
 from . import product_template
 #from . import res_partner
@@ -11,6 +12,10 @@ from . import stock_move_line
 from . import stock_picking
 from . import sequence_alert
 from . import sequence_audit
+from . import fiscal_ledger
+from . import fiscal_range_check
+from . import fiscal_lease
+from . import emission_point
 from . import res_company
 from . import account_payment
 from . import account_aged_partner_balance
\ No newline at end of file
@@ -1,10 +1,17 @@
 import logging
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
 _logger = logging.getLogger(__name__)
 
+# Tipos de movimiento que usan secuencia fiscal
+FISCAL_MOVE_TYPES = ('out_invoice', 'in_invoice', 'out_refund', 'in_refund', 'in_receipt')
+# Campos del diario que cambian la resolución de la secuencia fiscal
+FISCAL_SEQUENCE_FIELDS = {'document_fiscal', 'sequence_id', 'refund_sequence_id'}
+# Clave de versión (kc_fiscal_hn.cache.version) de la resolución diario/punto de emisión → secuencia fiscal
+FISCAL_SEQUENCE_CONFIG_CACHE_KEY = 'fiscal_sequence_config'
+
 
 class AccountJournal(models.Model):
     _inherit = "account.journal"
@@ -89,7 +96,16 @@ class AccountJournal(models.Model):
                     and not vals.get("refund_sequence_id")
             ):
                 vals["refund_sequence_id"] = self._create_sequence(vals, refund=True).id
-        return super().create(vals_list)
+        journals = super().create(vals_list)
+        journals._check_refund_fiscal_sequences()
+        return journals
+
+    def write(self, vals):
+        result = super().write(vals)
+        if FISCAL_SEQUENCE_FIELDS.intersection(vals):
+            self._check_refund_fiscal_sequences()
+            self.env['kc_fiscal_hn.cache.version']._bump([FISCAL_SEQUENCE_CONFIG_CACHE_KEY])
+        return result
 
     @api.model
     def _prepare_sequence(self, vals, refund=False):
@@ -258,6 +274,30 @@ class AccountJournal(models.Model):
             _logger.warning("%s %s", msg_err, e)
         return {}
 
+    def _get_fiscal_sequence_config(self, move_type):
+        """
+        Resolución (diario, tipo de movimiento) → (necesita_fiscal, id_secuencia, es_fiscal, usa_rango_fecha).
+        Sin efectos secundarios: se memoriza por versión, que cambia al modificar los campos
+        fiscales de diarios, puntos de emisión o secuencias.
+        """
+        version = self.env['kc_fiscal_hn.cache.version']._get_version(FISCAL_SEQUENCE_CONFIG_CACHE_KEY)
+        return self._get_fiscal_sequence_config_cached(move_type, version)
+
+    @tools.ormcache('self.id', 'move_type', 'version')
+    def _get_fiscal_sequence_config_cached(self, move_type, version):
+        journal = self.sudo()
+        # Solo facturas y notas de crédito/débito necesitan secuencias fiscales
+        if not journal.document_fiscal or (move_type and move_type not in FISCAL_MOVE_TYPES):
+            return (False, False, False, False)
+        # Para notas de crédito/débito, usar refund_sequence_id si existe
+        if move_type in ('out_refund', 'in_refund') and journal.refund_sequence_id:
+            sequence = journal.refund_sequence_id
+        else:
+            sequence = journal.sequence_id
+        if not sequence:
+            return (True, False, False, False)
+        return (True, sequence.id, sequence.is_fiscal, sequence.use_date_range)
+
     def needs_fiscal_sequence(self, move_type=None):
         """
         Determina si el diario necesita secuencia fiscal basado en:
@@ -265,78 +305,30 @@ class AccountJournal(models.Model):
         - El tipo de movimiento (si se especifica)
         """
         self.ensure_one()
-        
-        # Si no tiene documento fiscal configurado, no necesita secuencia fiscal
-        if not self.document_fiscal:
-            if move_type == 'out_refund':
-                _logger.info(
-                    "NC needs_fiscal_sequence: diario %s sin documento fiscal",
-                    self.display_name,
-                )
-            return False
-            
-        # Si se especifica el tipo de movimiento, verificar si aplica
-        if move_type:
-            # Solo facturas y notas de crédito/débito necesitan secuencias fiscales
-            fiscal_move_types = ['out_invoice', 'in_invoice', 'out_refund', 'in_refund', 'in_receipt']
-            if move_type not in fiscal_move_types:
-                if move_type == 'out_refund':
-                    _logger.info(
-                        "NC needs_fiscal_sequence: tipo %s no fiscal en diario %s",
-                        move_type, self.display_name,
-                    )
-                return False
-                
-        if move_type == 'out_refund':
-            _logger.info(
-                "NC needs_fiscal_sequence: diario %s OK (documento_fiscal=%s)",
-                self.display_name, self.document_fiscal,
-            )
-        return True
+        return self._get_fiscal_sequence_config(move_type)[0]
 
     def get_fiscal_sequence(self, move_type=None):
         """
         Obtiene la secuencia fiscal apropiada según el tipo de movimiento
         """
         self.ensure_one()
-        
-        if not self.needs_fiscal_sequence(move_type):
-            if move_type == 'out_refund':
-                _logger.info(
-                    "NC get_fiscal_sequence: diario %s no requiere secuencia",
-                    self.display_name,
-                )
-            return False
-            
-        # Para notas de crédito/débito, usar refund_sequence_id si existe
-        if move_type in ['out_refund', 'in_refund'] and self.refund_sequence_id:
-            if not self.refund_sequence_id.is_fiscal and self.document_fiscal == 'credit':
-                # Forzar marcado fiscal para secuencia de NC si está configurada en diario fiscal
-                self.refund_sequence_id.sudo().write({
-                    'is_fiscal': True,
-                    'fiscal_type': 'credit_note',
-                })
-                _logger.warning(
-                    "NC get_fiscal_sequence: refund_sequence_id marcado como fiscal (%s)",
-                    self.refund_sequence_id.display_name,
-                )
-            if move_type == 'out_refund':
-                _logger.info(
-                    "NC get_fiscal_sequence: usando refund_sequence_id %s",
-                    self.refund_sequence_id.display_name,
-                )
-            return self.refund_sequence_id
-        elif self.sequence_id:
-            if move_type == 'out_refund':
-                _logger.info(
-                    "NC get_fiscal_sequence: usando sequence_id %s",
-                    self.sequence_id.display_name,
-                )
-            return self.sequence_id
-            
-        if move_type == 'out_refund':
+        sequence_id = self._get_fiscal_sequence_config(move_type)[1]
+        return self.env['ir.sequence'].browse(sequence_id) if sequence_id else False
+
+    def _check_refund_fiscal_sequences(self):
+        """
+        Verificación de configuración: en diarios de nota de crédito la secuencia de
+        reembolso debe ser fiscal. Se ejecuta al configurar el diario, no al publicar.
+        """
+        sequences = self.filtered(
+            lambda j: j.document_fiscal == 'credit' and j.refund_sequence_id and not j.refund_sequence_id.is_fiscal
+        ).refund_sequence_id
+        if sequences:
+            sequences.sudo().write({
+                'is_fiscal': True,
+                'fiscal_type': 'credit_note',
+            })
             _logger.warning(
-                "NC get_fiscal_sequence: no hay secuencia en diario %s",
-                self.display_name,
+                "Secuencias de nota de crédito marcadas como fiscales: %s",
+                ", ".join(sequences.mapped('display_name')),
             )
-        return False
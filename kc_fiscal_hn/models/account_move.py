@@ -2,14 +2,30 @@
 # @author: Alexis de Lattre <alexis.delattre@akretion.com>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError, ValidationError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import logging
 import math
+import threading
+import time
+
+from .account_move_line import (FISCAL_FACTS_CHUNK_SIZE, FISCAL_INVOICE_LINE_TYPES, FISCAL_LINE_AMOUNT_FIELDS,
+                                FISCAL_LINE_FACT_FIELDS)
 
 _logger = logging.getLogger(__name__)
 
+# Clave del bloqueo consultivo que garantiza un único proceso de numeración diferida
+FISCAL_NUMBERING_QUEUE_LOCK = 4807201
+
+# Hilos máximos para publicar grupos de secuencias independientes en paralelo
+PARALLEL_POST_MAX_WORKERS = 4
+
+# Totales SAR de cabecera, agregados desde los hechos fiscales por línea
+FISCAL_TOTAL_FIELDS = ('amount_discount', 'amount_exento', 'amount_exonerado', 'amount_isv15', 'gravado_isv15',
+                       'amount_isv18', 'gravado_isv18', 'base_imponible_total', 'isv_total')
+
 class AccountMove(models.Model):
     _inherit = "account.move"
 
@@ -29,10 +45,23 @@ class AccountMove(models.Model):
         help='Número de documento del proveedor (se usará como referencia)'
     )
     femision_proveedor = fields.Char(string='Fecha Emisión')
-    cai = fields.Char(string='CAI', help='Clave de Autorización de Impresión')
-    fechaLimiteEmision = fields.Date(string='Fecha límite de emisión',help='Fecha límite de emisión de facturas')
-    numeroInicial = fields.Char(string='Número inicial', help='Número inicial de facturación', )
-    numeroFinal = fields.Char(string='Número final', help='Número final de facturación', )
+    # Rango CAI con el que se numeró el documento; el CAI y el rango autorizado se leen de él
+    fiscal_date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango CAI', copy=False,
+                                           readonly=True, index='btree_not_null', ondelete='restrict')
+    cai = fields.Char(string='CAI', help='Clave de Autorización de Impresión',
+                      compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info',
+                      search='_search_cai')
+    fechaLimiteEmision = fields.Date(string='Fecha límite de emisión',help='Fecha límite de emisión de facturas',
+                                     compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
+    numeroInicial = fields.Char(string='Número inicial', help='Número inicial de facturación',
+                                compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
+    numeroFinal = fields.Char(string='Número final', help='Número final de facturación',
+                              compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
+    # Valores capturados a mano o importados de documentos sin rango CAI en el sistema
+    cai_manual = fields.Char(string='CAI (Manual)', copy=False)
+    fecha_limite_manual = fields.Date(string='Fecha Límite (Manual)', copy=False)
+    numero_inicial_manual = fields.Char(string='Número Inicial (Manual)', copy=False)
+    numero_final_manual = fields.Char(string='Número Final (Manual)', copy=False)
     totalAmountString = fields.Char(string='Monto Total', help='Monto Total', )
     noOrdenCompraExenta = fields.Char(string='No OC exenta', help='Número de orden de compra exenta')
     noConsRegistroExonerado = fields.Char(string='No cons. reg. Exonerado', help='Número constancia de registro exonerado')
@@ -40,13 +69,13 @@ class AccountMove(models.Model):
     sale_order_id = fields.Many2one('sale.order', string='Pedido de Venta', compute='_get_saleorder', store=True)
     exonerado = fields.Boolean(string='Exonerado', required=False, default=False)
     exento = fields.Boolean(string='Exento', required=False, default=False)
-    amount_discount = fields.Monetary(string='Descuento', store=True, compute='_compute_discount', readonly=True, currency_field='currency_id', digits=(16, 4))
-    amount_exento = fields.Monetary(string='Exento', store=True, compute='_compute_exent', readonly=True, currency_field='currency_id', digits=(16, 4))
-    amount_exonerado = fields.Monetary(string='Exonerado', store=True, compute='_compute_exent', readonly=True, currency_field='currency_id', digits=(16, 4))
-    amount_isv15 = fields.Monetary(string='Isv 15%', store=True, compute='_compute_importe_gravado', readonly=True, currency_field='currency_id', digits=(16, 4))
-    gravado_isv15 = fields.Monetary(string='Importe Gravado 15%', store=True, compute='_compute_importe_gravado', readonly=True, currency_field='currency_id', digits=(16, 4))
-    amount_isv18 = fields.Monetary(string='Isv 18%', store=True, compute='_compute_importe_gravado', readonly=True, currency_field='currency_id', digits=(16, 4))
-    gravado_isv18 = fields.Monetary(string='Importe Gravado 18%', store=True, compute='_compute_importe_gravado', readonly=True, currency_field='currency_id', digits=(16, 4))
+    amount_discount = fields.Monetary(string='Descuento', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    amount_exento = fields.Monetary(string='Exento', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    amount_exonerado = fields.Monetary(string='Exonerado', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    amount_isv15 = fields.Monetary(string='Isv 15%', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    gravado_isv15 = fields.Monetary(string='Importe Gravado 15%', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    amount_isv18 = fields.Monetary(string='Isv 18%', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
+    gravado_isv18 = fields.Monetary(string='Importe Gravado 18%', store=True, compute='_compute_fiscal_amounts', readonly=True, currency_field='currency_id', digits=(16, 4))
     depto = fields.Many2one("res.country.state", string='Departamento', related='partner_id.state_id', store=True)
     class_document_sar = fields.Selection(string='Clase de Documento SAR', selection=[('FA', 'FA-FACTURA'), ('OC', 'OC-OTROS COMPROBANTES DE PAGO')], required=False, )
     montos_sar = fields.Selection(string='Montos SAR', selection=[('costo', 'Monto al Costo'), ('gasto', 'Monto al Gasto'), ('no_deducible', 'Valor no deducible')], default='gasto', required=False, )
@@ -63,8 +92,8 @@ class AccountMove(models.Model):
     ], string='Estado Validación Fiscal', default='pending', readonly=True)
     fiscal_validation_message = fields.Text(string='Mensaje Validación Fiscal', readonly=True)
     requires_fiscal_numbering = fields.Boolean(string='Requiere Numeración Fiscal', compute='_compute_requires_fiscal_numbering', store=True)
-    base_imponible_total = fields.Monetary(string='Base Imponible Total', compute='_compute_base_imponible', store=True, readonly=True, currency_field='currency_id', digits=(16, 4))
-    isv_total = fields.Monetary(string='ISV Total', compute='_compute_isv_total', store=True, readonly=True, currency_field='currency_id', digits=(16, 4))
+    base_imponible_total = fields.Monetary(string='Base Imponible Total', compute='_compute_fiscal_amounts', store=True, readonly=True, currency_field='currency_id', digits=(16, 4))
+    isv_total = fields.Monetary(string='ISV Total', compute='_compute_fiscal_amounts', store=True, readonly=True, currency_field='currency_id', digits=(16, 4))
     
     # Campo computado para mostrar la referencia completa
     referencia_completa = fields.Char(
@@ -94,6 +123,16 @@ class AccountMove(models.Model):
     dmc_numero_fyduca = fields.Char(string='N.º FYDUCA')
     dmc_numero_dua = fields.Char(string='N.º DUA')
 
+    # Cola de numeración fiscal diferida
+    fiscal_number_pending = fields.Boolean(string='Numeración Fiscal Pendiente', copy=False, readonly=True, index=True)
+    fiscal_queued_at = fields.Datetime(string='En Cola Desde', copy=False, readonly=True)
+    fiscal_ledger_ids = fields.One2many('kc_fiscal_hn.fiscal.ledger', 'move_id', string='Números Fiscales Consumidos',
+                                        copy=False, readonly=True)
+    emission_point_id = fields.Many2one('kc_fiscal_hn.emission.point', string='Punto de Emisión',
+                                        compute='_compute_emission_point_id', store=True, readonly=False,
+                                        copy=False, index='btree_not_null', check_company=True,
+                                        domain="[('journal_ids', 'in', journal_id)]")
+
     # def action_print_document(self):
     #     """
     #     Método personalizado para imprimir documentos y marcar original_print como True
@@ -154,138 +193,219 @@ class AccountMove(models.Model):
             return False
         return super(AccountMove, invoices_other_sequences)._is_end_of_seq_chain()
 
-    @api.depends('invoice_line_ids.discount', 'invoice_line_ids.price_unit',
-                 'invoice_line_ids.quantity', 'invoice_line_ids.price_subtotal',
-                 'invoice_line_ids.product_id')
-    def _compute_discount(self):
-        for inv in self:
-            discount_total = 0.0
-            for line in inv.invoice_line_ids:
-                if line.discount:
-                    subtotal_line = line.quantity * line.price_unit
-                    discount_line = (subtotal_line * line.discount) / 100
-                    discount_total += discount_line
-                elif line.product_id.product_tmpl_id.default_code == 'Desc':
-                    discount_total += abs(line.price_subtotal)
-            inv.amount_discount = round(discount_total, 2)
-
-    @api.depends('invoice_line_ids.tax_ids', 'invoice_line_ids.discount',
-                 'invoice_line_ids.price_unit', 'invoice_line_ids.quantity',
-                 'invoice_line_ids.price_subtotal')
-    def _compute_exent(self):
+    @api.depends('invoice_line_ids.fiscal_discount', 'invoice_line_ids.fiscal_class',
+                 'invoice_line_ids.fiscal_isv_amount', 'invoice_line_ids.fiscal_exento_base',
+                 'invoice_line_ids.fiscal_exonerado_base', 'invoice_line_ids.fiscal_gravado_base')
+    def _compute_fiscal_amounts(self):
+        """Totales SAR agregados desde los hechos fiscales de las líneas (account.move.line):
+        descuento, exento, exonerado, gravado e ISV 15%/18%, base imponible e ISV total.
+        """
+        totals = self._get_fiscal_line_totals()
         for inv in self:
-            exento = 0.0
-            exonerado = 0.0
+            by_class = totals.get(inv.id, {})
 
-            for line in inv.invoice_line_ids:
-                # Calcular el subtotal de la línea
-                subtotal = line.quantity * line.price_unit
-                total = subtotal - ((subtotal * line.discount) / 100) if line.discount else subtotal
-
-                # Normalizar nombre de grupos para robustez
-                def _name(n):
-                    return (n or '').strip().lower()
-
-                # Verificar si la línea está exenta (grupo con nombre que contenga 'exento') o si no tiene impuestos asignados
-                # Tratamos líneas sin impuestos como exentas para efectos de totales SAR
-                if (not line.tax_ids) or any('exento' in _name(tax.tax_group_id.name) for tax in line.tax_ids):
-                    exento += total
-
-                # Verificar si la línea está exonerada (grupo cuyo nombre contenga 'exonerado')
-                if any('exonerado' in _name(tax.tax_group_id.name) for tax in line.tax_ids):
-                    exonerado += total
-
-                # # Verificar si la línea está exonerada (código de producto específico)
-                # if line.product_id.product_tmpl_id.default_code == 'Desc':  # Cambia 'Desc' por el código que identifica productos exonerados
-                #     exonerado += total
-
-            # Asignar los valores acumulados a los campos correspondientes
-            inv.amount_exento = round(exento, 2)
-            inv.amount_exonerado = round(exonerado, 2)
-
-    @api.depends('invoice_line_ids.tax_ids', 'invoice_line_ids.discount',
-                 'invoice_line_ids.price_unit', 'invoice_line_ids.quantity',
-                 'invoice_line_ids.price_subtotal')
-    def _compute_importe_gravado(self):
-        """Cálculo mejorado de ISV según SAR de Honduras"""
-        for inv in self:
-            isv15 = 0.0
-            isv18 = 0.0
-            importe15 = 0.0
-            importe18 = 0.0
+            def _sum(fname, fiscal_class=None):
+                return sum(values[fname] for line_class, values in by_class.items()
+                           if fiscal_class is None or line_class == fiscal_class)
 
-            for line in inv.invoice_line_ids:
-                # Calcular base imponible correctamente
-                subtotal_line = line.quantity * line.price_unit
-                
-                # Aplicar descuento si existe
-                if line.discount:
-                    discount_amount = (subtotal_line * line.discount) / 100
-                    base_imponible = subtotal_line - discount_amount
-                else:
-                    base_imponible = subtotal_line
+            inv.amount_discount = self._round_sar(_sum('fiscal_discount'))
+            inv.amount_exento = self._round_sar(_sum('fiscal_exento_base'))
+            inv.amount_exonerado = self._round_sar(_sum('fiscal_exonerado_base'))
+            inv.amount_isv15 = self._round_sar(_sum('fiscal_isv_amount', 'isv15'))
+            inv.gravado_isv15 = self._round_sar(_sum('fiscal_gravado_base', 'isv15'))
+            inv.amount_isv18 = self._round_sar(_sum('fiscal_isv_amount', 'isv18'))
+            inv.gravado_isv18 = self._round_sar(_sum('fiscal_gravado_base', 'isv18'))
+            inv.base_imponible_total = self._round_sar(_sum('fiscal_gravado_base'))
+            inv.isv_total = self._round_sar(inv.amount_isv15 + inv.amount_isv18)
 
-                # Verificar si la línea está exenta o exonerada
-                is_exempt = any(tax.tax_group_id.name == 'Exento' for tax in line.tax_ids)
-                is_exonerated = any(tax.tax_group_id.name == 'Exonerado' for tax in line.tax_ids)
-                
-                # Solo calcular ISV si no está exenta ni exonerada
-                if not is_exempt and not is_exonerated:
-                    # Calcular ISV según SAR (redondeo a 2 decimales)
-                    for tax in line.tax_ids:
-                        if tax.amount == 15:
-                            isv_line = self._round_sar(base_imponible * 0.15)
-                            isv15 += isv_line
-                            importe15 += base_imponible
-                        elif tax.amount == 18:
-                            isv_line = self._round_sar(base_imponible * 0.18)
-                            isv18 += isv_line
-                            importe18 += base_imponible
-
-            # Aplicar redondeo final según SAR
-            inv.amount_isv15 = self._round_sar(isv15)
-            inv.gravado_isv15 = self._round_sar(importe15)
-            inv.amount_isv18 = self._round_sar(isv18)
-            inv.gravado_isv18 = self._round_sar(importe18)
-    
-    @api.depends('invoice_line_ids.price_subtotal', 'invoice_line_ids.tax_ids', 'amount_discount', 'amount_exento', 'amount_exonerado')
-    def _compute_base_imponible(self):
-        """Calcular base imponible total - solo líneas gravadas"""
-        for inv in self:
-            base_imponible = 0.0
+    def _get_fiscal_line_totals(self):
+        """
+        {id_factura: {clase_fiscal: {campo: suma}}} de los importes fiscales por línea.
+        Las facturas guardadas se agregan con un solo SUM ... GROUP BY; las nuevas (onchange) desde la caché.
+        """
+        totals = {}
+        stored = self.filtered('id')
+        if stored:
+            groups = self.env['account.move.line'].sudo()._read_group(
+                [('move_id', 'in', stored.ids), ('display_type', 'in', FISCAL_INVOICE_LINE_TYPES)],
+                ['move_id', 'fiscal_class'],
+                ['%s:sum' % fname for fname in FISCAL_LINE_AMOUNT_FIELDS],
+            )
+            for move, fiscal_class, *sums in groups:
+                totals.setdefault(move.id, {})[fiscal_class] = dict(zip(FISCAL_LINE_AMOUNT_FIELDS,
+                                                                        (value or 0.0 for value in sums)))
+        for inv in self - stored:
             for line in inv.invoice_line_ids:
-                # Calcular el subtotal de la línea
-                subtotal_line = line.quantity * line.price_unit
-                
-                # Aplicar descuento si existe
-                if line.discount:
-                    discount_amount = (subtotal_line * line.discount) / 100
-                    total_line = subtotal_line - discount_amount
-                else:
-                    total_line = subtotal_line
-
-                # Verificar si la línea está exenta o exonerada
-                def _name(n):
-                    return (n or '').strip().lower()
-                is_exempt = any('exento' in _name(tax.tax_group_id.name) for tax in line.tax_ids)
-                is_exonerated = any('exonerado' in _name(tax.tax_group_id.name) for tax in line.tax_ids)
-                has_taxes = bool(line.tax_ids)
-                
-                # Solo incluir en base imponible si la línea tiene impuestos y NO está exenta ni exonerada
-                # Así evitamos sumar líneas sin impuestos (consideradas exentas a efectos de totales)
-                if has_taxes and not is_exempt and not is_exonerated:
-                    base_imponible += total_line
-                else:
-                    pass
-            
-            inv.base_imponible_total = self._round_sar(base_imponible)
-    
-    @api.depends('amount_isv15', 'amount_isv18')
-    def _compute_isv_total(self):
-        """Calcular ISV total"""
-        for inv in self:
-            inv.isv_total = self._round_sar(inv.amount_isv15 + inv.amount_isv18)
-    
+                values = totals.setdefault(inv.id, {}).setdefault(
+                    line.fiscal_class, dict.fromkeys(FISCAL_LINE_AMOUNT_FIELDS, 0.0))
+                for fname in FISCAL_LINE_AMOUNT_FIELDS:
+                    values[fname] += line[fname]
+        return totals
+
+    def _refresh_fiscal_facts(self):
+        """Recalcular hechos fiscales por línea y totales SAR con la clasificación vigente de impuestos"""
+        lines = self.invoice_line_ids
+        for fname in FISCAL_LINE_FACT_FIELDS:
+            self.env.add_to_compute(lines._fields[fname], lines)
+        for fname in FISCAL_TOTAL_FIELDS:
+            self.env.add_to_compute(self._fields[fname], self)
+
+    @api.model
+    def _recompute_fiscal_totals_sql(self, move_ids, refresh_lines=True, chunk_size=FISCAL_FACTS_CHUNK_SIZE,
+                                     progress=None):
+        """
+        Recalcular en SQL los totales SAR almacenados de `move_ids`, una sentencia
+        UPDATE ... FROM (SELECT ... GROUP BY move_id) por bloque. Con `refresh_lines` se recalculan
+        antes los hechos fiscales de las líneas (cambios de impuestos o del producto de descuento).
+        Registra el avance en el log y en la lista `progress` si se indica.
+        Devuelve el número de facturas cuyos totales cambiaron.
+        """
+        Line = self.env['account.move.line']
+        move_ids = list(move_ids)
+        self.env.flush_all()
+        changed = done = 0
+        start = time.time()
+        for index, chunk in enumerate(tools.split_every(chunk_size, move_ids), start=1):
+            chunk = list(chunk)
+            if refresh_lines:
+                Line._update_fiscal_facts_sql(chunk)
+            self.env.cr.execute("""
+                UPDATE account_move m
+                   SET amount_discount = t.amount_discount,
+                       amount_exento = t.amount_exento,
+                       amount_exonerado = t.amount_exonerado,
+                       amount_isv15 = t.amount_isv15,
+                       gravado_isv15 = t.gravado_isv15,
+                       amount_isv18 = t.amount_isv18,
+                       gravado_isv18 = t.gravado_isv18,
+                       base_imponible_total = t.base_imponible_total,
+                       isv_total = t.amount_isv15 + t.amount_isv18
+                  FROM (
+                        SELECT mv.id AS move_id,
+                               ROUND(COALESCE(SUM(l.fiscal_discount), 0)::numeric, 2) AS amount_discount,
+                               ROUND(COALESCE(SUM(l.fiscal_exento_base), 0)::numeric, 2) AS amount_exento,
+                               ROUND(COALESCE(SUM(l.fiscal_exonerado_base), 0)::numeric, 2) AS amount_exonerado,
+                               ROUND(COALESCE(SUM(l.fiscal_isv_amount) FILTER (WHERE l.fiscal_class = 'isv15'), 0)::numeric, 2)
+                                   AS amount_isv15,
+                               ROUND(COALESCE(SUM(l.fiscal_gravado_base) FILTER (WHERE l.fiscal_class = 'isv15'), 0)::numeric, 2)
+                                   AS gravado_isv15,
+                               ROUND(COALESCE(SUM(l.fiscal_isv_amount) FILTER (WHERE l.fiscal_class = 'isv18'), 0)::numeric, 2)
+                                   AS amount_isv18,
+                               ROUND(COALESCE(SUM(l.fiscal_gravado_base) FILTER (WHERE l.fiscal_class = 'isv18'), 0)::numeric, 2)
+                                   AS gravado_isv18,
+                               ROUND(COALESCE(SUM(l.fiscal_gravado_base), 0)::numeric, 2) AS base_imponible_total
+                          FROM unnest(%(move_ids)s::int[]) AS mv(id)
+                     LEFT JOIN account_move_line l ON l.move_id = mv.id AND l.display_type IN %(line_types)s
+                         GROUP BY mv.id
+                       ) t
+                 WHERE t.move_id = m.id
+                   AND (m.amount_discount, m.amount_exento, m.amount_exonerado, m.amount_isv15, m.gravado_isv15,
+                        m.amount_isv18, m.gravado_isv18, m.base_imponible_total, m.isv_total)
+                       IS DISTINCT FROM
+                       (t.amount_discount, t.amount_exento, t.amount_exonerado, t.amount_isv15, t.gravado_isv15,
+                        t.amount_isv18, t.gravado_isv18, t.base_imponible_total, t.amount_isv15 + t.amount_isv18)
+            """, {'move_ids': chunk, 'line_types': FISCAL_INVOICE_LINE_TYPES})
+            changed += self.env.cr.rowcount
+            done += len(chunk)
+            message = _('Bloque %s: %s/%s facturas, %s con totales corregidos (%.1fs)') % (
+                index, done, len(move_ids), changed, time.time() - start)
+            _logger.info(message)
+            if progress is not None:
+                progress.append(message)
+        self.invalidate_model(list(FISCAL_TOTAL_FIELDS))
+        return changed
+
+    def _verify_fiscal_totals(self):
+        """
+        Comparar los totales SAR almacenados con los que calcula el ORM, sin escribir nada.
+        Devuelve {id_factura: {campo: (almacenado, orm)}} solo con los campos que difieren.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("SELECT id, %s FROM account_move WHERE id = ANY(%%s)" % ', '.join(FISCAL_TOTAL_FIELDS),
+                            [self.ids])
+        stored = {row[0]: dict(zip(FISCAL_TOTAL_FIELDS, row[1:])) for row in self.env.cr.fetchall()}
+
+        with self.env.cr.savepoint() as savepoint:
+            self._refresh_fiscal_facts()
+            computed = {move.id: {fname: move[fname] for fname in FISCAL_TOTAL_FIELDS} for move in self}
+            self.env.flush_all()
+            savepoint.rollback()
+        self.env.invalidate_all()
+
+        differences = {}
+        for move_id, values in computed.items():
+            for fname, orm_value in values.items():
+                stored_value = stored.get(move_id, {}).get(fname) or 0.0
+                if tools.float_compare(stored_value, orm_value or 0.0, precision_digits=2):
+                    differences.setdefault(move_id, {})[fname] = (stored_value, orm_value)
+        return differences
+
+    def init(self):
+        super().init()
+        # Búsquedas de documentos fiscales por prefijo (name =like 'prefijo%') resueltas por índice
+        tools.create_index(self._cr, 'account_move_name_prefix_index', self._table,
+                           ['name text_pattern_ops'], where="name != '/'")
+
+    @api.depends('fiscal_date_range_id', 'cai_manual', 'fecha_limite_manual',
+                 'numero_inicial_manual', 'numero_final_manual')
+    def _compute_fiscal_range_info(self):
+        for move in self:
+            date_range = move.fiscal_date_range_id
+            move.cai = move.cai_manual or date_range.cai
+            move.fechaLimiteEmision = move.fecha_limite_manual or date_range.date_to
+            move.numeroInicial = move.numero_inicial_manual or date_range.numeroInicial
+            move.numeroFinal = move.numero_final_manual or date_range.numeroFinal
+
+    def _inverse_fiscal_range_info(self):
+        for move in self:
+            date_range = move.fiscal_date_range_id
+            # Solo se guarda lo que difiere del rango CAI del documento
+            move.cai_manual = move.cai if move.cai != date_range.cai else False
+            move.fecha_limite_manual = move.fechaLimiteEmision if move.fechaLimiteEmision != date_range.date_to else False
+            move.numero_inicial_manual = move.numeroInicial if move.numeroInicial != date_range.numeroInicial else False
+            move.numero_final_manual = move.numeroFinal if move.numeroFinal != date_range.numeroFinal else False
+
+    def _search_cai(self, operator, value):
+        if operator == '=' and not value:
+            return [('cai_manual', '=', False), ('fiscal_date_range_id.cai', '=', False)]
+        if operator == '!=' and not value:
+            return ['|', ('cai_manual', '!=', False), ('fiscal_date_range_id.cai', '!=', False)]
+        return ['|', ('cai_manual', operator, value),
+                '&', ('cai_manual', '=', False), ('fiscal_date_range_id.cai', operator, value)]
+
+    @api.depends('journal_id', 'invoice_user_id', 'invoice_line_ids.sale_line_ids')
+    def _compute_emission_point_id(self):
+        """Punto de emisión del almacén de la venta o, en su defecto, del usuario que factura"""
+        for move in self:
+            if move.state != 'draft' or not move.journal_id.document_fiscal:
+                move.emission_point_id = move.emission_point_id
+                continue
+            by_user, by_warehouse = self.env['kc_fiscal_hn.emission.point']._get_emission_point_map(
+                move.company_id.id)
+            warehouse = move.invoice_line_ids.sale_line_ids.order_id.warehouse_id[:1]
+            user = move.invoice_user_id or self.env.user
+            point_id = by_warehouse.get((move.journal_id.id, warehouse.id)) or by_user.get((move.journal_id.id, user.id))
+            move.emission_point_id = point_id or False
+
+    def _get_fiscal_sequence_config(self):
+        """
+        Configuración fiscal del movimiento: la del punto de emisión si lo tiene, si no la del diario.
+        Las notas de crédito de un punto sin secuencia de notas de crédito usan la del diario.
+        """
+        self.ensure_one()
+        config = self.journal_id._get_fiscal_sequence_config(self.move_type)
+        if config[0] and self.emission_point_id:
+            point_config = self.emission_point_id._get_fiscal_sequence_config(self.move_type)
+            if point_config[1] or self.move_type not in ('out_refund', 'in_refund'):
+                return point_config
+        return config
+
+    def _get_fiscal_sequence(self):
+        """Secuencia fiscal del movimiento según su punto de emisión o su diario"""
+        self.ensure_one()
+        sequence_id = self._get_fiscal_sequence_config()[1]
+        return self.env['ir.sequence'].browse(sequence_id) if sequence_id else False
+
     @api.depends('amount_total')
     def _compute_requires_fiscal_numbering(self):
         """Determinar si requiere numeración fiscal según SAR"""
@@ -297,8 +417,12 @@ class AccountMove(models.Model):
                 inv.requires_fiscal_numbering = False
     
     def _round_sar(self, amount):
-        """Redondeo según SAR de Honduras (redondeo matemático a 2 decimales)"""
-        return round(amount, 2)
+        """
+        Redondeo según SAR de Honduras: 2 decimales con la mitad hacia arriba, igual que ROUND de
+        PostgreSQL en el recálculo SQL. El round() de Python dejaba el centavo inferior en los empates
+        (round(2.675, 2) == 2.67); la migración 18.0.1.4.0 realinea los totales guardados.
+        """
+        return tools.float_round(amount, precision_digits=2)
     
     def _validate_fiscal_amounts(self):
         """Validar montos según requerimientos del SAR"""
@@ -379,6 +503,98 @@ class AccountMove(models.Model):
                     }
                 }
 
+    def _get_fiscal_post_blockers(self):
+        """
+        Verificación previa de publicación para un lote de movimientos en borrador.
+        Devuelve {move_id: [motivos]} solo para los movimientos que no obtendrían número fiscal
+        o que `_post` rechazaría. Usa las cachés de diario y rango, y el estado memorizado de
+        la secuencia: no toma bloqueos sobre secuencias, rangos ni contadores.
+        """
+        blockers = {}
+        moves = self.filtered(lambda m: m.state == 'draft' and not m.is_import)
+        if not moves:
+            return blockers
+
+        def block(move, message):
+            blockers.setdefault(move.id, []).append(message)
+
+        # Montos y RTN: campos almacenados, leídos en bloque por el prefetch
+        for move in moves:
+            try:
+                move._validate_fiscal_amounts()
+            except ValidationError as e:
+                block(move, str(e))
+            if move.move_type in ('out_invoice', 'out_refund') \
+                    and not move.partner_id.vat and move.partner_id.country_id.code == 'HN':
+                block(move, _('El cliente %s no tiene RTN') % move.partner_id.display_name)
+
+        # Secuencia fiscal: una consulta cacheada por (diario, tipo)
+        by_sequence = {}
+        for move in moves:
+            needs, sequence_id, is_fiscal, use_date_range = move._get_fiscal_sequence_config()
+            if not needs:
+                continue
+            if not sequence_id or not is_fiscal:
+                block(move, _('El diario %s no tiene una secuencia fiscal para este tipo de documento')
+                      % move.journal_id.display_name)
+            elif use_date_range:
+                by_sequence.setdefault(sequence_id, []).append(move)
+
+        # Rangos CAI: simular el consumo del lote en el orden en que se asignarían los números
+        for sequence_id, sequence_moves in by_sequence.items():
+            sequence = self.env['ir.sequence'].browse(sequence_id)
+            sequence_moves.sort(key=lambda m: (m.invoice_date or m.date, m.id))
+            remaining = {}
+            for move in sequence_moves:
+                date = move.invoice_date or move.date
+                snapshot = sequence.get_status_snapshot(date)
+                current_range = snapshot['current_range']
+                if not snapshot['valid'] or not current_range:
+                    if snapshot['next_range']:
+                        block(move, _('No hay CAI vigente para el %s: el siguiente rango inicia el %s')
+                              % (date, snapshot['next_range'].date_from))
+                    else:
+                        block(move, snapshot['message'] or _('Fecha límite de emisión vencida para el %s') % date)
+                    continue
+                candidates = current_range | sequence._get_rollover_ranges(current_range, date)
+                for date_range in candidates - self.env['ir.sequence.date_range'].browse(list(remaining)):
+                    remaining[date_range.id] = date_range.rangoFinal - date_range.number_next_actual + 1
+                date_range = next((r for r in candidates if remaining[r.id] > 0), None)
+                if date_range:
+                    remaining[date_range.id] -= 1
+                else:
+                    block(move, _('Rango CAI agotado: %s-%s') % (current_range.rangoInicial, current_range.rangoFinal))
+        return blockers
+
+    def action_check_fiscal_post(self):
+        """Informar qué movimientos del lote no podrían publicarse y por qué"""
+        blockers = self._get_fiscal_post_blockers()
+        if not blockers:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Lote Listo'),
+                    'message': _('Los %d movimientos pueden publicarse.') % len(self),
+                    'type': 'success',
+                }
+            }
+        names = dict((move.id, move.display_name) for move in self.browse(list(blockers)))
+        details = ['%s: %s' % (names[move_id], '; '.join(messages))
+                   for move_id, messages in list(blockers.items())[:10]]
+        if len(blockers) > 10:
+            details.append(_('... y %d más') % (len(blockers) - 10))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('%d de %d movimientos no pueden publicarse') % (len(blockers), len(self)),
+                'message': '\n'.join(details),
+                'type': 'warning',
+                'sticky': True,
+            }
+        }
+
     @api.depends("sale_order_count")
     def _get_saleorder(self):
         for move in self:
@@ -416,7 +632,7 @@ class AccountMove(models.Model):
                 continue
 
             # ✅ OBTENER SECUENCIA FISCAL APROPIADA
-            sequence = move.journal_id.get_fiscal_sequence(move.move_type)
+            sequence = move._get_fiscal_sequence()
             if not sequence:
                 if move.move_type == 'out_refund':
                     _logger.warning(
@@ -468,6 +684,9 @@ class AccountMove(models.Model):
         - Para secuencias fiscales (is_fiscal = True): Genera la secuencia fiscal SAR.
         - Para secuencias no fiscales: Se omite, ya que se manejan en _set_next_sequence.
         """
+        # Hechos fiscales por línea con la clasificación de impuestos vigente al publicar
+        self.filtered(lambda m: m.is_invoice(include_receipts=True))._refresh_fiscal_facts()
+
         # Validar facturas fiscales antes de publicar
         for move in self:
             if move.move_type in ['out_invoice', 'out_refund']:
@@ -495,6 +714,7 @@ class AccountMove(models.Model):
                     _logger.debug("Actualizado totalAmountString para factura %s (name: %s, amount_total: %s): %s", 
                                  move.id, move.name, move.amount_total, move.totalAmountString)
 
+        to_number_ids = []
         for move in self:
             if move.move_type == 'out_refund':
                 _logger.info(
@@ -516,7 +736,7 @@ class AccountMove(models.Model):
                 continue
 
             # ✅ OBTENER SECUENCIA FISCAL APROPIADA
-            sequence = move.journal_id.get_fiscal_sequence(move.move_type)
+            sequence = move._get_fiscal_sequence()
             if not sequence:
                 if move.move_type == 'out_refund':
                     _logger.warning(
@@ -584,86 +804,326 @@ class AccountMove(models.Model):
                 _logger.info("Omitiendo generación de secuencia fiscal para movimiento %s - es asiento de ajuste", move.id)
                 continue
 
-            # ✅ PROCESAR SECUENCIA FISCAL
+            to_number_ids.append(move.id)
+
+        # ✅ PROCESAR SECUENCIAS FISCALES EN BLOQUE
+        self.browse(to_number_ids)._assign_fiscal_numbers()
+
+        return posted
+
+    def _resolve_fiscal_range(self, sequence, date):
+        """
+        Resolver el rango de fecha activo de una secuencia fiscal para una fecha.
+        Devuelve el ir.sequence.date_range a usar o False si no se debe numerar.
+        """
+        # Estado memorizado de la secuencia: una sola pasada por secuencia y fecha
+        sequence_status = sequence.get_status_snapshot(date)
+
+        if not sequence_status['valid']:
+            # Solo log de error, sin bloquear operaciones
+            _logger.error("Error de validación fiscal para secuencia %s: %s", sequence.name, sequence_status['message'])
+            return False
+
+        # Obtener rango actual
+        current_range = sequence_status['current_range']
+        if not current_range:
+            # Buscar rango futuro
+            next_range = sequence_status['next_range']
+            if next_range:
+                _logger.warning("No hay rango para fecha %s, pero existe rango futuro desde %s", date, next_range.date_from)
+            else:
+                _logger.error("No hay rangos válidos para fecha %s ni futuros", date)
+            return False
+
+        # Verificar si el rango actual permite continuar
+        if not sequence_status['can_continue']:
+            # Verificar si hay subsecuencias futuras que permitan continuar
+            if sequence_status['future_ranges']:
+                _logger.warning("Rango actual agotado pero existen subsecuencias futuras disponibles para secuencia %s", sequence.name)
+                # Continuar con la operación
+            else:
+                _logger.error("Rango actual agotado y no hay subsecuencias futuras para secuencia %s", sequence.name)
+                return False
+
+        # Registrar advertencias si las hay
+        for warning in sequence_status.get('warnings') or []:
+            _logger.warning("Advertencia fiscal para secuencia %s: %s", sequence.name, warning)
+
+        return current_range
+
+    def _assign_fiscal_numbers(self):
+        """
+        Asignar números fiscales SAR en bloque.
+        Los movimientos se agrupan por (diario, tipo, secuencia, rango de fecha activo); cada grupo
+        resuelve y bloquea su rango una sola vez, toma un bloque contiguo de números y escribe
+        name y el rango CAI (fiscal_date_range_id) en bloque.
+        """
+        groups = {}
+        ranges = {}
+        deferred_ids = []
+        for move in self:
+            sequence = move._get_fiscal_sequence()
+            if sequence.fiscal_numbering_mode == 'deferred' and not self.env.context.get('fiscal_numbering_worker'):
+                deferred_ids.append(move.id)
+                continue
+            date_range = self.env['ir.sequence.date_range']
             if sequence.use_date_range:
                 date = move.invoice_date or move.date
-                
-                # Usar la nueva validación inteligente
-                sequence_status = sequence.validate_sequence_continuity(date)
-                
-                if not sequence_status['valid']:
-                    # Solo log de error, sin bloquear operaciones
-                    _logger.error("Error de validación fiscal para secuencia %s: %s", sequence.name, sequence_status['message'])
+                if (sequence.id, date) not in ranges:
+                    ranges[sequence.id, date] = self._resolve_fiscal_range(sequence, date)
+                date_range = ranges[sequence.id, date]
+                if not date_range:
                     continue
-                
-                # Obtener rango actual
-                current_range = sequence_status.get('current_range')
-                if not current_range:
-                    # Buscar rango futuro
-                    next_range = sequence.get_next_available_range(date)
-                    if next_range:
-                        _logger.warning("No hay rango para fecha %s, pero existe rango futuro desde %s", date, next_range.date_from)
-                        continue
-                    else:
-                        _logger.error("No hay rangos válidos para fecha %s ni futuros", date)
-                        continue
-                
-                # Verificar si el rango actual permite continuar
-                if not sequence_status['can_continue']:
-                    # Verificar si hay subsecuencias futuras que permitan continuar
-                    if sequence.has_valid_future_sequences(date):
-                        _logger.warning("Rango actual agotado pero existen subsecuencias futuras disponibles para secuencia %s", sequence.name)
-                        # Continuar con la operación
-                    else:
-                        _logger.error("Rango actual agotado y no hay subsecuencias futuras para secuencia %s", sequence.name)
-                        continue
-                
-                # Registrar advertencias si las hay
-                if sequence_status.get('warnings'):
-                    for warning in sequence_status['warnings']:
-                        _logger.warning("Advertencia fiscal para secuencia %s: %s", sequence.name, warning)
-                
-                # Verificar que el rango tenga números disponibles
-                if hasattr(current_range, 'rangoFinal') and current_range.rangoFinal:
-                    if current_range.number_next_actual > current_range.rangoFinal:
-                        # Verificar si hay subsecuencias futuras
-                        if sequence.has_valid_future_sequences(date):
-                            _logger.warning("Rango actual agotado pero existen subsecuencias futuras para secuencia %s", sequence.name)
-                            continue
-                        else:
-                            _logger.error("Rango agotado y no hay subsecuencias futuras para secuencia %s", sequence.name)
-                            continue
-                
-                # Asignar el número de secuencia fiscal
-                ctx = dict(self.env.context, ir_sequence_date=date.strftime('%Y-%m-%d'))
-                new_name = sequence.with_context(ctx).next_by_id()
-
-                # Preparar valores para escribir
-                vals_to_write = {
-                    'name': new_name,
-                    'cai': current_range.cai if hasattr(current_range, 'cai') else '',
-                    'fechaLimiteEmision': current_range.date_to if hasattr(current_range, 'date_to') else False,
-                }
-                
-                # Agregar rangos numéricos si existen
-                if hasattr(current_range, 'rangoInicial') and hasattr(current_range, 'rangoFinal'):
-                    if current_range.rangoInicial and current_range.rangoFinal:
-                        numeroinicial = str(current_range.rangoInicial).zfill(sequence.padding)
-                        numeroFinal = str(current_range.rangoFinal).zfill(sequence.padding)
-                        vals_to_write.update({
-                            'numeroInicial': f"{sequence.prefix or ''}{numeroinicial}",
-                            'numeroFinal': f"{sequence.prefix or ''}{numeroFinal}",
-                        })
-                
-                move.write(vals_to_write)
-                _logger.info("Número fiscal SAR '%s' asignado a factura %s", new_name, move.id)
-            else:
-                # Para secuencias fiscales sin rango de fecha
-                new_name = sequence.next_by_id(sequence_date=move.date)
-                move.write({'name': new_name})
-                _logger.info("Número de secuencia fiscal '%s' asignado a factura %s", new_name, move.id)
-        
-        return posted
+            key = (move.journal_id.id, move.move_type, sequence.id, date_range.id)
+            groups.setdefault(key, (sequence, date_range, []))[2].append(move.id)
+
+        # Las estadísticas de uso almacenadas las refresca el proceso programado, no la publicación
+        for sequence, date_range, move_ids in groups.values():
+            self.browse(move_ids)._assign_fiscal_numbers_group(sequence, date_range)
+
+        if deferred_ids:
+            self.browse(deferred_ids)._queue_fiscal_numbering()
+
+    def _queue_fiscal_numbering(self):
+        """
+        Encolar movimientos para numeración fiscal diferida.
+        El movimiento queda publicado con "/" y no toca el rango de la secuencia, por lo que
+        la transacción interactiva nunca espera el bloqueo del rango no_gap.
+        """
+        self.write({
+            'fiscal_number_pending': True,
+            'fiscal_queued_at': fields.Datetime.now(),
+        })
+        _logger.info("%d movimientos encolados para numeración fiscal diferida", len(self))
+        cron = self.env.ref('kc_fiscal_hn.ir_cron_fiscal_numbering_queue', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    @api.model
+    def _cron_assign_deferred_fiscal_numbers(self, batch_size=100, auto_commit=True):
+        """
+        Proceso único de numeración diferida: asigna los números SAR estrictamente en orden
+        de publicación, en transacciones cortas de `batch_size` movimientos.
+        Cuando un movimiento no puede numerarse, su secuencia queda detenida hasta la siguiente
+        ejecución: los movimientos posteriores de esa secuencia siguen en cola, de modo que
+        nunca reciben un número menor que uno encolado antes.
+        """
+        held_ids = []
+        blocked_sequence_ids = set()
+        while True:
+            # Cada lote toma el bloqueo consultivo de su transacción: nunca hay dos lotes en paralelo
+            self.env.cr.execute("SELECT pg_try_advisory_xact_lock(%s)", [FISCAL_NUMBERING_QUEUE_LOCK])
+            if not self.env.cr.fetchone()[0]:
+                _logger.info("Numeración fiscal diferida ya en ejecución en otro proceso")
+                return False
+            moves = self.search([
+                ('fiscal_number_pending', '=', True),
+                ('id', 'not in', held_ids),
+            ], order='fiscal_queued_at, id', limit=batch_size)
+            if not moves:
+                break
+            to_number = moves.filtered(lambda m: m.state == 'posted' and m.name == '/')
+            held = to_number.filtered(lambda m: m._get_fiscal_sequence_config()[1] in blocked_sequence_ids)
+            (to_number - held).with_context(fiscal_numbering_worker=True)._assign_fiscal_numbers()
+            # Los que siguen con "/" quedan en cola y detienen su secuencia hasta el siguiente ciclo
+            failed = (to_number - held).filtered(lambda m: m.name == '/')
+            if failed:
+                failed_sequences = self.env['ir.sequence'].browse(
+                    list({m._get_fiscal_sequence_config()[1] for m in failed} - {False}))
+                blocked_sequence_ids.update(failed_sequences.ids)
+                _logger.error("%d movimientos en cola no pudieron numerarse; la numeración de las secuencias %s "
+                              "se detiene hasta el siguiente ciclo",
+                              len(failed), ', '.join(failed_sequences.mapped('name')))
+            held |= failed
+            held_ids.extend(held.ids)
+            (moves - held).write({'fiscal_number_pending': False})
+            if auto_commit:
+                self.env.cr.commit()
+        return True
+
+    def _get_fiscal_post_group_key(self):
+        """Grupo de publicación independiente: la secuencia fiscal, o el diario si no la usa"""
+        self.ensure_one()
+        needs, sequence_id, is_fiscal, _use_date_range = self._get_fiscal_sequence_config()
+        if needs and sequence_id and is_fiscal and not self.is_import:
+            return ('sequence', sequence_id)
+        return ('journal', self.journal_id.id)
+
+    def _post_fiscal_groups_parallel(self, max_workers=PARALLEL_POST_MAX_WORKERS):
+        """
+        Publicar el lote repartido en grupos que no comparten bloqueos (una secuencia fiscal,
+        o un diario sin secuencia fiscal), con un máximo de `max_workers` hilos.
+        Cada grupo se publica y confirma en su propio cursor: un grupo que falla se revierte
+        sin afectar a los demás, y los grupos ya confirmados no se revierten aunque otro falle
+        o aunque la transacción que llama se revierta. Los borradores deben estar confirmados
+        en la base de datos antes de llamar a este método, ya que los hilos no ven la
+        transacción actual (en pruebas, registry.cursor() entrega cursores de prueba que los hilos
+        usan por turnos).
+        Devuelve un informe por grupo con los movimientos publicados, si el grupo quedó
+        confirmado ('committed'), el error y la duración.
+        """
+        groups = {}
+        for move in self.filtered(lambda m: m.state == 'draft'):
+            groups.setdefault(move._get_fiscal_post_group_key(), []).append(move.id)
+        if not groups:
+            return []
+
+        registry = self.env.registry
+        uid, context = self.env.uid, dict(self.env.context, skip_fiscal_warning=True)
+        dbname = self.env.cr.dbname
+
+        def post_group(key, move_ids):
+            threading.current_thread().dbname = dbname
+            result = {'key': key, 'move_ids': move_ids, 'posted': 0, 'committed': False, 'error': False}
+            start = time.monotonic()
+            try:
+                with registry.cursor() as cr:
+                    moves = api.Environment(cr, uid, context)['account.move'].browse(move_ids)
+                    moves.action_post()
+                    result['posted'] = len(moves.filtered(lambda m: m.state == 'posted'))
+                result['committed'] = True
+            except Exception as e:
+                _logger.exception("Error al publicar el grupo %s (%d movimientos)", key, len(move_ids))
+                result['error'] = str(e)
+            result['duration'] = time.monotonic() - start
+            return result
+
+        if len(groups) == 1:
+            # Un solo grupo no gana nada con hilos: se publica en la transacción actual
+            key, move_ids = next(iter(groups.items()))
+            start = time.monotonic()
+            moves = self.browse(move_ids)
+            moves.with_context(skip_fiscal_warning=True).action_post()
+            return [{'key': key, 'move_ids': move_ids, 'posted': len(moves.filtered(lambda m: m.state == 'posted')),
+                     'committed': False, 'error': False, 'duration': time.monotonic() - start}]
+
+        self.env.flush_all()
+        workers = max(1, min(max_workers, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fiscal_post') as executor:
+            futures = [executor.submit(post_group, key, move_ids) for key, move_ids in groups.items()]
+            report = [future.result() for future in futures]
+        # Los hilos confirmaron en sus propias transacciones
+        self.env.invalidate_all()
+
+        failed = [r for r in report if r['error']]
+        if failed and len(failed) < len(report):
+            _logger.warning("Publicación paralela confirmada parcialmente: %d de %d grupos confirmados, "
+                            "%d grupos revertidos", len(report) - len(failed), len(report), len(failed))
+        _logger.info("Publicación paralela: %d grupos, %d movimientos publicados, %d grupos con error",
+                     len(report), sum(r['posted'] for r in report), len(failed))
+        return report
+
+    def action_post_parallel(self):
+        """Publicar los movimientos seleccionados en paralelo por secuencia fiscal"""
+        report = self._post_fiscal_groups_parallel()
+        failed = [r for r in report if r['error']]
+        committed = [r for r in report if r['committed']]
+        lines = [_('%d movimientos publicados en %d grupos.') % (sum(r['posted'] for r in report), len(report))]
+        if failed and committed:
+            # Cada grupo confirmó por separado: los publicados no se revierten por los grupos con error
+            lines.append(_('Publicación parcial: %d grupos quedaron confirmados y %d grupos con error se '
+                           'revirtieron; vuelva a publicar solo los movimientos de los grupos con error.')
+                         % (len(committed), len(failed)))
+        lines += ['%s %s: %s' % (r['key'][0], r['key'][1], r['error']) for r in failed]
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Publicación Paralela'),
+                'message': '\n'.join(lines),
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            }
+        }
+
+    def _assign_fiscal_numbers_group(self, sequence, date_range):
+        """
+        Numerar un grupo de movimientos que comparten secuencia y rango de fecha.
+        Si el rango se agota a mitad del grupo, cada movimiento pendiente continúa en el
+        siguiente rango válido cuya vigencia incluye la fecha del documento, sin modificar las
+        fechas autorizadas de ningún rango; cada cambio de rango queda en la auditoría de la
+        secuencia. Los movimientos sin rango vigente para su fecha quedan sin número.
+        Los números se reparten en orden de (fecha del documento, id), sin importar el orden
+        del recordset recibido.
+        """
+        self = self.sorted(lambda m: (m.invoice_date or m.date, m.id))
+        if not date_range:
+            # Para secuencias fiscales sin rango de fecha
+            numbers = sequence._reserve_fiscal_block(len(self))
+            names = sequence._get_fiscal_names(numbers)
+            self._write_fiscal_names(names)
+            self.env['kc_fiscal_hn.fiscal.ledger']._record_moves(self, sequence, date_range, numbers)
+            _logger.info("Números de secuencia fiscal %s..%s asignados a %d facturas", names[0], names[-1], len(self))
+            return self
+
+        numbers = date_range._reserve_fiscal_block(len(self))
+        moves = self[:len(numbers)]._write_fiscal_range_numbers(sequence, date_range, numbers)
+        pending = self[len(numbers):]
+        if not pending:
+            return moves
+
+        # Rango agotado: continuar en los rangos válidos siguientes que cubren la fecha de cada documento
+        date = min(pending.mapped(lambda m: m.invoice_date or m.date))
+        for next_range in sequence._get_rollover_ranges(date_range, date):
+            eligible = pending.filtered(
+                lambda m: next_range.date_from <= (m.invoice_date or m.date) <= next_range.date_to)
+            if not eligible:
+                continue
+            next_numbers = next_range._reserve_fiscal_block(len(eligible))
+            if not next_numbers:
+                continue
+            rolled = eligible[:len(next_numbers)]
+            _logger.warning("Rango CAI %s agotado en la secuencia %s: %d facturas continúan en el rango CAI %s",
+                            date_range.cai, sequence.name, len(rolled), next_range.cai)
+            moves |= rolled._write_fiscal_range_numbers(sequence, next_range, next_numbers)
+            date_range._audit_fiscal_rollover(next_range, next_numbers)
+            pending -= rolled
+            if not pending:
+                return moves
+
+        _logger.error("Rango CAI %s agotado en la secuencia %s y no hay otro rango vigente para la fecha de "
+                      "%d movimientos; quedan sin número fiscal", date_range.cai, sequence.name, len(pending))
+        return moves
+
+    def _write_fiscal_range_numbers(self, sequence, date_range, numbers):
+        """Escribir nombre, CAI y rango autorizado de `date_range` con los números reservados, en bloque"""
+        if not numbers:
+            return self.browse()
+
+        # El prefijo se interpola una vez por fecha de documento, no por movimiento
+        numbers_by_date = {}
+        for move, number in zip(self, numbers):
+            date_move_ids, date_numbers = numbers_by_date.setdefault(move.invoice_date or move.date, ([], []))
+            date_move_ids.append(move.id)
+            date_numbers.append(number)
+        move_ids, move_numbers, names = [], [], []
+        for date, (date_move_ids, date_numbers) in numbers_by_date.items():
+            move_ids.extend(date_move_ids)
+            move_numbers.extend(date_numbers)
+            names.extend(sequence._get_fiscal_names(date_numbers, date=date, date_range=date_range.date_from))
+        moves = self.browse(move_ids)
+        moves._write_fiscal_names(names)
+        self.env['kc_fiscal_hn.fiscal.ledger']._record_moves(moves, sequence, date_range, move_numbers)
+
+        # CAI, fecha límite y rango autorizado se leen del rango: se escribe solo su id
+        moves.write({'fiscal_date_range_id': date_range.id})
+        _logger.info("Números fiscales SAR %d..%d (secuencia %s) asignados a %d facturas",
+                     numbers[0], numbers[-1], sequence.name, len(moves))
+        return moves
+
+    def _write_fiscal_names(self, names):
+        """Escribir los nombres fiscales de todos los movimientos en una sola sentencia"""
+        self.flush_recordset()
+        self.env.cr.execute("""
+            UPDATE account_move AS m
+               SET name = v.name
+              FROM unnest(%s::int[], %s::varchar[]) AS v(id, name)
+             WHERE m.id = v.id
+        """, [self.ids, names])
+        self.invalidate_recordset(['name'])
+        self.modified(['name'])
+        # El UPDATE directo se salta las restricciones del ORM sobre name
+        self._check_unique_sequence_number()
 
     def letra_cifra(self):
         for r in self:
@@ -767,12 +1227,12 @@ class AccountMove(models.Model):
                 if not move.journal_id.needs_fiscal_sequence(move.move_type):
                     continue
                     
-                sequence = move.journal_id.get_fiscal_sequence(move.move_type)
+                sequence = move._get_fiscal_sequence()
                 if sequence and sequence.is_fiscal and sequence.use_date_range:
                     date = move.invoice_date or move.date
                     
-                    # Usar la nueva validación inteligente
-                    sequence_status = sequence.validate_sequence_continuity(date)
+                    # Estado memorizado de la secuencia, compartido con _post
+                    sequence_status = sequence.get_status_snapshot(date)
                     
                     if not sequence_status['valid']:
                         # Solo log de error, sin bloquear operaciones
@@ -780,10 +1240,10 @@ class AccountMove(models.Model):
                         continue
                     
                     # Obtener rango actual
-                    current_range = sequence_status.get('current_range')
+                    current_range = sequence_status['current_range']
                     if not current_range:
                         # Buscar rango futuro
-                        next_range = sequence.get_next_available_range(date)
+                        next_range = sequence_status['next_range']
                         if next_range:
                             _logger.warning("No hay rango para fecha %s, pero existe rango futuro desde %s", date, next_range.date_from)
                             continue
@@ -794,7 +1254,7 @@ class AccountMove(models.Model):
                     # Verificar si el rango actual permite continuar
                     if not sequence_status['can_continue']:
                         # Verificar si hay subsecuencias futuras que permitan continuar
-                        if sequence.has_valid_future_sequences(date):
+                        if sequence_status['future_ranges']:
                             _logger.warning("Rango actual agotado pero existen subsecuencias futuras disponibles para secuencia %s", sequence.name)
                             # Continuar con la operación
                         else:
@@ -804,8 +1264,8 @@ class AccountMove(models.Model):
                     # LÓGICA INTELIGENTE: Siempre generar alertas, pero verificar subsecuencias futuras para determinar si bloquear
                     
                     # Días de advertencia
-                    if sequence.dias_alerta and hasattr(current_range, 'date_to') and current_range.date_to:
-                        fecha_limite = current_range.date_to
+                    if sequence.dias_alerta:
+                        fecha_limite = sequence_status['date_to']
                         fecha_actual = fields.Date.today()
                         dias_restantes = (fecha_limite - fecha_actual).days
                         _logger.info("Validación días: fecha límite %s, fecha actual %s, días restantes %d, alerta en %d", 
@@ -813,7 +1273,7 @@ class AccountMove(models.Model):
                         
                         if dias_restantes <= 0:
                             # VERIFICAR si hay subsecuencias futuras que cubran el rango de fechas
-                            future_ranges = sequence.get_available_future_ranges(date)
+                            future_ranges = sequence_status['future_ranges']
                             if future_ranges:
                                 # NO mostrar alerta - hay subsecuencias futuras, continuar transparentemente
                                 _logger.info("Fecha límite vencida (%s) pero existen %d subsecuencias futuras para secuencia %s - continuando sin alertas", 
@@ -840,16 +1300,16 @@ class AccountMove(models.Model):
                             }
                     
                     # Números de advertencia
-                    if sequence.numeros_alerta and hasattr(current_range, 'rangoInicial') and hasattr(current_range, 'rangoFinal'):
-                        if current_range.rangoInicial and current_range.rangoFinal:
-                            numeros_restantes = current_range.rangoFinal - current_range.number_next_actual + 1
+                    if sequence.numeros_alerta:
+                        if sequence_status['remaining_numbers'] is not None:
+                            numeros_restantes = sequence_status['remaining_numbers']
                             _logger.info("Validación números: rango %d-%d, actual %d, restantes %d, alerta en %d", 
                                        current_range.rangoInicial, current_range.rangoFinal, 
-                                       current_range.number_next_actual, numeros_restantes, sequence.numeros_alerta)
+                                       current_range.rangoFinal - numeros_restantes + 1, numeros_restantes, sequence.numeros_alerta)
                             
                             if numeros_restantes <= 0:
                                 # VERIFICAR si hay subsecuencias futuras que cubran el rango numérico
-                                future_ranges = sequence.get_available_future_ranges(date)
+                                future_ranges = sequence_status['future_ranges']
                                 if future_ranges:
                                     # NO mostrar alerta - hay subsecuencias futuras, continuar transparentemente
                                     _logger.info("Rango agotado (%d-%d) pero existen %d subsecuencias futuras para secuencia %s - continuando sin alertas", 
@@ -940,6 +1400,12 @@ class AccountMove(models.Model):
         _logger.info("Documento histórico creado: %s (ID: %s)", documento.name, documento.id)
         return documento
 
+    def button_cancel(self):
+        """Marcar como anulados en el libro fiscal los números de los documentos cancelados"""
+        res = super().button_cancel()
+        self.fiscal_ledger_ids.filtered(lambda l: not l.is_void).write({'is_void': True})
+        return res
+
     def copy(self, default=None):
         """
         Sobrescribir el método copy para manejar correctamente la duplicación de facturas fiscales.
@@ -955,10 +1421,7 @@ class AccountMove(models.Model):
                 default['name'] = "/"
                 
                 # Resetear campos fiscales relacionados
-                default['cai'] = False
-                default['fechaLimiteEmision'] = False
-                default['numeroInicial'] = False
-                default['numeroFinal'] = False
+                default['fiscal_date_range_id'] = False
                 default['totalAmountString'] = False
                 
                 # Resetear estado de validación fiscal
@@ -1,6 +1,23 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models, _
+import logging
+
+from odoo import api, fields, models, tools, _
+
+_logger = logging.getLogger(__name__)
+
+# Tipos de línea que forman parte de invoice_line_ids
+FISCAL_INVOICE_LINE_TYPES = ('product', 'line_section', 'line_note')
+
+# Importes fiscales por línea; los totales SAR de la cabecera los agregan con SUM ... GROUP BY
+FISCAL_LINE_AMOUNT_FIELDS = ('fiscal_discount', 'fiscal_isv_amount', 'fiscal_exento_base',
+                             'fiscal_exonerado_base', 'fiscal_gravado_base')
+FISCAL_LINE_FACT_FIELDS = ('fiscal_gross', 'fiscal_class') + FISCAL_LINE_AMOUNT_FIELDS
+
+# Facturas por sentencia al rellenar los hechos fiscales en SQL
+FISCAL_FACTS_CHUNK_SIZE = 5000
+
+ISV_RATES = {'isv15': 0.15, 'isv18': 0.18}
 
 
 class AccountMoveLine(models.Model):
@@ -8,6 +25,21 @@ class AccountMoveLine(models.Model):
 
     # Redefinir price_subtotal con 4 dígitos decimales
     price_subtotal = fields.Monetary(compute='_compute_totals', string='Subtotal', store=True, currency_field='currency_id', digits=(16, 4))
+
+    # Hechos fiscales por línea de factura (Float sin redondeo de moneda, igual que el cálculo por línea)
+    fiscal_gross = fields.Float(string='Bruto Fiscal', compute='_compute_fiscal_facts', store=True)
+    fiscal_discount = fields.Float(string='Descuento Fiscal', compute='_compute_fiscal_facts', store=True)
+    fiscal_class = fields.Selection([
+        ('exento', 'Exento'),
+        ('exonerado', 'Exonerado'),
+        ('isv15', 'ISV 15%'),
+        ('isv18', 'ISV 18%'),
+        ('otros', 'Otros'),
+    ], string='Clase Fiscal', compute='_compute_fiscal_facts', store=True)
+    fiscal_isv_amount = fields.Float(string='ISV Fiscal', compute='_compute_fiscal_facts', store=True)
+    fiscal_exento_base = fields.Float(string='Base Exenta', compute='_compute_fiscal_facts', store=True)
+    fiscal_exonerado_base = fields.Float(string='Base Exonerada', compute='_compute_fiscal_facts', store=True)
+    fiscal_gravado_base = fields.Float(string='Base Gravada', compute='_compute_fiscal_facts', store=True)
     
     # base_imponible = fields.Monetary(string='Base Imponible', compute='_compute_base_imponible', store=True, currency_field='currency_id')
     # porcentaje_retencion = fields.Float(string='Porcentaje Retención', compute='_compute_porcentaje_retencion', store=True)
@@ -40,6 +72,150 @@ class AccountMoveLine(models.Model):
     #         else:
     #             line.porcentaje_retencion = 0.0
 
+    @api.depends('display_type', 'quantity', 'price_unit', 'discount', 'price_subtotal',
+                 'product_id', 'tax_ids')
+    def _compute_fiscal_facts(self):
+        """
+        Bruto, descuento, clase fiscal, ISV y bases exenta/exonerada/gravada de cada línea de factura.
+        La clase de cada impuesto sale de account.tax._get_fiscal_class_map; _update_fiscal_facts_sql
+        aplica la misma regla en SQL. Cada línea tiene una sola clase: con ISV 15% y 18% a la vez cuenta
+        solo como 15% (antes se sumaba a ambos totales, lo que duplicaba su base gravada).
+        """
+        Tax = self.env['account.tax']
+        round_sar = self.env['account.move']._round_sar
+        for line in self:
+            if line.display_type not in FISCAL_INVOICE_LINE_TYPES:
+                line.update(dict(dict.fromkeys(FISCAL_LINE_AMOUNT_FIELDS, 0.0), fiscal_gross=0.0, fiscal_class=False))
+                continue
+
+            gross = line.quantity * line.price_unit
+            discount_line = (gross * line.discount) / 100 if line.discount else 0.0
+            net = gross - discount_line
+            if line.discount:
+                fiscal_discount = discount_line
+            elif line.product_id.product_tmpl_id.default_code == 'Desc':
+                fiscal_discount = abs(line.price_subtotal)
+            else:
+                fiscal_discount = 0.0
+
+            class_map = Tax._get_fiscal_class_map(line.company_id.id)
+            tax_classes = {class_map.get(tax_id, 'otros') for tax_id in line.tax_ids.ids}
+            # Líneas sin impuestos se tratan como exentas para efectos de totales SAR
+            is_exempt = not tax_classes or 'exento' in tax_classes
+            is_exonerated = 'exonerado' in tax_classes
+            if is_exempt:
+                fiscal_class = 'exento'
+            elif is_exonerated:
+                fiscal_class = 'exonerado'
+            elif 'isv15' in tax_classes:
+                fiscal_class = 'isv15'
+            elif 'isv18' in tax_classes:
+                fiscal_class = 'isv18'
+            else:
+                fiscal_class = 'otros'
+
+            rate = ISV_RATES.get(fiscal_class)
+            line.update({
+                'fiscal_gross': gross,
+                'fiscal_discount': fiscal_discount,
+                'fiscal_class': fiscal_class,
+                'fiscal_isv_amount': round_sar(net * rate) if rate else 0.0,
+                'fiscal_exento_base': net if is_exempt else 0.0,
+                'fiscal_exonerado_base': net if is_exonerated else 0.0,
+                'fiscal_gravado_base': net if not is_exempt and not is_exonerated else 0.0,
+            })
+
+    @api.model
+    def _update_fiscal_facts_sql(self, move_ids):
+        """
+        Recalcular en una sola sentencia SQL los hechos fiscales de las líneas de factura de `move_ids`,
+        con la misma regla que _compute_fiscal_facts. Devuelve el número de líneas actualizadas.
+        """
+        if not move_ids:
+            return 0
+        Tax = self.env['account.tax']
+        tax_classes = {}
+        for company in self.env['res.company'].sudo().search([]):
+            tax_classes.update(Tax._get_fiscal_class_map(company.id))
+        self.env.flush_all()
+
+        self.env.cr.execute("""
+            WITH tax_class AS (
+                SELECT * FROM unnest(%(tax_ids)s::int[], %(tax_classes)s::varchar[]) AS c(tax_id, fiscal_class)
+            ), line_tax AS (
+                SELECT rel.account_move_line_id AS line_id,
+                       bool_or(c.fiscal_class = 'exento') AS exento,
+                       bool_or(c.fiscal_class = 'exonerado') AS exonerado,
+                       bool_or(c.fiscal_class = 'isv15') AS isv15,
+                       bool_or(c.fiscal_class = 'isv18') AS isv18
+                  FROM account_move_line_account_tax_rel rel
+                  JOIN account_move_line l ON l.id = rel.account_move_line_id
+                  LEFT JOIN tax_class c ON c.tax_id = rel.account_tax_id
+                 WHERE l.move_id = ANY(%(move_ids)s)
+                 GROUP BY rel.account_move_line_id
+            ), line_base AS (
+                SELECT l.id,
+                       l.quantity * l.price_unit AS gross,
+                       l.quantity * l.price_unit - l.quantity * l.price_unit * COALESCE(l.discount, 0) / 100 AS net,
+                       CASE WHEN COALESCE(l.discount, 0) != 0 THEN l.quantity * l.price_unit * l.discount / 100
+                            WHEN pt.default_code = 'Desc' THEN ABS(COALESCE(l.price_subtotal, 0))
+                            ELSE 0 END AS discount,
+                       lt.line_id IS NULL OR COALESCE(lt.exento, FALSE) AS is_exempt,
+                       COALESCE(lt.exonerado, FALSE) AS is_exonerated,
+                       COALESCE(lt.isv15, FALSE) AS isv15,
+                       COALESCE(lt.isv18, FALSE) AS isv18
+                  FROM account_move_line l
+                  LEFT JOIN line_tax lt ON lt.line_id = l.id
+                  LEFT JOIN product_product pp ON pp.id = l.product_id
+                  LEFT JOIN product_template pt ON pt.id = pp.product_tmpl_id
+                 WHERE l.move_id = ANY(%(move_ids)s)
+                   AND l.display_type IN %(line_types)s
+            ), line_facts AS (
+                SELECT b.*,
+                       CASE WHEN b.is_exempt THEN 'exento'
+                            WHEN b.is_exonerated THEN 'exonerado'
+                            WHEN b.isv15 THEN 'isv15'
+                            WHEN b.isv18 THEN 'isv18'
+                            ELSE 'otros' END AS fiscal_class
+                  FROM line_base b
+            )
+            UPDATE account_move_line l
+               SET fiscal_gross = f.gross,
+                   fiscal_discount = f.discount,
+                   fiscal_class = f.fiscal_class,
+                   fiscal_isv_amount = CASE f.fiscal_class
+                                           WHEN 'isv15' THEN ROUND(f.net * 0.15, 2)
+                                           WHEN 'isv18' THEN ROUND(f.net * 0.18, 2)
+                                           ELSE 0 END,
+                   fiscal_exento_base = CASE WHEN f.is_exempt THEN f.net ELSE 0 END,
+                   fiscal_exonerado_base = CASE WHEN f.is_exonerated THEN f.net ELSE 0 END,
+                   fiscal_gravado_base = CASE WHEN NOT f.is_exempt AND NOT f.is_exonerated THEN f.net ELSE 0 END
+              FROM line_facts f
+             WHERE f.id = l.id
+        """, {
+            'tax_ids': list(tax_classes),
+            'tax_classes': list(tax_classes.values()),
+            'move_ids': list(move_ids),
+            'line_types': FISCAL_INVOICE_LINE_TYPES,
+        })
+        updated = self.env.cr.rowcount
+        self.invalidate_model(list(FISCAL_LINE_FACT_FIELDS))
+        return updated
+
+    @api.model
+    def _backfill_fiscal_facts(self, chunk_size=FISCAL_FACTS_CHUNK_SIZE):
+        """Rellenar en SQL los hechos fiscales de todas las líneas de factura, por bloques de facturas"""
+        self.env.cr.execute("""
+            SELECT DISTINCT move_id FROM account_move_line WHERE display_type IN %s ORDER BY move_id
+        """, [FISCAL_INVOICE_LINE_TYPES])
+        move_ids = [row[0] for row in self.env.cr.fetchall()]
+        updated = 0
+        for index, chunk in enumerate(tools.split_every(chunk_size, move_ids), start=1):
+            updated += self._update_fiscal_facts_sql(chunk)
+            _logger.info("Hechos fiscales por línea: bloque %d, %d/%d facturas, %d líneas",
+                         index, min(index * chunk_size, len(move_ids)), len(move_ids), updated)
+        return updated
+
     @api.onchange('product_id')
     def _onchange_product_id(self):
         if self.product_id:
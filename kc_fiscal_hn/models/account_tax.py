@@ -1,6 +1,20 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
+
+# Campos de account.tax que determinan su clase fiscal; al modificarlos se invalida el mapa cacheado
+TAX_FISCAL_CLASS_FIELDS = {'tipo_impuesto', 'codigo_sar', 'amount', 'amount_type', 'is_retention', 'retencion_tipo',
+                           'company_id', 'active'}
+# Clave de versión (kc_fiscal_hn.cache.version) del mapa de clases fiscales de impuestos
+TAX_FISCAL_CLASS_CACHE_KEY = 'tax_fiscal_class'
+
+# Código SAR -> clase fiscal (ver data/fiscal_data.xml)
+CODIGO_SAR_FISCAL_CLASS = {
+    '01': 'isv15',
+    '02': 'isv18',
+    '03': 'exento',
+    '04': 'exonerado',
+}
 
 
 class AccountTax(models.Model):
@@ -25,6 +39,64 @@ class AccountTax(models.Model):
     # Campo para identificar impuestos de retención
     is_retention = fields.Boolean(string='Es Retención', default=False,
                                      help='Indica si este impuesto es de retención')
+    retencion_tipo = fields.Selection([
+        ('isr', 'ISR'),
+        ('isv', 'ISV'),
+    ], string='Tipo de Retención', default='isv',
+        help='Impuesto retenido; clasifica el impuesto en el reporte de retenciones SAR')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        taxes = super().create(vals_list)
+        self.env['kc_fiscal_hn.cache.version']._bump([TAX_FISCAL_CLASS_CACHE_KEY])
+        return taxes
+
+    def write(self, vals):
+        result = super().write(vals)
+        if TAX_FISCAL_CLASS_FIELDS.intersection(vals):
+            self.env['kc_fiscal_hn.cache.version']._bump([TAX_FISCAL_CLASS_CACHE_KEY])
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['kc_fiscal_hn.cache.version']._bump([TAX_FISCAL_CLASS_CACHE_KEY])
+        return result
+
+    def _get_fiscal_class(self):
+        """
+        Clase fiscal del impuesto: isv15, isv18, exento, exonerado, retencion_isr, retencion_isv u otros.
+        Depende solo de tipo_impuesto, codigo_sar y el monto; el nombre del impuesto o de su grupo no interviene.
+        """
+        self.ensure_one()
+        if self.tipo_impuesto == 'retencion' or self.is_retention:
+            return 'retencion_isr' if self.retencion_tipo == 'isr' else 'retencion_isv'
+        if self.tipo_impuesto in ('exento', 'exonerado'):
+            return self.tipo_impuesto
+        if self.tipo_impuesto == 'isv':
+            fiscal_class = CODIGO_SAR_FISCAL_CLASS.get((self.codigo_sar or '').strip())
+            if fiscal_class in ('isv15', 'isv18'):
+                return fiscal_class
+            if self.amount_type == 'percent' and self.amount == 15:
+                return 'isv15'
+            if self.amount_type == 'percent' and self.amount == 18:
+                return 'isv18'
+        return 'otros'
+
+    @api.model
+    def _get_fiscal_class_map(self, company_id):
+        """
+        {id_impuesto: clase fiscal} de la compañía (incluye los impuestos heredados de la matriz).
+        Se memoriza por versión, que cambia al crear o eliminar impuestos o al modificar los
+        campos que determinan su clase fiscal.
+        """
+        version = self.env['kc_fiscal_hn.cache.version']._get_version(TAX_FISCAL_CLASS_CACHE_KEY)
+        return self._get_fiscal_class_map_cached(company_id, version)
+
+    @api.model
+    @tools.ormcache('company_id', 'version')
+    def _get_fiscal_class_map_cached(self, company_id, version):
+        taxes = self.sudo().with_context(active_test=False).search([('company_id', 'parent_of', company_id)])
+        return {tax.id: tax._get_fiscal_class() for tax in taxes}
     
     @api.model
     def _get_fiscal_taxes(self, tax_type=None):
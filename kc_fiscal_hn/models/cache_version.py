@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+
+class CacheVersion(models.Model):
+    """
+    Versión de los datos que el módulo memoriza con ormcache, por clave.
+    Los métodos memorizados incluyen la versión en su clave: un cambio relevante toma un
+    valor nuevo de la secuencia y solo deja obsoletas las entradas de esa clave, en todos
+    los procesos, sin vaciar las cachés del registro. Como los valores salen de una secuencia
+    de PostgreSQL, la versión de una transacción revertida nunca se reutiliza.
+    """
+    _name = 'kc_fiscal_hn.cache.version'
+    _description = 'Versión de Caché Fiscal'
+    _log_access = False
+
+    name = fields.Char(string='Clave', required=True, readonly=True)
+    version = fields.Integer(string='Versión', required=True, readonly=True, default=0)
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'Solo puede existir una versión por clave.'),
+    ]
+
+    def init(self):
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS kc_fiscal_hn_cache_version_seq")
+
+    def _get_transaction_versions(self):
+        """Versiones ya leídas en la transacción actual; se descartan al confirmar o revertir"""
+        return self.env.cr.precommit.data.setdefault('kc_fiscal_hn.cache.version', {})
+
+    @api.model
+    def _get_version(self, key):
+        """Versión vigente de `key` (0 si nunca se ha invalidado), leída una vez por transacción"""
+        versions = self._get_transaction_versions()
+        if key not in versions:
+            self.env.cr.execute("SELECT version FROM kc_fiscal_hn_cache_version WHERE name = %s", [key])
+            row = self.env.cr.fetchone()
+            versions[key] = row[0] if row else 0
+        return versions[key]
+
+    @api.model
+    def _bump(self, keys):
+        """Dar una versión nueva a `keys`, dejando obsoletas sus entradas memorizadas"""
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        self.env.cr.execute("""
+            INSERT INTO kc_fiscal_hn_cache_version (name, version)
+            SELECT key, nextval('kc_fiscal_hn_cache_version_seq')
+              FROM unnest(%s::varchar[]) AS key
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version
+         RETURNING name, version
+        """, [keys])
+        self._get_transaction_versions().update(self.env.cr.fetchall())
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+
+from .account_journal import FISCAL_SEQUENCE_CONFIG_CACHE_KEY
+
+_logger = logging.getLogger(__name__)
+
+# Campos del punto de emisión que cambian la asignación (diario, usuario/almacén) → punto
+EMISSION_POINT_MAP_FIELDS = {'active', 'company_id', 'journal_ids', 'user_ids', 'warehouse_ids', 'sequence'}
+# Campos del punto de emisión que cambian la resolución de la secuencia fiscal
+EMISSION_POINT_SEQUENCE_FIELDS = {'sequence_id', 'refund_sequence_id'}
+# Clave de versión (kc_fiscal_hn.cache.version) de la asignación de puntos de emisión
+EMISSION_POINT_MAP_CACHE_KEY = 'emission_point_map'
+
+
+class EmissionPoint(models.Model):
+    _name = 'kc_fiscal_hn.emission.point'
+    _description = 'Punto de Emisión SAR'
+    _order = 'sequence, establishment, point'
+
+    name = fields.Char(string='Nombre', required=True)
+    sequence = fields.Integer(string='Secuencia', default=10)
+    active = fields.Boolean(string='Activo', default=True)
+    establishment = fields.Char(string='Establecimiento', size=3, required=True, default='000')
+    point = fields.Char(string='Punto de Emisión', size=3, required=True, default='001')
+    code = fields.Char(string='Código', compute='_compute_code', store=True)
+    company_id = fields.Many2one('res.company', string='Compañía', required=True,
+                                 default=lambda self: self.env.company)
+    journal_ids = fields.Many2many('account.journal', string='Diarios', check_company=True,
+                                   domain="[('document_fiscal', '!=', False), ('company_id', '=', company_id)]",
+                                   help='Diarios fiscales cuyos documentos se numeran con este punto de emisión')
+    sequence_id = fields.Many2one('ir.sequence', string='Secuencia de Facturas', check_company=True,
+                                  domain="[('is_fiscal', '=', True), ('company_id', '=', company_id)]")
+    refund_sequence_id = fields.Many2one('ir.sequence', string='Secuencia de Notas de Crédito', check_company=True,
+                                         domain="[('is_fiscal', '=', True), ('company_id', '=', company_id)]")
+    user_ids = fields.Many2many('res.users', string='Usuarios',
+                                help='Usuarios que emiten desde este punto')
+    warehouse_ids = fields.Many2many('stock.warehouse', string='Almacenes', check_company=True,
+                                     help='Almacenes cuyas ventas se facturan desde este punto')
+
+    _sql_constraints = [
+        ('code_company_unique', 'unique(company_id, establishment, point)',
+         'Ya existe un punto de emisión con este establecimiento y punto en la compañía.'),
+    ]
+
+    @api.depends('establishment', 'point')
+    def _compute_code(self):
+        for emission_point in self:
+            emission_point.code = '%s-%s' % (emission_point.establishment or '', emission_point.point or '')
+
+    @api.constrains('establishment', 'point', 'sequence_id', 'refund_sequence_id')
+    def _check_sequences(self):
+        for emission_point in self:
+            if not (emission_point.establishment or '').isdigit() or not (emission_point.point or '').isdigit():
+                raise ValidationError(_('El establecimiento y el punto de emisión deben ser numéricos de 3 dígitos'))
+            sequences = emission_point.sequence_id | emission_point.refund_sequence_id
+            for sequence in sequences:
+                if not (sequence.prefix or '').startswith(emission_point.code + '-'):
+                    raise ValidationError(_('El prefijo de la secuencia %s debe iniciar con %s-')
+                                          % (sequence.display_name, emission_point.code))
+            other = self.search([('id', '!=', emission_point.id), '|',
+                                 ('sequence_id', 'in', sequences.ids), ('refund_sequence_id', 'in', sequences.ids)],
+                                limit=1)
+            if other:
+                raise ValidationError(_('La secuencia ya está asignada al punto de emisión %s') % other.display_name)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        points = super().create(vals_list)
+        self.env['kc_fiscal_hn.cache.version']._bump([EMISSION_POINT_MAP_CACHE_KEY])
+        return points
+
+    def write(self, vals):
+        result = super().write(vals)
+        keys = []
+        if EMISSION_POINT_MAP_FIELDS.intersection(vals):
+            keys.append(EMISSION_POINT_MAP_CACHE_KEY)
+        if EMISSION_POINT_SEQUENCE_FIELDS.intersection(vals):
+            keys.append(FISCAL_SEQUENCE_CONFIG_CACHE_KEY)
+        self.env['kc_fiscal_hn.cache.version']._bump(keys)
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['kc_fiscal_hn.cache.version']._bump([EMISSION_POINT_MAP_CACHE_KEY])
+        return result
+
+    @api.model
+    def _get_emission_point_map(self, company_id):
+        """
+        Asignación de la compañía: ({(diario, usuario): punto}, {(diario, almacén): punto}).
+        Se memoriza por versión, que cambia al crear, eliminar o reasignar puntos de emisión.
+        """
+        version = self.env['kc_fiscal_hn.cache.version']._get_version(EMISSION_POINT_MAP_CACHE_KEY)
+        return self._get_emission_point_map_cached(company_id, version)
+
+    @api.model
+    @tools.ormcache('company_id', 'version')
+    def _get_emission_point_map_cached(self, company_id, version):
+        by_user, by_warehouse = {}, {}
+        points = self.sudo().search([('company_id', '=', company_id)], order='sequence desc, id desc')
+        for emission_point in points:
+            for journal_id in emission_point.journal_ids.ids:
+                by_user.update(((journal_id, user_id), emission_point.id) for user_id in emission_point.user_ids.ids)
+                by_warehouse.update(((journal_id, warehouse_id), emission_point.id)
+                                    for warehouse_id in emission_point.warehouse_ids.ids)
+        return by_user, by_warehouse
+
+    def _get_fiscal_sequence_config(self, move_type):
+        """Igual que en el diario: (necesita_fiscal, id_secuencia, es_fiscal, usa_rango_fecha)"""
+        version = self.env['kc_fiscal_hn.cache.version']._get_version(FISCAL_SEQUENCE_CONFIG_CACHE_KEY)
+        return self._get_fiscal_sequence_config_cached(move_type, version)
+
+    @tools.ormcache('self.id', 'move_type', 'version')
+    def _get_fiscal_sequence_config_cached(self, move_type, version):
+        emission_point = self.sudo()
+        if move_type in ('out_refund', 'in_refund'):
+            # Las notas de crédito nunca consumen la secuencia (ni el CAI) de facturas del punto
+            sequence = emission_point.refund_sequence_id
+        else:
+            sequence = emission_point.sequence_id
+        if not sequence:
+            return (True, False, False, False)
+        return (True, sequence.id, sequence.is_fiscal, sequence.use_date_range)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+_logger = logging.getLogger(__name__)
+
+
+class FiscalLease(models.Model):
+    _name = 'kc_fiscal_hn.fiscal.lease'
+    _description = 'Bloque de Números Fiscales para Emisor Móvil'
+    _order = 'lease_date desc, id desc'
+
+    name = fields.Char(string='Referencia', compute='_compute_name')
+    sequence_id = fields.Many2one('ir.sequence', string='Secuencia', required=True, readonly=True,
+                                  index=True, ondelete='restrict')
+    date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango de Fecha', required=True,
+                                    readonly=True, ondelete='restrict')
+    cai = fields.Char(string='CAI', readonly=True)
+    number_from = fields.Integer(string='Desde', readonly=True)
+    number_to = fields.Integer(string='Hasta', readonly=True)
+    device = fields.Char(string='Dispositivo / Emisor', readonly=True)
+    user_id = fields.Many2one('res.users', string='Usuario', readonly=True, default=lambda self: self.env.user)
+    lease_date = fields.Datetime(string='Fecha de Entrega', readonly=True, default=fields.Datetime.now)
+    expires_at = fields.Datetime(string='Vence', required=True, readonly=True, index=True)
+    state = fields.Selection([
+        ('active', 'Activo'),
+        ('closed', 'Cerrado'),
+        ('expired', 'Vencido'),
+    ], string='Estado', default='active', readonly=True, index=True)
+    ledger_ids = fields.One2many('kc_fiscal_hn.fiscal.ledger', 'lease_id', string='Números Registrados', readonly=True)
+    used_count = fields.Integer(string='Usados', compute='_compute_counts')
+    void_count = fields.Integer(string='Anulados', compute='_compute_counts')
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True,
+                                 default=lambda self: self.env.company)
+
+    @api.depends('sequence_id', 'number_from', 'number_to')
+    def _compute_name(self):
+        for lease in self:
+            lease.name = '%s %d-%d' % (lease.sequence_id.prefix or '', lease.number_from, lease.number_to)
+
+    @api.depends('ledger_ids.is_void')
+    def _compute_counts(self):
+        for lease in self:
+            lease.void_count = len(lease.ledger_ids.filtered('is_void'))
+            lease.used_count = len(lease.ledger_ids) - lease.void_count
+
+    def _get_lease_info(self):
+        """Datos que el dispositivo necesita para emitir sin conexión"""
+        self.ensure_one()
+        sequence = self.sequence_id
+        return {
+            'lease_id': self.id,
+            'cai': self.cai,
+            'prefix': sequence.prefix or '',
+            'padding': sequence.padding,
+            'number_from': self.number_from,
+            'number_to': self.number_to,
+            'first_name': sequence._get_fiscal_names([self.number_from], date_range=self.date_range_id.date_from)[0],
+            'last_name': sequence._get_fiscal_names([self.number_to], date_range=self.date_range_id.date_from)[0],
+            'numeroInicial': self.date_range_id.numeroInicial,
+            'numeroFinal': self.date_range_id.numeroFinal,
+            'fechaLimiteEmision': self.date_range_id.date_to,
+            'expires_at': self.expires_at,
+        }
+
+    def register_usage(self, numbers, names=None):
+        """
+        Registrar en el libro fiscal los números que el dispositivo emitió.
+        `names` es opcional y, si se indica, va alineado con `numbers`.
+        """
+        self.ensure_one()
+        self._check_lease_manager()
+        if self.state != 'active':
+            raise UserError(_('El bloque %s ya no está activo.') % self.name)
+        outside = [number for number in numbers if not self.number_from <= number <= self.number_to]
+        if outside:
+            raise UserError(_('Los números %s no pertenecen al bloque %s.') % (outside, self.name))
+        recorded = set(self.ledger_ids.mapped('number'))
+        names = names or self.sequence_id._get_fiscal_names(numbers, date_range=self.date_range_id.date_from)
+        self.env['kc_fiscal_hn.fiscal.ledger'].sudo().create([
+            self._prepare_ledger_vals(number, name)
+            for number, name in zip(numbers, names) if number not in recorded
+        ])
+        return True
+
+    def action_close(self):
+        """Cerrar el bloque: los números no usados se registran como anulados"""
+        self._check_lease_manager()
+        self._void_unused_numbers()
+        self.sudo().write({'state': 'closed'})
+        return True
+
+    @api.model
+    def _cron_expire_fiscal_leases(self):
+        """Vencer los bloques cuyo plazo terminó y anular sus números no usados"""
+        leases = self.search([('state', '=', 'active'), ('expires_at', '<=', fields.Datetime.now())])
+        leases._void_unused_numbers()
+        leases.write({'state': 'expired'})
+        if leases:
+            _logger.info("Bloques de números fiscales vencidos: %d", len(leases))
+        return leases
+
+    def _void_unused_numbers(self):
+        """Registrar como anulados, en una sola sentencia, los números del bloque que no se usaron"""
+        if not self:
+            return
+        self.env.flush_all()
+        today = fields.Date.context_today(self)
+        for lease in self:
+            prefix, suffix = lease.sequence_id._get_prefix_suffix(date_range=lease.date_range_id.date_from)
+            self.env.cr.execute("""
+                INSERT INTO kc_fiscal_hn_fiscal_ledger
+                       (sequence_id, date_range_id, cai, number, name, document_date,
+                        lease_id, allocated_at, user_id, company_id, is_void)
+                SELECT %(sequence)s, %(date_range)s, %(cai)s, n.number,
+                       %(prefix)s || LPAD(n.number::text, GREATEST(%(padding)s, length(n.number::text)), '0') || %(suffix)s,
+                       %(today)s, %(lease)s, now() at time zone 'UTC', %(uid)s, %(company)s, TRUE
+                  FROM generate_series(%(number_from)s, %(number_to)s) AS n(number)
+                 WHERE NOT EXISTS (
+                       SELECT 1 FROM kc_fiscal_hn_fiscal_ledger l
+                        WHERE l.lease_id = %(lease)s AND l.number = n.number
+                 )
+            """, {
+                'sequence': lease.sequence_id.id,
+                'date_range': lease.date_range_id.id,
+                'cai': lease.cai,
+                'prefix': prefix,
+                'suffix': suffix,
+                'padding': lease.sequence_id.padding,
+                'today': today,
+                'lease': lease.id,
+                'uid': self.env.uid,
+                'company': lease.company_id.id,
+                'number_from': lease.number_from,
+                'number_to': lease.number_to,
+            })
+        self.env['kc_fiscal_hn.fiscal.ledger'].invalidate_model()
+        self.invalidate_recordset(['ledger_ids'])
+
+    def _check_lease_manager(self):
+        """El libro fiscal se escribe con sudo(): solo los administradores contables operan los bloques"""
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise ValidationError(_('Solo los administradores contables pueden registrar números de un bloque fiscal'))
+
+    def _prepare_ledger_vals(self, number, name):
+        return {
+            'sequence_id': self.sequence_id.id,
+            'date_range_id': self.date_range_id.id,
+            'cai': self.cai,
+            'number': number,
+            'name': name,
+            'document_date': fields.Date.context_today(self),
+            'lease_id': self.id,
+            'company_id': self.company_id.id,
+        }
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+
+
+class FiscalLedger(models.Model):
+    _name = 'kc_fiscal_hn.fiscal.ledger'
+    _description = 'Libro de Números Fiscales Consumidos'
+    _order = 'allocated_at desc, id desc'
+    _log_access = False
+
+    sequence_id = fields.Many2one('ir.sequence', string='Secuencia', required=True, readonly=True,
+                                  index=True, ondelete='restrict')
+    date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango de Fecha', readonly=True,
+                                    ondelete='restrict')
+    cai = fields.Char(string='CAI', readonly=True)
+    number = fields.Integer(string='Número', readonly=True)
+    name = fields.Char(string='Número Fiscal', readonly=True, index=True)
+    document_date = fields.Date(string='Fecha del Documento', readonly=True)
+    move_id = fields.Many2one('account.move', string='Movimiento', readonly=True, index='btree_not_null',
+                              ondelete='set null')
+    picking_id = fields.Many2one('stock.picking', string='Guía de Remisión', readonly=True,
+                                 index='btree_not_null', ondelete='set null')
+    lease_id = fields.Many2one('kc_fiscal_hn.fiscal.lease', string='Bloque de Emisor Móvil', readonly=True,
+                               index='btree_not_null', ondelete='restrict')
+    allocated_at = fields.Datetime(string='Fecha de Asignación', readonly=True, default=fields.Datetime.now)
+    user_id = fields.Many2one('res.users', string='Usuario', readonly=True, default=lambda self: self.env.user)
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True,
+                                 default=lambda self: self.env.company)
+    is_void = fields.Boolean(string='Anulado', readonly=True, default=False)
+
+    def init(self):
+        # Última fecha de uso por secuencia y búsqueda de números por rango: ambas por índice
+        tools.create_index(self._cr, 'kc_fiscal_hn_fiscal_ledger_sequence_date_index',
+                           self._table, ['sequence_id', 'document_date DESC'])
+        tools.create_index(self._cr, 'kc_fiscal_hn_fiscal_ledger_range_number_index',
+                           self._table, ['date_range_id', 'number'])
+        # Libro vigente para las verificaciones de rangos: omite los registros anulados que una
+        # corrección posterior reemplazó (mismo movimiento y número, anexado después)
+        self._cr.execute("""
+            CREATE OR REPLACE VIEW kc_fiscal_hn_fiscal_ledger_current AS
+            SELECT l.id, l.date_range_id, l.number, l.move_id, l.is_void
+              FROM kc_fiscal_hn_fiscal_ledger l
+             WHERE NOT (l.is_void AND EXISTS (
+                       SELECT 1 FROM kc_fiscal_hn_fiscal_ledger n
+                        WHERE n.move_id = l.move_id AND n.number = l.number
+                          AND n.id > l.id AND NOT n.is_void))
+        """)
+
+    def write(self, vals):
+        """El libro es de solo anexado: únicamente se permite marcar números como anulados"""
+        if set(vals) - {'is_void'}:
+            raise UserError(_('El libro de números fiscales no se puede modificar; solo se pueden anular números.'))
+        return super().write(vals)
+
+    def unlink(self):
+        raise UserError(_('No se pueden eliminar registros del libro de números fiscales.'))
+
+    @api.model
+    def _record_moves(self, moves, sequence, date_range, numbers):
+        """Registrar los números asignados a `moves` (en el mismo orden que `numbers`)"""
+        return self.sudo().create([{
+            'sequence_id': sequence.id,
+            'date_range_id': date_range.id,
+            'cai': date_range.cai,
+            'number': number,
+            'name': move.name,
+            'document_date': move.invoice_date or move.date,
+            'move_id': move.id,
+            'company_id': move.company_id.id,
+        } for move, number in zip(moves, numbers)])
+
+    @api.model
+    def _record_void_numbers(self, sequence, date_range, numbers):
+        """Registrar como anulados números reservados que no llegaron a ningún documento"""
+        names = sequence._get_fiscal_names(numbers, date=date_range.date_from, date_range=date_range.date_from)
+        return self.sudo().create([{
+            'sequence_id': sequence.id,
+            'date_range_id': date_range.id,
+            'cai': date_range.cai,
+            'number': number,
+            'name': name,
+            'company_id': sequence.company_id.id or self.env.company.id,
+            'is_void': True,
+        } for number, name in zip(numbers, names)])
+
+    @api.model
+    def _record_pickings(self, pickings, sequence, date_range, numbers):
+        """Registrar los números SAR asignados a `pickings` (en el mismo orden que `numbers`)"""
+        today = fields.Date.today()
+        return self.sudo().create([{
+            'sequence_id': sequence.id,
+            'date_range_id': date_range.id,
+            'cai': date_range.cai,
+            'number': number,
+            'name': picking.sar_name,
+            'document_date': picking.date_done or today,
+            'picking_id': picking.id,
+            'company_id': picking.company_id.id,
+        } for picking, number in zip(pickings, numbers)])
+
+    @api.model
+    def _backfill_from_moves(self):
+        """
+        Cargar en el libro los movimientos fiscales publicados antes de que existiera.
+        Una sola sentencia INSERT ... SELECT; los movimientos ya registrados se omiten.
+        Si los rangos de la secuencia se solapan en la fecha del documento, el movimiento se
+        asigna una sola vez, al rango que empieza más tarde.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            INSERT INTO kc_fiscal_hn_fiscal_ledger
+                   (sequence_id, date_range_id, cai, number, name, document_date,
+                    move_id, allocated_at, company_id, is_void)
+            SELECT DISTINCT ON (m.id)
+                   seq.id, dr.id, COALESCE(m.cai_manual, dr.cai),
+                   substring(m.name from '(\\d+)\\D*$')::bigint,
+                   m.name, COALESCE(m.invoice_date, m.date), m.id,
+                   COALESCE(m.write_date, m.create_date), m.company_id, m.state = 'cancel'
+              FROM account_move m
+              JOIN account_journal j ON j.id = m.journal_id
+              JOIN ir_sequence seq
+                ON seq.id = CASE WHEN m.move_type IN ('out_refund', 'in_refund') AND j.refund_sequence_id IS NOT NULL
+                                 THEN j.refund_sequence_id ELSE j.sequence_id END
+         LEFT JOIN ir_sequence_date_range dr
+                ON dr.sequence_id = seq.id
+               AND COALESCE(m.invoice_date, m.date) BETWEEN dr.date_from AND dr.date_to
+             WHERE seq.is_fiscal
+               AND j.document_fiscal IS NOT NULL
+               AND m.state IN ('posted', 'cancel')
+               AND m.name IS NOT NULL AND m.name != '/'
+               AND m.name ~ '\\d'
+               AND NOT EXISTS (SELECT 1 FROM kc_fiscal_hn_fiscal_ledger l WHERE l.move_id = m.id)
+          ORDER BY m.id, dr.date_from DESC NULLS LAST
+        """)
+        return self.env.cr.rowcount
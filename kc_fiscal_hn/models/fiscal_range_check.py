@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+# Máximo de intervalos que se guardan en texto por verificación; los totales siempre son exactos
+MAX_REPORTED_INTERVALS = 200
+
+
+def _format_intervals(intervals):
+    """Convertir [(1, 3), (7, 7)] en '1-3, 7' recortando a MAX_REPORTED_INTERVALS"""
+    parts = ['%d-%d' % (start, end) if start != end else '%d' % start
+             for start, end in intervals[:MAX_REPORTED_INTERVALS]]
+    if len(intervals) > MAX_REPORTED_INTERVALS:
+        parts.append(_('... (%d intervalos más)') % (len(intervals) - MAX_REPORTED_INTERVALS))
+    return ', '.join(parts)
+
+
+class FiscalRangeCheck(models.Model):
+    _name = 'kc_fiscal_hn.fiscal.range.check'
+    _description = 'Verificación de Huecos y Duplicados en Rangos CAI'
+    _order = 'check_date desc, id desc'
+
+    date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango de Fecha', required=True,
+                                    readonly=True, index=True, ondelete='cascade')
+    sequence_id = fields.Many2one('ir.sequence', string='Secuencia', readonly=True, index=True,
+                                  ondelete='cascade')
+    cai = fields.Char(string='CAI', readonly=True)
+    check_date = fields.Datetime(string='Fecha de Verificación', readonly=True, default=fields.Datetime.now)
+    range_start = fields.Integer(string='Inicio de Rango', readonly=True)
+    range_end = fields.Integer(string='Fin de Rango', readonly=True)
+    last_number = fields.Integer(string='Último Número Usado', readonly=True)
+    used_count = fields.Integer(string='Números Usados', readonly=True)
+    missing_count = fields.Integer(string='Números Faltantes', readonly=True)
+    duplicate_count = fields.Integer(string='Números Duplicados', readonly=True)
+    out_of_range_count = fields.Integer(string='Números Fuera de Rango', readonly=True)
+    missing_numbers = fields.Text(string='Faltantes', readonly=True)
+    duplicate_numbers = fields.Text(string='Duplicados', readonly=True)
+    out_of_range_numbers = fields.Text(string='Fuera de Rango', readonly=True)
+    state = fields.Selection([
+        ('ok', 'Sin Observaciones'),
+        ('issues', 'Con Observaciones'),
+    ], string='Estado', readonly=True, default='ok')
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True,
+                                 default=lambda self: self.env.company)
+
+    @api.model
+    def _cron_check_fiscal_ranges(self):
+        """Verificación nocturna de todos los rangos CAI con números consumidos"""
+        checks = self.check_date_ranges()
+        _logger.info("Verificación de rangos CAI: %d rangos revisados, %d con observaciones",
+                     len(checks), len(checks.filtered(lambda c: c.state == 'issues')))
+        return checks
+
+    @api.model
+    def check_date_ranges(self, date_ranges=None):
+        """
+        Detectar huecos, duplicados y números fuera de rango en cada rango CAI.
+
+        Todo se calcula en PostgreSQL sobre el libro de números fiscales vigente (sin los
+        registros anulados que reemplazó una corrección de CAI): los huecos
+        con LAG() sobre los números distintos de cada rango (islas y huecos), de modo
+        que el costo depende de los números usados y no del tamaño del rango.
+        """
+        if date_ranges is None:
+            date_ranges = self.env['ir.sequence.date_range'].search([
+                ('sequence_id.is_fiscal', '=', True),
+                ('cai', '!=', False),
+                ('rangoFinal', '>', 0),
+            ])
+        if not date_ranges:
+            return self.browse()
+        self.env.flush_all()
+        cr = self.env.cr
+        range_ids = date_ranges.ids
+
+        # Resumen por rango: usados, último número y cantidad de duplicados/fuera de rango
+        cr.execute("""
+            SELECT dr.id,
+                   COUNT(DISTINCT l.number) FILTER (WHERE l.number BETWEEN dr."rangoInicial" AND dr."rangoFinal"),
+                   MAX(l.number) FILTER (WHERE l.number BETWEEN dr."rangoInicial" AND dr."rangoFinal"),
+                   COUNT(DISTINCT l.number) FILTER (WHERE l.number NOT BETWEEN dr."rangoInicial" AND dr."rangoFinal")
+              FROM ir_sequence_date_range dr
+         LEFT JOIN kc_fiscal_hn_fiscal_ledger_current l ON l.date_range_id = dr.id
+             WHERE dr.id = ANY(%s)
+          GROUP BY dr.id
+        """, [range_ids])
+        summary = {row[0]: row[1:] for row in cr.fetchall()}
+
+        # Huecos: desde el inicio del rango hasta el último número usado
+        cr.execute("""
+            WITH used AS (
+                SELECT DISTINCT l.date_range_id, l.number
+                  FROM kc_fiscal_hn_fiscal_ledger_current l
+                  JOIN ir_sequence_date_range dr ON dr.id = l.date_range_id
+                 WHERE l.date_range_id = ANY(%s)
+                   AND l.number BETWEEN dr."rangoInicial" AND dr."rangoFinal"
+            ), islands AS (
+                SELECT date_range_id, number,
+                       LAG(number) OVER (PARTITION BY date_range_id ORDER BY number) AS previous
+                  FROM used
+            )
+            SELECT i.date_range_id,
+                   COALESCE(i.previous + 1, dr."rangoInicial") AS gap_start,
+                   i.number - 1 AS gap_end
+              FROM islands i
+              JOIN ir_sequence_date_range dr ON dr.id = i.date_range_id
+             WHERE i.number > COALESCE(i.previous + 1, dr."rangoInicial")
+          ORDER BY i.date_range_id, gap_start
+        """, [range_ids])
+        gaps = {}
+        for range_id, gap_start, gap_end in cr.fetchall():
+            gaps.setdefault(range_id, []).append((gap_start, gap_end))
+
+        # Duplicados y fuera de rango, cada número una sola vez
+        cr.execute("""
+            SELECT l.date_range_id, l.number,
+                   COUNT(*) > 1 AS duplicated,
+                   l.number NOT BETWEEN dr."rangoInicial" AND dr."rangoFinal" AS out_of_range
+              FROM kc_fiscal_hn_fiscal_ledger_current l
+              JOIN ir_sequence_date_range dr ON dr.id = l.date_range_id
+             WHERE l.date_range_id = ANY(%s)
+          GROUP BY l.date_range_id, l.number, dr."rangoInicial", dr."rangoFinal"
+            HAVING COUNT(*) > 1 OR l.number NOT BETWEEN dr."rangoInicial" AND dr."rangoFinal"
+          ORDER BY l.date_range_id, l.number
+        """, [range_ids])
+        duplicates, out_of_range = {}, {}
+        for range_id, number, duplicated, outside in cr.fetchall():
+            if duplicated:
+                duplicates.setdefault(range_id, []).append((number, number))
+            if outside:
+                out_of_range.setdefault(range_id, []).append((number, number))
+
+        vals_list = []
+        for date_range in date_ranges:
+            used_count, last_number, out_count = summary.get(date_range.id, (0, 0, 0))
+            range_gaps = gaps.get(date_range.id, [])
+            range_duplicates = duplicates.get(date_range.id, [])
+            missing_count = sum(end - start + 1 for start, end in range_gaps)
+            vals_list.append({
+                'date_range_id': date_range.id,
+                'sequence_id': date_range.sequence_id.id,
+                'cai': date_range.cai,
+                'range_start': date_range.rangoInicial,
+                'range_end': date_range.rangoFinal,
+                'last_number': last_number or 0,
+                'used_count': used_count,
+                'missing_count': missing_count,
+                'duplicate_count': len(range_duplicates),
+                'out_of_range_count': out_count,
+                'missing_numbers': _format_intervals(range_gaps),
+                'duplicate_numbers': _format_intervals(range_duplicates),
+                'out_of_range_numbers': _format_intervals(out_of_range.get(date_range.id, [])),
+                'state': 'issues' if (missing_count or range_duplicates or out_count) else 'ok',
+                'company_id': date_range.sequence_id.company_id.id or self.env.company.id,
+            })
+        return self.create(vals_list)
+
+    def action_view_ledger(self):
+        """Ver los números consumidos del rango verificado"""
+        self.ensure_one()
+        return {
+            'name': _('Números Fiscales del Rango'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'kc_fiscal_hn.fiscal.ledger',
+            'view_mode': 'list',
+            'domain': [('date_range_id', '=', self.date_range_id.id)],
+        }
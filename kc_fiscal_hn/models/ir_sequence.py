@@ -1,10 +1,104 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+import logging
 import re
+import psycopg2
+from bisect import bisect_right
+from collections import namedtuple
 from datetime import datetime, timedelta
 
+from odoo.addons.base.models.ir_sequence import _select_nextval
+
+from .account_journal import FISCAL_SEQUENCE_CONFIG_CACHE_KEY
+
+_logger = logging.getLogger(__name__)
+
+# Espera máxima por la fila del contador en el cursor propio de la reserva
+FISCAL_COUNTER_LOCK_TIMEOUT = '5s'
+
+# Pronóstico de agotamiento: factor de suavizado del EWMA, ventana observada y plazos de aviso
+FORECAST_ALPHA = 0.2
+FORECAST_LOOKBACK_DAYS = 60
+FORECAST_DEFAULT_NOTICE_DAYS = 30
+FORECAST_CRITICAL_DAYS = 7
+FORECAST_FIELDS = ['consumption_rate', 'forecast_days_left', 'forecast_exhaustion_date', 'forecast_before_expiry']
+
+# Estadísticas de uso almacenadas que se refrescan por SQL
+USAGE_STATS_FIELDS = ['current_fiscal_number', 'fiscal_usage_count', 'fiscal_usage_percentage', 'fiscal_status']
+
+# Días de anticipación con que se crean los rangos del próximo período
+PREWARM_LOOKAHEAD_DAYS = 7
+
+# Campos de ir.sequence.date_range que forman parte del índice de intervalos
+DATE_RANGE_INDEX_FIELDS = {'sequence_id', 'date_from', 'date_to', 'cai', 'rangoInicial', 'rangoFinal'}
+# Clave de versión (kc_fiscal_hn.cache.version) del índice de intervalos de cada secuencia
+DATE_RANGE_INDEX_CACHE_KEY = 'date_range_index.%s'
+
+# Entrada del índice de intervalos: solo valores inmutables, se comparte entre transacciones
+DateRangeEntry = namedtuple('DateRangeEntry', [
+    'id', 'date_from', 'date_to', 'has_cai', 'has_numbers', 'numbers_ordered', 'valid',
+])
+
+
+class DateRangeIndex:
+    """
+    Índice de los rangos de fecha de una secuencia ordenado por date_from.
+    `max_date_to[i]` es el mayor date_to de las entradas 0..i, lo que permite
+    detener la búsqueda hacia atrás apenas ningún rango anterior puede contener la fecha.
+    """
+    __slots__ = ('entries', 'date_froms', 'max_date_to')
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.date_froms = tuple(entry.date_from for entry in self.entries)
+        max_date_to, current = [], None
+        for entry in self.entries:
+            current = entry.date_to if current is None else max(current, entry.date_to)
+            max_date_to.append(current)
+        self.max_date_to = tuple(max_date_to)
+
+    def containing(self, date):
+        """Entradas cuyo intervalo contiene `date`, ordenadas por date_from"""
+        found = []
+        index = bisect_right(self.date_froms, date) - 1
+        while index >= 0 and self.max_date_to[index] >= date:
+            if self.entries[index].date_to >= date:
+                found.append(self.entries[index])
+            index -= 1
+        found.reverse()
+        return found
+
+    def after(self, date):
+        """Entradas que empiezan después de `date`, ordenadas por date_from"""
+        return self.entries[bisect_right(self.date_froms, date):]
+
+
+def _reserve_nogap_block(records, count, increment=1, limit=None):
+    """
+    Reserva `count` números consecutivos de una fila no_gap (ir_sequence o
+    ir_sequence_date_range) con un solo bloqueo de fila y un solo UPDATE.
+    Si se indica `limit`, no se reservan números por encima de ese valor.
+    Devuelve la lista de números reservados (puede ser más corta que `count`).
+    """
+    records.ensure_one()
+    increment = increment or 1
+    records.flush_recordset(['number_next'])
+    records.env.cr.execute(
+        "SELECT number_next FROM %s WHERE id = %%s FOR UPDATE" % records._table, [records.id]
+    )
+    number_next = records.env.cr.fetchone()[0]
+    if limit:
+        count = min(count, max(0, (limit - number_next) // increment + 1))
+    if count:
+        records.env.cr.execute(
+            "UPDATE %s SET number_next = number_next + %%s WHERE id = %%s" % records._table,
+            [count * increment, records.id],
+        )
+        records.invalidate_recordset(['number_next', 'number_next_actual'])
+    return [number_next + i * increment for i in range(count)]
+
 
 class IrSequence(models.Model):
     _inherit = 'ir.sequence'
@@ -19,7 +113,30 @@ class IrSequence(models.Model):
         ('retention', 'Retención'),
         ('other', 'Otro')
     ], string='Tipo Fiscal', default='invoice')
+    fiscal_numbering_mode = fields.Selection([
+        ('immediate', 'Inmediata'),
+        ('deferred', 'Diferida (cola)')
+    ], string='Modo de Numeración', default='immediate', required=True,
+       help='Inmediata: el número SAR se asigna al publicar. '
+            'Diferida: el documento se publica con "/" y un proceso programado asigna '
+            'los números en orden de publicación, sin bloquear al usuario.')
+    fiscal_allocator = fields.Selection([
+        ('sequence', 'Rango de la secuencia (no_gap)'),
+        ('counter', 'Contador fiscal dedicado')
+    ], string='Asignador de Números', default='sequence', required=True,
+       help='Rango de la secuencia: bloquea la fila de ir.sequence.date_range (comportamiento estándar). '
+            'Contador fiscal dedicado: reserva en una tabla angosta por rango, en una transacción '
+            'corta propia, sin bloquear la fila del rango. Los números de una publicación revertida '
+            'quedan anulados en el libro fiscal. Solo aplica a secuencias con rangos de fecha.')
     
+    # CAI autorizado que se activará en el próximo período (preparación anticipada)
+    pending_cai = fields.Char(string='CAI Pendiente', copy=False,
+                              help='CAI ya autorizado por el SAR que el proceso programado activará '
+                                   'en un rango nuevo al terminar el rango vigente')
+    pending_rango_inicial = fields.Integer(string='Rango Inicial Pendiente', copy=False)
+    pending_rango_final = fields.Integer(string='Rango Final Pendiente', copy=False)
+    pending_cai_date_to = fields.Date(string='Fecha Límite del CAI Pendiente', copy=False)
+
     # Campos de alerta
     dias_alerta = fields.Integer(string='Días de Alerta', default=30)
     numeros_alerta = fields.Integer(string='Números de Alerta', default=100)
@@ -83,15 +200,20 @@ class IrSequence(models.Model):
     
     @api.depends('number_next_actual')
     def _compute_last_used_date(self):
-        """Calcular la última fecha de uso"""
+        """Calcular la última fecha de uso desde el libro de números fiscales (por índice)"""
+        last_dates = {}
+        sequence_ids = [sequence_id for sequence_id in self.ids if sequence_id]
+        if sequence_ids:
+            self.env['kc_fiscal_hn.fiscal.ledger'].flush_model(['sequence_id', 'document_date'])
+            self.env.cr.execute("""
+                SELECT sequence_id, MAX(document_date)
+                  FROM kc_fiscal_hn_fiscal_ledger
+                 WHERE sequence_id = ANY(%s)
+              GROUP BY sequence_id
+            """, [sequence_ids])
+            last_dates = dict(self.env.cr.fetchall())
         for sequence in self:
-            # Buscar el último uso en las facturas
-            last_invoice = self.env['account.move'].search([
-                ('name', 'like', f'%{sequence.prefix}%'),
-                ('state', 'in', ['posted', 'cancel'])
-            ], order='date desc', limit=1)
-            
-            sequence.last_used_date = last_invoice.date if last_invoice else False
+            sequence.last_used_date = last_dates.get(sequence.id, False)
     
     @api.depends('fiscal_usage_percentage', 'fiscal_range_end', 'number_next_actual')
     def _compute_fiscal_status(self):
@@ -110,6 +232,141 @@ class IrSequence(models.Model):
             else:
                 sequence.fiscal_status = 'active'
     
+    @api.model
+    def _cron_prewarm_fiscal_ranges(self, lookahead_days=PREWARM_LOOKAHEAD_DAYS):
+        """Crear por adelantado los rangos de fecha y contadores de las secuencias fiscales"""
+        sequences = self.search([('is_fiscal', '=', True), ('use_date_range', '=', True)])
+        created = sequences._prewarm_fiscal_ranges(lookahead_days=lookahead_days)
+        _logger.info("Preparación de rangos fiscales: %d rangos creados en %d secuencias",
+                     len(created), len(sequences))
+        return created
+
+    def _prewarm_fiscal_ranges(self, today=None, lookahead_days=PREWARM_LOOKAHEAD_DAYS):
+        """
+        Crear antes del cambio de período el rango de fecha que cubrirá los próximos
+        `lookahead_days` días, para que el primer documento del período no lo cree dentro
+        de la transacción de publicación con la secuencia bloqueada.
+        - Con CAI pendiente configurado: el rango nuevo se crea con ese CAI y su rango
+          autorizado, y los campos pendientes se limpian.
+        - Secuencias que no requieren CAI: rango anual estándar de Odoo.
+        - Secuencias que requieren CAI sin CAI pendiente: solo se advierte.
+        También crea las filas de contador de los rangos vigentes o próximos (asignador dedicado).
+        """
+        today = today or fields.Date.context_today(self)
+        horizon = today + timedelta(days=lookahead_days)
+        DateRange = self.env['ir.sequence.date_range']
+        created = DateRange
+        for sequence in self.filtered(lambda s: s.is_fiscal and s.use_date_range):
+            index = sequence._get_date_range_index()
+            date = today
+            while date <= horizon:
+                covering = index.containing(date)
+                if not covering:
+                    break
+                date = max(entry.date_to for entry in covering) + timedelta(days=1)
+            if date > horizon:
+                continue
+            if sequence.pending_cai:
+                date_range = DateRange.create({
+                    'sequence_id': sequence.id,
+                    'date_from': date,
+                    'date_to': sequence.pending_cai_date_to or fields.Date.end_of(date, 'year'),
+                    'cai': sequence.pending_cai,
+                    'rangoInicial': sequence.pending_rango_inicial,
+                    'rangoFinal': sequence.pending_rango_final,
+                    'number_next': sequence.pending_rango_inicial or 1,
+                })
+                sequence.write({
+                    'pending_cai': False,
+                    'pending_rango_inicial': 0,
+                    'pending_rango_final': 0,
+                    'pending_cai_date_to': False,
+                })
+                _logger.info("Secuencia %s: CAI pendiente %s activado desde %s",
+                             sequence.name, date_range.cai, date)
+            elif not sequence.requires_cai:
+                date_range = sequence._create_date_range_seq(date)
+            else:
+                _logger.warning("Secuencia %s sin rango para %s ni CAI pendiente configurado", sequence.name, date)
+                continue
+            created |= date_range
+
+        counter_sequences = self.filtered(lambda s: s.fiscal_allocator == 'counter')
+        if counter_sequences:
+            DateRange.flush_model(['number_next'])
+            self.env.cr.execute("""
+                INSERT INTO kc_fiscal_hn_fiscal_counter (date_range_id, number_next)
+                SELECT id, number_next
+                  FROM ir_sequence_date_range
+                 WHERE sequence_id = ANY(%s)
+                   AND date_to >= %s
+                   AND date_from <= %s
+                ON CONFLICT (date_range_id) DO NOTHING
+            """, [counter_sequences.ids, today, horizon])
+        return created
+
+    @api.model
+    def _cron_refresh_fiscal_usage_stats(self):
+        """Refrescar las estadísticas de uso almacenadas de todas las secuencias fiscales"""
+        refreshed = self._refresh_fiscal_usage_stats()
+        _logger.info("Estadísticas de uso fiscal refrescadas en %d secuencias", len(refreshed))
+        return refreshed
+
+    def _refresh_fiscal_usage_stats(self):
+        """
+        Recalcular en una sola sentencia current_fiscal_number, fiscal_usage_count,
+        fiscal_usage_percentage y fiscal_status de las secuencias fiscales (todas si el
+        conjunto está vacío). La asignación no_gap avanza number_next por SQL sin pasar por
+        el ORM, así que los valores almacenados quedan desactualizados hasta este refresco,
+        que ejecuta cada hora ir_cron_fiscal_usage_stats (la publicación no lo llama).
+        Usa las mismas fórmulas que los métodos _compute_*; solo escribe las filas que cambian.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            WITH actual AS (
+                SELECT s.id, s.fiscal_range_start AS range_start, s.fiscal_range_end AS range_end,
+                       s.alert_threshold, s.warning_threshold,
+                       COALESCE(s.fiscal_range_start, 0) != 0 AND COALESCE(s.fiscal_range_end, 0) != 0 AS has_range,
+                       CASE WHEN s.implementation = 'standard'
+                            THEN COALESCE(ps.last_value + s.number_increment, s.number_next)
+                            ELSE s.number_next END AS next_actual
+                  FROM ir_sequence s
+             LEFT JOIN pg_sequences ps
+                    ON ps.schemaname = current_schema()
+                   AND ps.sequencename = 'ir_sequence_' || lpad(s.id::text, GREATEST(3, length(s.id::text)), '0')
+                 WHERE s.is_fiscal
+                   AND (%(all)s OR s.id = ANY(%(ids)s))
+            ), stats AS (
+                SELECT a.id, a.next_actual, a.range_end, a.alert_threshold, a.warning_threshold,
+                       CASE WHEN a.has_range THEN a.next_actual ELSE 0 END AS current_number,
+                       CASE WHEN a.has_range THEN GREATEST(0, a.next_actual - a.range_start) ELSE 0 END AS usage_count,
+                       CASE WHEN a.has_range AND a.range_end - a.range_start + 1 > 0
+                            THEN (a.next_actual - a.range_start) * 100.0 / (a.range_end - a.range_start + 1)
+                            ELSE 0 END AS usage_percentage
+                  FROM actual a
+            ), target AS (
+                SELECT st.id, st.current_number, st.usage_count, st.usage_percentage,
+                       CASE WHEN COALESCE(st.range_end, 0) != 0 AND st.next_actual > st.range_end THEN 'expired'
+                            WHEN st.usage_percentage >= COALESCE(st.warning_threshold, 0) THEN 'critical'
+                            WHEN st.usage_percentage >= COALESCE(st.alert_threshold, 0) THEN 'warning'
+                            ELSE 'active' END AS status
+                  FROM stats st
+            )
+            UPDATE ir_sequence s
+               SET current_fiscal_number = t.current_number,
+                   fiscal_usage_count = t.usage_count,
+                   fiscal_usage_percentage = t.usage_percentage,
+                   fiscal_status = t.status
+              FROM target t
+             WHERE s.id = t.id
+               AND (s.current_fiscal_number, s.fiscal_usage_count, s.fiscal_usage_percentage, s.fiscal_status)
+                   IS DISTINCT FROM (t.current_number, t.usage_count, t.usage_percentage, t.status)
+         RETURNING s.id
+        """, {'all': not self.ids, 'ids': self.ids or [0]})
+        refreshed = self.browse([row[0] for row in self.env.cr.fetchall()])
+        self.invalidate_model(USAGE_STATS_FIELDS)
+        return refreshed
+
     @api.constrains('fiscal_range_start', 'fiscal_range_end')
     def _check_fiscal_range(self):
         """Validar que el rango fiscal sea válido"""
@@ -121,6 +378,13 @@ class IrSequence(models.Model):
                 if sequence.fiscal_range_start < 1:
                     raise ValidationError(_('El inicio del rango fiscal debe ser mayor a 0'))
     
+    @api.constrains('pending_cai', 'pending_rango_inicial', 'pending_rango_final')
+    def _check_pending_cai(self):
+        """El CAI pendiente debe traer su rango autorizado"""
+        for sequence in self.filtered('pending_cai'):
+            if not 0 < sequence.pending_rango_inicial <= sequence.pending_rango_final:
+                raise ValidationError(_('El CAI pendiente debe tener un rango autorizado válido'))
+
     @api.constrains('alert_threshold', 'warning_threshold')
     def _check_thresholds(self):
         """Validar que los umbrales sean válidos"""
@@ -217,11 +481,13 @@ class IrSequence(models.Model):
         if not self.is_fiscal:
             raise ValidationError(_('Esta secuencia no es fiscal'))
         
-        # Buscar documentos que usan esta secuencia
-        domain = [
-            ('name', 'like', f'%{self.prefix}%'),
-            ('state', 'in', ['posted', 'cancel'])
-        ]
+        # Documentos que consumieron números de esta secuencia según el libro fiscal, más los
+        # importados con su prefijo (búsqueda anclada a la izquierda, resuelta por índice)
+        domain = [('fiscal_ledger_ids.sequence_id', '=', self.id)]
+        name_pattern = self._get_fiscal_name_pattern()
+        if name_pattern:
+            domain = ['|', ('name', '=like', name_pattern)] + domain
+        domain.append(('state', 'in', ['posted', 'cancel']))
         
         return {
             'name': _('Uso de Secuencia Fiscal'),
@@ -235,6 +501,18 @@ class IrSequence(models.Model):
             }
         }
     
+    def _get_fiscal_name_pattern(self):
+        """
+        Patrón =like anclado a la izquierda para los nombres de esta secuencia: la parte fija
+        del prefijo (antes de cualquier %(...)s) seguida de '%'. Vacío si no hay parte fija.
+        """
+        self.ensure_one()
+        static_prefix = (self.prefix or '').split('%(')[0]
+        if not static_prefix:
+            return False
+        escaped = static_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return escaped + '%'
+
     def get_next_fiscal_number(self):
         """Obtener el próximo número fiscal con validaciones"""
         self.ensure_one()
@@ -256,6 +534,35 @@ class IrSequence(models.Model):
         
         return self._next()
     
+    def _reserve_fiscal_block(self, count):
+        """Reservar un bloque contiguo de números en secuencias fiscales sin rango de fecha"""
+        self.ensure_one()
+        if self.implementation == 'standard':
+            return [_select_nextval(self.env.cr, 'ir_sequence_%03d' % self.id) for _i in range(count)]
+        return _reserve_nogap_block(self, count, self.number_increment)
+
+    def _next_fiscal_block(self, count, sequence_date=None):
+        """Equivalente a `count` llamadas a next_by_id, resolviendo el rango de fecha una sola vez"""
+        self.ensure_one()
+        date = sequence_date or fields.Date.today()
+        if not self.use_date_range:
+            return self._get_fiscal_names(self._reserve_fiscal_block(count), date=date)
+        entry = self._get_date_range_entry(date)
+        if entry:
+            date_range = self.env['ir.sequence.date_range'].browse(entry.id)
+        else:
+            date_range = self._create_date_range_seq(date)
+        numbers = date_range._reserve_fiscal_block(count)
+        if len(numbers) < count:
+            raise UserError(_('El rango de numeración de la secuencia %s está agotado.') % self.name)
+        return self._get_fiscal_names(numbers, date=date, date_range=date_range.date_from)
+
+    def _get_fiscal_names(self, numbers, date=None, date_range=None):
+        """Formatear números reservados con el prefijo/sufijo interpolado una sola vez"""
+        self.ensure_one()
+        prefix, suffix = self._get_prefix_suffix(date=date, date_range=date_range)
+        return ['%s%0*d%s' % (prefix, self.padding, number, suffix) for number in numbers]
+
     def _generate_sequence_alert(self):
         """Generar alerta automática para la secuencia"""
         self.ensure_one()
@@ -271,6 +578,107 @@ class IrSequence(models.Model):
             'range_end': self.fiscal_range_end
         })
     
+    @api.model
+    def _cron_forecast_range_exhaustion(self):
+        """Pronóstico diario de agotamiento de los rangos CAI activos"""
+        forecasts = self._forecast_range_exhaustion()
+        self._generate_forecast_alerts(forecasts)
+        return forecasts
+
+    @api.model
+    def _forecast_range_exhaustion(self, today=None):
+        """
+        Calcular, en una sola sentencia para todas las secuencias fiscales, el consumo diario
+        de cada rango activo como promedio móvil exponencial (EWMA) sobre el libro de números
+        fiscales, y la fecha estimada de agotamiento frente a la fecha límite del CAI.
+
+        El EWMA se evalúa en forma cerrada: cada día con consumo pesa alpha * (1 - alpha)^edad
+        y la suma se normaliza por la ventana observada (días desde el inicio del rango,
+        hasta FORECAST_LOOKBACK_DAYS). Guarda el resultado en el rango y lo devuelve como
+        lista de diccionarios.
+        """
+        today = today or fields.Date.context_today(self)
+        self.env.flush_all()
+        self.env.cr.execute("""
+            WITH active AS (
+                SELECT dr.id, dr.date_to, dr."rangoInicial" AS range_start, dr."rangoFinal" AS range_end,
+                       LEAST(%(lookback)s, %(today)s::date - dr.date_from + 1) AS window_days
+                  FROM ir_sequence_date_range dr
+                  JOIN ir_sequence s ON s.id = dr.sequence_id
+                 WHERE s.is_fiscal AND s.active
+                   AND COALESCE(dr.cai, '') != ''
+                   AND COALESCE(dr."rangoFinal", 0) > 0
+                   AND %(today)s::date BETWEEN dr.date_from AND dr.date_to
+            ), daily AS (
+                SELECT l.date_range_id, l.allocated_at::date AS day, COUNT(*) AS used
+                  FROM kc_fiscal_hn_fiscal_ledger l
+                  JOIN active a ON a.id = l.date_range_id
+                 WHERE l.allocated_at >= %(today)s::date - a.window_days + 1
+                   AND l.allocated_at < %(today)s::date + 1
+              GROUP BY l.date_range_id, l.allocated_at::date
+            ), forecast AS (
+                SELECT a.id, a.date_to,
+                       a.range_end - COALESCE(
+                           (SELECT MAX(l.number) FROM kc_fiscal_hn_fiscal_ledger l WHERE l.date_range_id = a.id),
+                           a.range_start - 1) AS remaining,
+                       COALESCE(SUM(d.used * %(alpha)s * power(1 - %(alpha)s, %(today)s::date - d.day)), 0)
+                           / (1 - power(1 - %(alpha)s, a.window_days)) AS rate
+                  FROM active a
+             LEFT JOIN daily d ON d.date_range_id = a.id
+              GROUP BY a.id, a.date_to, a.range_start, a.range_end, a.window_days
+            ), projected AS (
+                SELECT f.id, f.date_to, GREATEST(f.remaining, 0) AS remaining, f.rate,
+                       CASE WHEN f.rate > 0 THEN CEIL(GREATEST(f.remaining, 0) / f.rate)::int END AS days_left
+                  FROM forecast f
+            )
+            UPDATE ir_sequence_date_range dr
+               SET consumption_rate = p.rate,
+                   forecast_days_left = p.days_left,
+                   forecast_exhaustion_date = %(today)s::date + p.days_left,
+                   forecast_before_expiry = COALESCE(%(today)s::date + p.days_left < p.date_to, FALSE)
+              FROM projected p
+             WHERE dr.id = p.id
+         RETURNING dr.id, dr.sequence_id, p.remaining, p.rate, p.days_left,
+                   dr.forecast_exhaustion_date, dr.date_to, dr.forecast_before_expiry
+        """, {'today': today, 'alpha': FORECAST_ALPHA, 'lookback': FORECAST_LOOKBACK_DAYS})
+        columns = ['date_range_id', 'sequence_id', 'remaining', 'rate', 'days_left',
+                   'exhaustion_date', 'date_to', 'before_expiry']
+        forecasts = [dict(zip(columns, row)) for row in self.env.cr.fetchall()]
+        self.env['ir.sequence.date_range'].invalidate_model(FORECAST_FIELDS)
+        return forecasts
+
+    @api.model
+    def _generate_forecast_alerts(self, forecasts):
+        """Alertar los rangos que se agotarán antes del vencimiento del CAI dentro del plazo de aviso"""
+        DateRange = self.env['ir.sequence.date_range']
+        Alert = self.env['kc_fiscal_hn.sequence.alert']
+        for forecast in forecasts:
+            if not forecast['before_expiry']:
+                continue
+            date_range = DateRange.browse(forecast['date_range_id'])
+            sequence = date_range.sequence_id
+            if forecast['days_left'] > (sequence.dias_alerta or FORECAST_DEFAULT_NOTICE_DAYS):
+                continue
+            total = date_range.rangoFinal - date_range.rangoInicial + 1
+            Alert.create({
+                'sequence_id': sequence.id,
+                'alert_type': 'critical' if forecast['days_left'] <= FORECAST_CRITICAL_DAYS else 'warning',
+                'message': _(
+                    'El rango %(prefix)s (CAI %(cai)s) se agota en %(days)d días (%(date)s) al ritmo de '
+                    '%(rate).1f números diarios, antes del vencimiento del CAI (%(date_to)s). '
+                    'Solicite un nuevo CAI al SAR.',
+                    prefix=sequence.prefix or sequence.name, cai=date_range.cai,
+                    days=forecast['days_left'], date=forecast['exhaustion_date'],
+                    rate=forecast['rate'], date_to=forecast['date_to'],
+                ),
+                'usage_percentage': (total - forecast['remaining']) / total * 100 if total > 0 else 0,
+                'current_number': date_range.rangoFinal - forecast['remaining'] + 1,
+                'range_start': date_range.rangoInicial,
+                'range_end': date_range.rangoFinal,
+            })
+            _logger.warning("Rango %s (secuencia %s) se agota en %d días, antes del vencimiento del CAI %s",
+                            date_range.cai, sequence.name, forecast['days_left'], forecast['date_to'])
+
     @api.model_create_multi
     def create(self, vals_list):
         """Crear secuencias con validaciones fiscales"""
@@ -284,7 +692,14 @@ class IrSequence(models.Model):
     
     def write(self, vals):
         """Escribir secuencia con validaciones fiscales"""
+        if vals.get('fiscal_allocator') == 'sequence':
+            # Devolver al rango el valor del contador antes de dejar de usarlo
+            self.filtered(lambda s: s.fiscal_allocator == 'counter').date_range_ids._release_fiscal_counters()
         result = super().write(vals)
+        self._invalidate_status_snapshot()
+        if {'is_fiscal', 'use_date_range'}.intersection(vals):
+            # La resolución diario → secuencia fiscal guarda estos valores
+            self.env['kc_fiscal_hn.cache.version']._bump([FISCAL_SEQUENCE_CONFIG_CACHE_KEY])
         
         for sequence in self:
             if sequence.is_fiscal:
@@ -341,23 +756,24 @@ class IrSequence(models.Model):
             return True
         
         # Buscar rango de fecha para hoy
-        current_date_range = self.date_range_ids.filtered(lambda r: r.date_from <= fields.Date.today() <= r.date_to)
-        if not current_date_range:
-            # Si no hay rango para hoy, buscar el más reciente
-            current_date_range = self.date_range_ids.filtered(lambda r: r.date_to >= fields.Date.today()).sorted('date_to', reverse=True)
+        today = fields.Date.today()
+        current_range = self._get_date_range_entry(today)
+        if not current_range:
+            # Si no hay rango para hoy, buscar el que vence más tarde
+            upcoming = self._get_date_range_index().after(today)
+            current_range = max(upcoming, key=lambda entry: entry.date_to) if upcoming else None
         
-        if not current_date_range:
+        if not current_range:
             raise ValidationError(_('No hay rangos de fecha válidos para el período actual'))
         
         # Validar que el rango de fecha actual tenga CAI y rangos válidos
-        current_range = current_date_range[0]
-        if not current_range.cai:
+        if not current_range.has_cai:
             raise ValidationError(_('El rango de fecha actual no tiene CAI configurado'))
         
-        if not current_range.rangoInicial or not current_range.rangoFinal:
+        if not current_range.has_numbers:
             raise ValidationError(_('El rango de fecha actual no tiene rangos inicial y final configurados'))
         
-        if current_range.rangoInicial >= current_range.rangoFinal:
+        if not current_range.numbers_ordered:
             raise ValidationError(_('El rango inicial debe ser menor al rango final en el período actual'))
         
         return True
@@ -486,11 +902,13 @@ class IrSequence(models.Model):
         """Obtener datos para el dashboard fiscal"""
         sequences = self.search([('is_fiscal', '=', True)])
         
+        # Las columnas almacenadas se mantienen al día con _refresh_fiscal_usage_stats
+        status_counts = dict(self._read_group([('is_fiscal', '=', True)], ['fiscal_status'], ['__count']))
         total_sequences = len(sequences)
-        active_sequences = len(sequences.filtered(lambda s: s.fiscal_status == 'active'))
-        warning_sequences = len(sequences.filtered(lambda s: s.fiscal_status == 'warning'))
-        critical_sequences = len(sequences.filtered(lambda s: s.fiscal_status == 'critical'))
-        expired_sequences = len(sequences.filtered(lambda s: s.fiscal_status == 'expired'))
+        active_sequences = status_counts.get('active', 0)
+        warning_sequences = status_counts.get('warning', 0)
+        critical_sequences = status_counts.get('critical', 0)
+        expired_sequences = status_counts.get('expired', 0)
         
         # Calcular uso total
         total_usage = sum(sequences.mapped('fiscal_usage_count'))
@@ -557,6 +975,91 @@ class IrSequence(models.Model):
             
             return self._return_validation_result(title=_('Error de Validación de Rangos de Fecha'), error_message=str(e))
 
+    def _get_date_range_index(self):
+        """
+        Índice de intervalos de los rangos de fecha de la secuencia, con las banderas
+        de validez precalculadas. Se memoriza por versión: solo lo invalidan los cambios
+        de fechas, CAI o rango autorizado de los rangos de esta secuencia.
+        """
+        version = self.env['kc_fiscal_hn.cache.version']._get_version(DATE_RANGE_INDEX_CACHE_KEY % self.id)
+        return self._get_date_range_index_cached(version)
+
+    @tools.ormcache('self.id', 'version')
+    def _get_date_range_index_cached(self, version):
+        self.env['ir.sequence.date_range'].flush_model(DATE_RANGE_INDEX_FIELDS)
+        self.env.cr.execute("""
+            SELECT id, date_from, date_to,
+                   COALESCE(cai, '') != '',
+                   COALESCE("rangoInicial", 0) != 0 AND COALESCE("rangoFinal", 0) != 0,
+                   COALESCE("rangoInicial" < "rangoFinal", FALSE)
+              FROM ir_sequence_date_range
+             WHERE sequence_id = %s AND date_from IS NOT NULL AND date_to IS NOT NULL
+          ORDER BY date_from, id
+        """, [self.id])
+        return DateRangeIndex(
+            DateRangeEntry(range_id, date_from, date_to, has_cai, has_numbers, numbers_ordered,
+                           has_cai and has_numbers and numbers_ordered and date_from < date_to)
+            for range_id, date_from, date_to, has_cai, has_numbers, numbers_ordered in self.env.cr.fetchall()
+        )
+
+    def _bump_date_range_index(self):
+        """Dejar obsoleto el índice de intervalos memorizado de las secuencias"""
+        self.env['kc_fiscal_hn.cache.version']._bump(DATE_RANGE_INDEX_CACHE_KEY % sequence_id
+                                                     for sequence_id in self.ids)
+
+    def _get_date_range_entry(self, date):
+        """Entrada del índice del rango que contiene `date` (o None)"""
+        entries = self._get_date_range_index().containing(date)
+        return entries[0] if entries else None
+
+    def _get_future_range_entries(self, current_date):
+        """Entradas válidas que contienen `current_date` o empiezan después, ordenadas por date_from"""
+        index = self._get_date_range_index()
+        return [entry for entry in index.containing(current_date) + list(index.after(current_date)) if entry.valid]
+
+    def lease_fiscal_numbers(self, count, hours=12, device=None, date=None):
+        """
+        Entregar a un emisor móvil un bloque contiguo de `count` números del rango CAI activo,
+        con una sola operación bloqueada. Los números no usados se anulan al vencer el bloque.
+        Devuelve los datos que el dispositivo necesita para emitir sin conexión.
+        """
+        self.ensure_one()
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise ValidationError(_('Solo los administradores contables pueden entregar bloques de números fiscales'))
+        if not self.is_fiscal or not self.use_date_range:
+            raise UserError(_('Solo se pueden entregar bloques de secuencias fiscales con rangos de fecha.'))
+        if count <= 0:
+            raise UserError(_('La cantidad de números del bloque debe ser mayor a cero.'))
+        if self.implementation == 'standard' and self.fiscal_allocator != 'counter':
+            # nextval() no garantiza un bloque contiguo con emisiones concurrentes
+            raise UserError(_('Los bloques requieren una secuencia sin huecos o el contador fiscal dedicado.'))
+        date_range = self.get_status_snapshot(date)['current_range']
+        if not date_range or not date_range.cai:
+            raise UserError(_('No hay un rango CAI activo para la secuencia %s.') % self.name)
+        numbers = date_range._reserve_fiscal_block(count)
+        if not numbers:
+            raise UserError(_('El rango de numeración del CAI %s está agotado.') % date_range.cai)
+        lease = self.env['kc_fiscal_hn.fiscal.lease'].sudo().create({
+            'sequence_id': self.id,
+            'date_range_id': date_range.id,
+            'cai': date_range.cai,
+            'number_from': numbers[0],
+            'number_to': numbers[-1],
+            'device': device,
+            'expires_at': fields.Datetime.now() + timedelta(hours=hours),
+            'company_id': self.company_id.id or self.env.company.id,
+        })
+        _logger.info("Bloque de números fiscales %d-%d (CAI %s) entregado a %s", numbers[0], numbers[-1],
+                     date_range.cai, device or self.env.user.name)
+        return lease._get_lease_info()
+
+    def _get_rollover_ranges(self, date_range, current_date):
+        """Rangos válidos que siguen a `date_range` para continuar la numeración de `current_date`"""
+        self.ensure_one()
+        entries = [entry for entry in self._get_future_range_entries(current_date)
+                   if entry.id != date_range.id and entry.date_from >= date_range.date_from]
+        return self.env['ir.sequence.date_range'].browse([entry.id for entry in entries])
+
     def get_available_future_ranges(self, current_date=None):
         """
         Obtener rangos de fecha futuros disponibles que permitan continuar operaciones
@@ -569,22 +1072,10 @@ class IrSequence(models.Model):
         if not current_date:
             current_date = fields.Date.today()
         
-        # Buscar rangos futuros que tengan CAI y rangos válidos
-        future_ranges = self.date_range_ids.filtered(lambda r: 
-            r.cai and 
-            r.rangoInicial and 
-            r.rangoFinal and
-            r.rangoInicial < r.rangoFinal and
-            r.date_from and 
-            r.date_to and
-            r.date_from < r.date_to and
-            (
-                r.date_from > current_date or  # Fecha posterior
-                (r.date_from <= current_date <= r.date_to)  # Incluye fecha actual
-            )
-        ).sorted('date_from')
-        
-        return future_ranges
+        # Rangos válidos (CAI y rangos numéricos) que incluyen la fecha actual o son posteriores
+        return self.env['ir.sequence.date_range'].browse(
+            [entry.id for entry in self._get_future_range_entries(current_date)]
+        )
     
     def has_valid_future_sequences(self, current_date=None):
         """
@@ -611,114 +1102,134 @@ class IrSequence(models.Model):
             current_date = fields.Date.today()
         
         # Buscar el siguiente rango válido
-        next_range = self.date_range_ids.filtered(lambda r: 
-            r.cai and 
-            r.rangoInicial and 
-            r.rangoFinal and
-            r.rangoInicial < r.rangoFinal and
-            r.date_from and 
-            r.date_to and
-            r.date_from < r.date_to and
-            r.date_from > current_date
-        ).sorted('date_from')
-        
-        return next_range[0] if next_range else False
+        for entry in self._get_date_range_index().after(current_date):
+            if entry.valid:
+                return self.env['ir.sequence.date_range'].browse(entry.id)
+        return False
     
-    def validate_sequence_continuity(self, current_date=None):
+    def get_status_snapshot(self, date=None):
         """
-        Validar continuidad de la secuencia fiscal, permitiendo operaciones si hay subsecuencias futuras
+        Estado de la secuencia fiscal para una fecha, calculado en una sola pasada:
+        rango actual, números restantes, días restantes, rangos futuros y si se puede continuar.
+
+        El resultado se memoriza durante la transacción por (secuencia, fecha), de modo que
+        action_post, _post y el controlador comparten el mismo análisis. Se descarta al
+        asignar números o al modificar los rangos de fecha.
         """
         self.ensure_one()
-        
+        date = date or fields.Date.today()
+        memo = self.env.cr.cache.setdefault('kc_fiscal_hn_status_snapshot', {})
+        key = (self.id, date)
+        if key not in memo:
+            memo[key] = self._compute_status_snapshot(date)
+        snapshot = dict(memo[key])
+        DateRange = self.env['ir.sequence.date_range']
+        snapshot['current_range'] = DateRange.browse(snapshot['current_range'])
+        snapshot['next_range'] = DateRange.browse(snapshot['next_range'])
+        snapshot['future_ranges'] = DateRange.browse(snapshot['future_ranges'])
+        snapshot['warnings'] = list(snapshot['warnings'])
+        return snapshot
+
+    def _invalidate_status_snapshot(self):
+        """Descartar los estados memorizados en la transacción"""
+        self.env.cr.cache.pop('kc_fiscal_hn_status_snapshot', None)
+
+    def _compute_status_snapshot(self, current_date):
+        """Calcular el estado de la secuencia; solo guarda ids y valores simples"""
+        snapshot = {
+            'date': current_date,
+            'valid': True,
+            'message': '',
+            'can_continue': True,
+            'warnings': (),
+            'current_range': (),
+            'next_range': (),
+            'future_ranges': (),
+            'remaining_numbers': None,
+            'days_left': None,
+            'date_to': None,
+        }
         if not self.use_date_range:
-            return {'valid': True, 'message': '', 'can_continue': True}
-        
-        if not current_date:
-            current_date = fields.Date.today()
-        
-        # Obtener rango actual
-        current_range = self.date_range_ids.filtered(lambda r: 
-            r.date_from <= current_date <= r.date_to
-        )
-        
-        if not current_range:
+            return snapshot
+
+        index = self._get_date_range_index()
+        future_entries = self._get_future_range_entries(current_date)
+        next_entry = next((entry for entry in index.after(current_date) if entry.valid), None)
+        snapshot['future_ranges'] = tuple(entry.id for entry in future_entries)
+        snapshot['next_range'] = (next_entry.id,) if next_entry else ()
+
+        entries = index.containing(current_date)
+        if not entries:
             # Buscar rango futuro más cercano
-            future_range = self.get_next_available_range(current_date)
-            if future_range:
-                return {
-                    'valid': True, 
-                    'message': f'No hay rango para la fecha actual, pero existe rango futuro desde {future_range.date_from}',
-                    'can_continue': True,
-                    'next_range': future_range
-                }
+            if next_entry:
+                snapshot['message'] = f'No hay rango para la fecha actual, pero existe rango futuro desde {next_entry.date_from}'
             else:
-                return {
-                    'valid': False,
-                    'message': 'No hay rangos de fecha válidos para la fecha actual ni futuros',
-                    'can_continue': False
-                }
-        
-        current_range = current_range[0]
-        
+                snapshot.update(valid=False, can_continue=False,
+                                message='No hay rangos de fecha válidos para la fecha actual ni futuros')
+            return snapshot
+
+        entry = entries[0]
+        snapshot.update(current_range=(entry.id,), date_to=entry.date_to,
+                        days_left=(entry.date_to - current_date).days)
+
         # Validar rango actual
-        if not current_range.cai:
-            return {
-                'valid': False,
-                'message': f'El rango de fecha {current_range.date_from} - {current_range.date_to} no tiene CAI configurado',
-                'can_continue': False
-            }
-        
-        if not current_range.rangoInicial or not current_range.rangoFinal:
-            return {
-                'valid': False,
-                'message': f'El rango de fecha {current_range.date_from} - {current_range.date_to} no tiene rangos numéricos configurados',
-                'can_continue': False
-            }
-        
-        if current_range.rangoInicial >= current_range.rangoFinal:
-            return {
-                'valid': False,
-                'message': f'El rango numérico {current_range.rangoInicial}-{current_range.rangoFinal} no es válido',
-                'can_continue': False
-            }
-        
+        if not entry.has_cai:
+            snapshot.update(valid=False, can_continue=False,
+                            message=f'El rango de fecha {entry.date_from} - {entry.date_to} no tiene CAI configurado')
+            return snapshot
+
+        if not entry.has_numbers:
+            snapshot.update(valid=False, can_continue=False,
+                            message=f'El rango de fecha {entry.date_from} - {entry.date_to} no tiene rangos numéricos configurados')
+            return snapshot
+
+        current_range = self.env['ir.sequence.date_range'].browse(entry.id)
+        if not entry.numbers_ordered:
+            snapshot.update(valid=False, can_continue=False,
+                            message=f'El rango numérico {current_range.rangoInicial}-{current_range.rangoFinal} no es válido')
+            return snapshot
+
+        remaining = current_range.rangoFinal - current_range.number_next_actual + 1
+        snapshot['remaining_numbers'] = remaining
+
         # Verificar si el rango actual está próximo a vencer
         warnings = []
         can_continue = True
-        
+
         # Alerta de fecha
-        if self.dias_alerta and current_range.date_to:
-            dias_restantes = (current_range.date_to - current_date).days
-            if dias_restantes <= 0:
-                warnings.append(f'Fecha límite vencida: {current_range.date_to}')
+        if self.dias_alerta:
+            if snapshot['days_left'] <= 0:
+                warnings.append(f'Fecha límite vencida: {entry.date_to}')
                 can_continue = False
-            elif dias_restantes <= self.dias_alerta:
-                warnings.append(f'Fecha límite próxima: {current_range.date_to} (quedan {dias_restantes} días)')
-        
+            elif snapshot['days_left'] <= self.dias_alerta:
+                warnings.append(f'Fecha límite próxima: {entry.date_to} (quedan {snapshot["days_left"]} días)')
+
         # Alerta de números
-        if self.numeros_alerta and hasattr(current_range, 'rangoInicial') and hasattr(current_range, 'rangoFinal'):
-            if current_range.rangoInicial and current_range.rangoFinal:
-                numeros_restantes = current_range.rangoFinal - current_range.number_next_actual + 1
-                if numeros_restantes <= 0:
-                    warnings.append(f'Rango numérico agotado: {current_range.rangoInicial}-{current_range.rangoFinal}')
-                    can_continue = False
-                elif numeros_restantes <= self.numeros_alerta:
-                    warnings.append(f'Rango numérico próximo a agotarse: quedan {numeros_restantes} números')
-        
+        if self.numeros_alerta:
+            if remaining <= 0:
+                warnings.append(f'Rango numérico agotado: {current_range.rangoInicial}-{current_range.rangoFinal}')
+                can_continue = False
+            elif remaining <= self.numeros_alerta:
+                warnings.append(f'Rango numérico próximo a agotarse: quedan {remaining} números')
+
         # Verificar si hay subsecuencias futuras que permitan continuar
-        if not can_continue:
-            future_ranges = self.get_available_future_ranges(current_date)
-            if future_ranges:
-                can_continue = True
-                warnings.append(f'Existen {len(future_ranges)} rangos futuros disponibles que permiten continuar operaciones')
-        
-        return {
-            'valid': True,
-            'message': '; '.join(warnings) if warnings else 'Rango válido',
-            'can_continue': can_continue,
-            'current_range': current_range,
-            'warnings': warnings
-        }
+        if not can_continue and future_entries:
+            can_continue = True
+            warnings.append(f'Existen {len(future_entries)} rangos futuros disponibles que permiten continuar operaciones')
+
+        snapshot.update(
+            can_continue=can_continue,
+            warnings=tuple(warnings),
+            message='; '.join(warnings) if warnings else 'Rango válido',
+        )
+        return snapshot
+
+    def validate_sequence_continuity(self, current_date=None):
+        """
+        Validar continuidad de la secuencia fiscal, permitiendo operaciones si hay subsecuencias futuras
+        """
+        self.ensure_one()
+        return self.get_status_snapshot(current_date)
     
     def get_fiscal_sequence_status(self, current_date=None):
         """
@@ -729,16 +1240,15 @@ class IrSequence(models.Model):
         if not current_date:
             current_date = fields.Date.today()
         
-        # Validar continuidad
-        continuity = self.validate_sequence_continuity(current_date)
-        
-        # Obtener rangos futuros
-        future_ranges = self.get_available_future_ranges(current_date)
+        # Validar continuidad y obtener rangos futuros en la misma pasada
+        continuity = self.get_status_snapshot(current_date)
+        future_ranges = continuity['future_ranges']
         
         # Calcular estadísticas
-        total_ranges = len(self.date_range_ids)
-        valid_ranges = len(self.date_range_ids.filtered(lambda r: r.cai and hasattr(r, 'rangoInicial') and hasattr(r, 'rangoFinal') and r.rangoInicial and r.rangoFinal))
-        expired_ranges = len(self.date_range_ids.filtered(lambda r: r.date_to and r.date_to < current_date))
+        entries = self._get_date_range_index().entries
+        total_ranges = len(entries)
+        valid_ranges = sum(1 for entry in entries if entry.has_cai and entry.has_numbers)
+        expired_ranges = sum(1 for entry in entries if entry.date_to < current_date)
         future_ranges_count = len(future_ranges)
         
         return {
@@ -763,10 +1273,208 @@ class IrSequenceDateRange(models.Model):
     cai = fields.Char(string='CAI', help='Clave de Autorización de Impresión')
     rangoInicial = fields.Integer(string='Rango inicial', help='Rango inicial')
     rangoFinal = fields.Integer(string='Rango final', help='Rango final')
+    # Rango autorizado con prefijo y relleno, calculado una vez por rango para facturas y guías
+    numeroInicial = fields.Char(string='Número inicial', compute='_compute_numero_range', store=True)
+    numeroFinal = fields.Char(string='Número final', compute='_compute_numero_range', store=True)
     cai_validated = fields.Boolean(string='CAI Validado', default=False)
     cai_validation_date = fields.Datetime(string='Fecha de Validación CAI', readonly=True)
     cai_validation_error = fields.Text(string='Error de Validación CAI', readonly=True)
+
+    # Pronóstico de agotamiento (calculado por el proceso programado)
+    consumption_rate = fields.Float(string='Consumo Diario (EWMA)', digits=(16, 2), readonly=True)
+    forecast_days_left = fields.Integer(string='Días Estimados Restantes', readonly=True)
+    forecast_exhaustion_date = fields.Date(string='Agotamiento Estimado', readonly=True)
+    forecast_before_expiry = fields.Boolean(string='Se Agota Antes del Vencimiento', readonly=True)
     
+    @api.depends('rangoInicial', 'rangoFinal', 'sequence_id.prefix', 'sequence_id.padding')
+    def _compute_numero_range(self):
+        for date_range in self:
+            sequence = date_range.sequence_id
+            if date_range.rangoInicial and date_range.rangoFinal:
+                date_range.numeroInicial = '%s%s' % (sequence.prefix or '', str(date_range.rangoInicial).zfill(sequence.padding))
+                date_range.numeroFinal = '%s%s' % (sequence.prefix or '', str(date_range.rangoFinal).zfill(sequence.padding))
+            else:
+                date_range.numeroInicial = date_range.numeroFinal = False
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        date_ranges = super().create(vals_list)
+        date_ranges.sequence_id._bump_date_range_index()
+        self.env['ir.sequence']._invalidate_status_snapshot()
+        return date_ranges
+
+    def write(self, vals):
+        sequences = self.sequence_id
+        result = super().write(vals)
+        # Los cambios de number_next no afectan el índice de intervalos
+        if DATE_RANGE_INDEX_FIELDS.intersection(vals):
+            (sequences | self.sequence_id)._bump_date_range_index()
+        self.env['ir.sequence']._invalidate_status_snapshot()
+        return result
+
+    def unlink(self):
+        sequences = self.sequence_id
+        result = super().unlink()
+        sequences._bump_date_range_index()
+        self.env['ir.sequence']._invalidate_status_snapshot()
+        return result
+
+    def _get_number_next_actual(self):
+        """Con el contador fiscal dedicado, el próximo número real vive en el contador"""
+        super()._get_number_next_actual()
+        counters = self._get_fiscal_counters()
+        for date_range in self:
+            if date_range.id in counters:
+                date_range.number_next_actual = counters[date_range.id]
+
+    def _set_number_next_actual(self):
+        super()._set_number_next_actual()
+        counter_ranges = self.filtered(lambda r: r.sequence_id.fiscal_allocator == 'counter')
+        for date_range in counter_ranges:
+            self.env.cr.execute(
+                "UPDATE kc_fiscal_hn_fiscal_counter SET number_next = %s WHERE date_range_id = %s",
+                [date_range.number_next_actual or 1, date_range.id],
+            )
+
+    def _next(self):
+        if self.sequence_id.fiscal_allocator == 'counter':
+            return self.sequence_id.get_next_char(self._reserve_counter_block(1)[0])
+        return super()._next()
+
+    def _get_fiscal_counters(self):
+        """Próximo número de los contadores dedicados, por id de rango"""
+        counter_ranges = self.filtered(lambda r: r.id and r.sequence_id.fiscal_allocator == 'counter')
+        if not counter_ranges:
+            return {}
+        self.env.cr.execute(
+            "SELECT date_range_id, number_next FROM kc_fiscal_hn_fiscal_counter WHERE date_range_id = ANY(%s)",
+            [counter_ranges.ids],
+        )
+        return dict(self.env.cr.fetchall())
+
+    def _release_fiscal_counters(self):
+        """Copiar el valor de los contadores dedicados al rango y eliminarlos"""
+        if not self:
+            return
+        self.flush_recordset(['number_next'])
+        self.env.cr.execute("""
+            UPDATE ir_sequence_date_range AS r
+               SET number_next = c.number_next
+              FROM kc_fiscal_hn_fiscal_counter AS c
+             WHERE c.date_range_id = r.id
+               AND r.id = ANY(%s)
+        """, [self.ids])
+        self.env.cr.execute("DELETE FROM kc_fiscal_hn_fiscal_counter WHERE date_range_id = ANY(%s)", [self.ids])
+        self.invalidate_recordset(['number_next', 'number_next_actual'])
+
+    def _reserve_counter_block(self, count, limit=None):
+        """
+        Reservar `count` números en el contador dedicado del rango.
+        La reserva se confirma de inmediato en un cursor propio, en READ COMMITTED: la fila del
+        contador solo queda bloqueada lo que dura la reserva y no hasta el commit de la
+        publicación, y la fila de ir_sequence_date_range nunca se bloquea.
+        Si la transacción actual se revierte después, los números reservados se registran como
+        anulados en el libro fiscal. En pruebas, si el rango aún no está confirmado o si esta
+        misma transacción tiene bloqueado el contador, se reserva en la transacción actual.
+        """
+        self.ensure_one()
+        increment = self.sequence_id.number_increment or 1
+        self.flush_recordset(['number_next'])
+        numbers = None
+        if not self.env.registry.in_test_mode():
+            try:
+                with self.env.registry.cursor() as cr:
+                    cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+                    cr.execute("SET LOCAL lock_timeout = %s", [FISCAL_COUNTER_LOCK_TIMEOUT])
+                    numbers = self._allocate_counter_block(cr, count, increment, limit)
+            except psycopg2.errors.LockNotAvailable:
+                _logger.warning("Contador fiscal del rango %s bloqueado por la transacción actual; "
+                                "se reserva dentro de ella", self.id)
+            if numbers:
+                self._void_counter_numbers_on_rollback(numbers)
+        if numbers is None:
+            numbers = self._allocate_counter_block(self.env.cr, count, increment, limit)
+        self.invalidate_recordset(['number_next_actual'])
+        return numbers
+
+    def _allocate_counter_block(self, cr, count, increment, limit):
+        """
+        Tomar hasta `count` números del contador del rango en el cursor `cr`.
+        Devuelve None si el rango no es visible en `cr` (creado en una transacción sin confirmar).
+        """
+        # El contador arranca desde el próximo número del rango la primera vez que se usa
+        cr.execute("""
+            INSERT INTO kc_fiscal_hn_fiscal_counter (date_range_id, number_next)
+            SELECT id, number_next FROM ir_sequence_date_range WHERE id = %s
+            ON CONFLICT (date_range_id) DO NOTHING
+        """, [self.id])
+        cr.execute(
+            "SELECT number_next FROM kc_fiscal_hn_fiscal_counter WHERE date_range_id = %s FOR UPDATE",
+            [self.id],
+        )
+        row = cr.fetchone()
+        if not row:
+            return None
+        first = row[0]
+        if limit is None:
+            taken = count
+        elif first > limit:
+            taken = 0
+        else:
+            taken = min(count, (limit - first) // increment + 1)
+        if taken:
+            cr.execute(
+                "UPDATE kc_fiscal_hn_fiscal_counter SET number_next = %s WHERE date_range_id = %s",
+                [first + increment * taken, self.id],
+            )
+        return list(range(first, first + increment * taken, increment))
+
+    def _void_counter_numbers_on_rollback(self, numbers):
+        """Registrar `numbers` como anulados en el libro fiscal si la transacción actual se revierte"""
+        registry, uid = self.env.registry, self.env.uid
+        range_id = self.id
+
+        def record_void_numbers():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, {})
+                date_range = env['ir.sequence.date_range'].browse(range_id)
+                env['kc_fiscal_hn.fiscal.ledger']._record_void_numbers(date_range.sequence_id, date_range, numbers)
+                _logger.warning("Números fiscales %d..%d del rango CAI %s anulados: la transacción que los "
+                                "reservó se revirtió", numbers[0], numbers[-1], date_range.cai)
+
+        self.env.cr.postrollback.add(record_void_numbers)
+
+    def _audit_fiscal_rollover(self, next_range, numbers):
+        """Registrar en la auditoría de la secuencia que la numeración pasó de este rango agotado a `next_range`"""
+        self.ensure_one()
+        sequence = self.sequence_id
+        return self.env['kc_fiscal_hn.sequence.audit'].sudo().create({
+            'sequence_id': sequence.id,
+            'action': 'rollover',
+            'old_number': self.rangoFinal,
+            'new_number': numbers[0],
+            'reason': _('Rango CAI %s agotado: los números %s a %s se asignaron en el rango CAI %s (%s - %s)') % (
+                self.cai, numbers[0], numbers[-1], next_range.cai, next_range.date_from, next_range.date_to),
+            'company_id': sequence.company_id.id or self.env.company.id,
+        })
+
+    def _reserve_fiscal_block(self, count):
+        """
+        Reservar un bloque contiguo de `count` números del rango bloqueando la fila una sola vez.
+        Nunca se reserva por encima de rangoFinal; devuelve los números obtenidos.
+        """
+        self.ensure_one()
+        # Los números restantes cambian: el estado memorizado ya no es válido
+        self.sequence_id._invalidate_status_snapshot()
+        if self.sequence_id.fiscal_allocator == 'counter':
+            return self._reserve_counter_block(count, limit=self.rangoFinal or None)
+        if self.sequence_id.implementation == 'standard':
+            seq_id = 'ir_sequence_%03d_%03d' % (self.sequence_id.id, self.id)
+            return [_select_nextval(self.env.cr, seq_id) for _i in range(count)]
+        return _reserve_nogap_block(
+            self, count, self.sequence_id.number_increment, limit=self.rangoFinal or None
+        )
+
     @api.constrains('rangoInicial', 'rangoFinal')
     def _check_cai_ranges(self):
         """Validar que los rangos del CAI sean válidos"""
@@ -840,3 +1548,17 @@ class IrSequenceDateRange(models.Model):
                     'type': 'danger',
                 }
             }
+
+
+class FiscalCounter(models.Model):
+    _name = 'kc_fiscal_hn.fiscal.counter'
+    _description = 'Contador Fiscal por Rango'
+    _log_access = False
+
+    date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango de Fecha', required=True,
+                                    ondelete='cascade', readonly=True)
+    number_next = fields.Integer(string='Próximo Número', required=True, readonly=True)
+
+    _sql_constraints = [
+        ('date_range_unique', 'unique(date_range_id)', 'Solo puede existir un contador por rango de fecha.'),
+    ]
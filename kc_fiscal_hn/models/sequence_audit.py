@@ -14,7 +14,9 @@ class SequenceAudit(models.Model):
         ('reset', 'Reinicio'),
         ('modify', 'Modificación'),
         ('create', 'Creación'),
-        ('delete', 'Eliminación')
+        ('delete', 'Eliminación'),
+        ('repair', 'Reparación'),
+        ('rollover', 'Cambio de Rango CAI'),
     ], string='Acción', required=True)
     
     old_number = fields.Integer(string='Número Anterior')
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import logging
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 
+_logger = logging.getLogger(__name__)
+
 
 class StockPickingType(models.Model):
     _inherit = "stock.picking.type"
@@ -23,12 +27,24 @@ class StockPicking(models.Model):
         index=True,
     )
 
-    cai = fields.Char(string='CAI', help='Clave de Autorización de Impresión')
+    # Rango CAI con el que se numeró la guía; el CAI y el rango autorizado se leen de él
+    fiscal_date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango CAI', copy=False,
+                                           readonly=True, index='btree_not_null', ondelete='restrict')
+    cai = fields.Char(string='CAI', help='Clave de Autorización de Impresión',
+                      compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
     fechaLimiteEmision = fields.Datetime(string='Fecha límite de emisión',
-                                         help='Fecha límite de emisión de facturas')
+                                         help='Fecha límite de emisión de facturas',
+                                         compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
     numeroInicial = fields.Char(string='Número inicial',
-                                help='Número inicial de facturación', )
-    numeroFinal = fields.Char(string='Número final', help='Número final de facturación', )
+                                help='Número inicial de facturación',
+                                compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
+    numeroFinal = fields.Char(string='Número final', help='Número final de facturación',
+                              compute='_compute_fiscal_range_info', inverse='_inverse_fiscal_range_info')
+    # Valores capturados a mano en guías sin rango CAI en el sistema
+    cai_manual = fields.Char(string='CAI (Manual)', copy=False)
+    fecha_limite_manual = fields.Datetime(string='Fecha Límite (Manual)', copy=False)
+    numero_inicial_manual = fields.Char(string='Número Inicial (Manual)', copy=False)
+    numero_final_manual = fields.Char(string='Número Final (Manual)', copy=False)
 
     motivo_traslado = fields.Selection([
         ('venta', 'Venta'),
@@ -76,39 +92,81 @@ class StockPicking(models.Model):
     total_isv = fields.Float(string='Total ISV', 
                             compute='_compute_totals', store=True)
 
+    @api.depends('fiscal_date_range_id', 'cai_manual', 'fecha_limite_manual',
+                 'numero_inicial_manual', 'numero_final_manual')
+    def _compute_fiscal_range_info(self):
+        for picking in self:
+            date_range = picking.fiscal_date_range_id
+            picking.cai = picking.cai_manual or date_range.cai
+            picking.fechaLimiteEmision = picking.fecha_limite_manual or date_range.date_to
+            picking.numeroInicial = picking.numero_inicial_manual or date_range.numeroInicial
+            picking.numeroFinal = picking.numero_final_manual or date_range.numeroFinal
+
+    def _inverse_fiscal_range_info(self):
+        for picking in self:
+            date_range = picking.fiscal_date_range_id
+            range_limit = fields.Datetime.to_datetime(date_range.date_to) if date_range.date_to else False
+            # Solo se guarda lo que difiere del rango CAI de la guía
+            picking.cai_manual = picking.cai if picking.cai != date_range.cai else False
+            picking.fecha_limite_manual = picking.fechaLimiteEmision if picking.fechaLimiteEmision != range_limit else False
+            picking.numero_inicial_manual = picking.numeroInicial if picking.numeroInicial != date_range.numeroInicial else False
+            picking.numero_final_manual = picking.numeroFinal if picking.numeroFinal != date_range.numeroFinal else False
+
     def update_custom_fields(self):
-        """Función para actualizar la información de numeración y CAI usando sequence_sar_id de stock.picking.type."""
+        """
+        Función para actualizar la información de numeración y CAI usando sequence_sar_id de stock.picking.type.
+        Las guías se agrupan por (secuencia SAR, rango CAI): cada grupo resuelve su rango una sola
+        vez en el índice de rangos, reserva un bloque contiguo y escribe sar_name y el rango en bloque.
+        Si el rango CAI se agota, el agotamiento se registra en el log y las guías sin número
+        disponible quedan sin sar_name, sin interrumpir la actualización de las demás.
+        """
+        groups = {}
         for record in self:
             picking_type = record.picking_type_id
             if not picking_type or not picking_type.sequence_sar_id:
                 raise UserError(_('El tipo de operación no tiene una secuencia SAR asignada.'))
 
             sequence_sar = picking_type.sequence_sar_id
-
-            if sequence_sar.use_date_range:
-                date = record.scheduled_date or fields.Date.today()
-
-                # Obtener el rango de numeración aplicable
-                seq_date = self.env['ir.sequence.date_range'].search(
-                    [('sequence_id', '=', sequence_sar.id),
-                     ('date_from', '<=', date),
-                     ('date_to', '>=', date)], limit=1)
-
-                if not seq_date or not seq_date.cai:
-                    raise UserError(
-                        _('No se encontró rango de numeración o CAI configurado. '
-                          'Revise que los rangos de fechas sean correctos y que la información del CAI esté ingresada.'))
-
-                numeroinicial = str(seq_date.rangoInicial).zfill(sequence_sar.padding)
-                numeroFinal = str(seq_date.rangoFinal).zfill(sequence_sar.padding)
-
-                record.numeroInicial = sequence_sar.prefix + numeroinicial
-                record.numeroFinal = sequence_sar.prefix + numeroFinal
-                record.cai = seq_date.cai
-                record.fechaLimiteEmision = seq_date.date_to
-
-                # Asignar el valor de sar_name usando la secuencia
-                record.sar_name = sequence_sar.next_by_id(sequence_date=record.date_done)
+            if not sequence_sar.use_date_range:
+                continue
+
+            # Obtener el rango de numeración aplicable
+            date = fields.Date.to_date(record.scheduled_date) or fields.Date.today()
+            entry = sequence_sar._get_date_range_entry(date)
+            if not entry or not entry.has_cai:
+                raise UserError(
+                    _('No se encontró rango de numeración o CAI configurado. '
+                      'Revise que los rangos de fechas sean correctos y que la información del CAI esté ingresada.'))
+            groups.setdefault((sequence_sar, entry.id), []).append(record.id)
+
+        for (sequence_sar, range_id), picking_ids in groups.items():
+            seq_date = self.env['ir.sequence.date_range'].browse(range_id)
+            pickings = self.browse(picking_ids)
+            # Reservar el bloque en el rango cuyo CAI se registra
+            numbers = seq_date._reserve_fiscal_block(len(pickings))
+            if len(numbers) < len(pickings):
+                _logger.error("Rango de numeración del CAI %s agotado: %d guías quedan sin número SAR",
+                              seq_date.cai, len(pickings) - len(numbers))
+                pickings = pickings[:len(numbers)]
+                if not pickings:
+                    continue
+            # El prefijo se interpola una vez por fecha de la guía, no por guía
+            numbers_by_date = {}
+            for picking, number in zip(pickings, numbers):
+                date_picking_ids, date_numbers = numbers_by_date.setdefault(
+                    fields.Date.to_date(picking.date_done), ([], []))
+                date_picking_ids.append(picking.id)
+                date_numbers.append(number)
+            picking_ids, picking_numbers, names = [], [], []
+            for date, (date_picking_ids, date_numbers) in numbers_by_date.items():
+                picking_ids.extend(date_picking_ids)
+                picking_numbers.extend(date_numbers)
+                names.extend(sequence_sar._get_fiscal_names(date_numbers, date=date, date_range=seq_date.date_from))
+            pickings = self.browse(picking_ids)
+            # CAI, fecha límite y rango autorizado se leen del rango
+            pickings.write({'fiscal_date_range_id': seq_date.id})
+            pickings._write_sar_values('sar_name', names)
+            self.env['kc_fiscal_hn.fiscal.ledger']._record_pickings(pickings, sequence_sar, seq_date, picking_numbers)
 
         return {
             'effect': {
@@ -127,16 +185,28 @@ class StockPicking(models.Model):
     def action_confirm(self):
         """Sobrescribimos para generar número de guía si es necesario"""
         result = super().action_confirm()
-        
-        for picking in self:
-            if picking.picking_type_code == 'outgoing' and not picking.numero_guia:
-                # Generar número de guía para salidas
-                sequence = self.env['ir.sequence'].search([
-                    ('is_fiscal', '=', True),
-                    ('code', '=', 'stock.picking.guide')
-                ], limit=1)
-                
-                if sequence:
-                    picking.numero_guia = sequence.next_by_id()
-        
-        return result
\ No newline at end of file
+
+        # Generar número de guía para salidas: la secuencia se busca una vez por lote
+        pickings = self.filtered(lambda p: p.picking_type_code == 'outgoing' and not p.numero_guia)
+        if pickings:
+            sequence = self.env['ir.sequence'].search([
+                ('is_fiscal', '=', True),
+                ('code', '=', 'stock.picking.guide')
+            ], limit=1)
+            if sequence:
+                pickings._write_sar_values('numero_guia', sequence._next_fiscal_block(len(pickings)))
+
+        return result
+
+    def _write_sar_values(self, field_name, values):
+        """Escribir sar_name o numero_guia de todas las guías en una sola sentencia"""
+        assert field_name in ('sar_name', 'numero_guia')
+        self.flush_recordset([field_name])
+        self.env.cr.execute("""
+            UPDATE stock_picking AS p
+               SET %s = v.value
+              FROM unnest(%%s::int[], %%s::varchar[]) AS v(id, value)
+             WHERE p.id = v.id
+        """ % field_name, [self.ids, values])
+        self.invalidate_recordset([field_name])
+        self.modified([field_name])
\ No newline at end of file
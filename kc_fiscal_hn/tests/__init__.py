@@ -1 +1,2 @@
 from . import test_account_move_name_seq
+from . import test_fiscal_batch_post
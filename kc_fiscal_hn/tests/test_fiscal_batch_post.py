@@ -0,0 +1,775 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields
+from odoo.exceptions import UserError, ValidationError
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase, new_test_user
+
+
+@tagged("post_install", "-at_install")
+class TestFiscalBatchPost(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.company = self.env.ref("base.main_company")
+        self.journal = self.env["account.journal"].create(
+            {
+                "name": "Test Fiscal Sales Journal",
+                "code": "TFSJ",
+                "type": "sale",
+                "company_id": self.company.id,
+                "document_fiscal": "client",
+            }
+        )
+        self.sequence = self.journal.sequence_id
+        self.sequence.write({"is_fiscal": True, "prefix": "000-001-01-", "padding": 8})
+        self.today = fields.Date.today()
+        self.date_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": fields.Date.subtract(self.today, days=10),
+                "date_to": fields.Date.add(self.today, days=365),
+                "number_next": 1,
+                "cai": "ABCDEF-123456-789012-345678-901234-56",
+                "rangoInicial": 1,
+                "rangoFinal": 10,
+            }
+        )
+        self.partner = self.env.ref("base.res_partner_3")
+        self.account = self.env["account.account"].search(
+            [("account_type", "=", "income")], limit=1
+        )
+
+    def _create_invoices(self, count):
+        return self.env["account.move"].create(
+            [
+                {
+                    "move_type": "out_invoice",
+                    "journal_id": self.journal.id,
+                    "partner_id": self.partner.id,
+                    "invoice_date": self.today,
+                    "invoice_line_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "name": "Producto %s" % index,
+                                "account_id": self.account.id,
+                                "price_unit": 1000.0,
+                                "quantity": 1,
+                                "tax_ids": [],
+                            },
+                        )
+                    ],
+                }
+                for index in range(count)
+            ]
+        )
+
+    def test_batch_post_contiguous_numbers(self):
+        invoices = self._create_invoices(5)
+        self.assertEqual(set(invoices.mapped("name")), {"/"})
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(
+            invoices.mapped("name"),
+            ["000-001-01-%s" % str(number).zfill(8) for number in range(1, 6)],
+        )
+        self.assertEqual(set(invoices.mapped("cai")), {self.date_range.cai})
+        self.assertEqual(set(invoices.mapped("numeroInicial")), {"000-001-01-00000001"})
+        self.assertEqual(set(invoices.mapped("numeroFinal")), {"000-001-01-00000010"})
+        self.assertEqual(set(invoices.mapped("fechaLimiteEmision")), {self.date_range.date_to})
+        self.assertEqual(self.date_range.number_next_actual, 6)
+
+    def test_batch_post_never_exceeds_range(self):
+        self.date_range.rangoFinal = 3
+        invoices = self._create_invoices(5)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(
+            invoices[:3].mapped("name"),
+            ["000-001-01-00000001", "000-001-01-00000002", "000-001-01-00000003"],
+        )
+        self.assertEqual(set(invoices[3:].mapped("name")), {"/"})
+        self.assertEqual(self.date_range.number_next_actual, 4)
+
+    def test_deferred_numbering_queue(self):
+        self.sequence.fiscal_numbering_mode = "deferred"
+        invoices = self._create_invoices(3)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(set(invoices.mapped("state")), {"posted"})
+        self.assertEqual(set(invoices.mapped("name")), {"/"})
+        self.assertTrue(all(invoices.mapped("fiscal_number_pending")))
+        self.assertEqual(self.date_range.number_next_actual, 1)
+
+        self.env["account.move"]._cron_assign_deferred_fiscal_numbers(auto_commit=False)
+        self.assertEqual(
+            invoices.mapped("name"),
+            ["000-001-01-00000001", "000-001-01-00000002", "000-001-01-00000003"],
+        )
+        self.assertFalse(any(invoices.mapped("fiscal_number_pending")))
+        self.assertEqual(set(invoices.mapped("cai")), {self.date_range.cai})
+
+    def test_counter_allocator(self):
+        self.sequence.fiscal_allocator = "counter"
+        invoices = self._create_invoices(3)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(
+            invoices.mapped("name"),
+            ["000-001-01-00000001", "000-001-01-00000002", "000-001-01-00000003"],
+        )
+        # El rango no se toca: el próximo número vive en el contador dedicado
+        self.assertEqual(self.date_range.number_next, 1)
+        self.assertEqual(self.date_range.number_next_actual, 4)
+        self.sequence.fiscal_allocator = "sequence"
+        self.assertEqual(self.date_range.number_next, 4)
+
+    def test_ledger_records_allocations(self):
+        invoices = self._create_invoices(3)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        ledger = self.env["kc_fiscal_hn.fiscal.ledger"].search([("sequence_id", "=", self.sequence.id)])
+        self.assertEqual(ledger.move_id, invoices)
+        self.assertEqual(sorted(ledger.mapped("number")), [1, 2, 3])
+        self.assertEqual(set(ledger.mapped("cai")), {self.date_range.cai})
+        invoices[0].button_cancel()
+        self.assertTrue(invoices[0].fiscal_ledger_ids.is_void)
+        with self.assertRaises(UserError):
+            ledger.unlink()
+
+    def test_range_check_reports_gaps_and_duplicates(self):
+        ledger = self.env["kc_fiscal_hn.fiscal.ledger"]
+        for number in (1, 2, 4, 4, 12):
+            ledger.create({
+                "sequence_id": self.sequence.id,
+                "date_range_id": self.date_range.id,
+                "cai": self.date_range.cai,
+                "number": number,
+            })
+        check = self.env["kc_fiscal_hn.fiscal.range.check"].check_date_ranges(self.date_range)
+        self.assertEqual(check.state, "issues")
+        self.assertEqual(check.last_number, 4)
+        self.assertEqual((check.missing_count, check.missing_numbers), (1, "3"))
+        self.assertEqual((check.duplicate_count, check.duplicate_numbers), (1, "4"))
+        self.assertEqual((check.out_of_range_count, check.out_of_range_numbers), (1, "12"))
+
+    def test_date_range_index(self):
+        next_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": fields.Date.add(self.today, days=366),
+                "date_to": fields.Date.add(self.today, days=730),
+                "cai": "ABCDEF-123456-789012-345678-901234-57",
+                "rangoInicial": 11,
+                "rangoFinal": 20,
+            }
+        )
+        self.assertEqual(self.sequence._get_date_range_entry(self.today).id, self.date_range.id)
+        self.assertEqual(self.sequence.get_next_available_range(self.today), next_range)
+        self.assertEqual(self.sequence.get_available_future_ranges(self.today), self.date_range | next_range)
+        # Modificar el rango invalida el índice
+        next_range.cai = False
+        self.assertFalse(self.sequence.get_next_available_range(self.today))
+
+    def test_status_snapshot(self):
+        snapshot = self.sequence.get_status_snapshot(self.today)
+        self.assertEqual(snapshot["current_range"], self.date_range)
+        self.assertEqual(snapshot["remaining_numbers"], 10)
+        self.assertEqual(snapshot["days_left"], 365)
+        self.assertTrue(snapshot["can_continue"])
+        # Asignar números descarta el estado memorizado
+        self._create_invoices(3).with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(self.sequence.get_status_snapshot(self.today)["remaining_numbers"], 7)
+
+    def test_range_exhaustion_forecast(self):
+        self.sequence.dias_alerta = 30
+        self._create_invoices(4).with_context(skip_fiscal_warning=True).action_post()
+        forecasts = self.env["ir.sequence"]._forecast_range_exhaustion()
+        forecast = next(f for f in forecasts if f["date_range_id"] == self.date_range.id)
+        self.assertEqual(forecast["remaining"], 6)
+        self.assertGreater(forecast["rate"], 0)
+        self.assertTrue(self.date_range.forecast_before_expiry)
+        self.assertEqual(
+            self.date_range.forecast_exhaustion_date,
+            fields.Date.add(fields.Date.context_today(self.sequence), days=forecast["days_left"]),
+        )
+        self.env["ir.sequence"]._generate_forecast_alerts(forecasts)
+        self.assertTrue(self.env["kc_fiscal_hn.sequence.alert"].search([("sequence_id", "=", self.sequence.id)]))
+
+    def test_batch_post_rolls_over_to_next_range(self):
+        self.date_range.rangoFinal = 3
+        next_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": self.today,
+                "date_to": fields.Date.add(self.today, days=730),
+                "cai": "ABCDEF-123456-789012-345678-901234-57",
+                "rangoInicial": 101,
+                "rangoFinal": 200,
+                "number_next": 101,
+            }
+        )
+        invoices = self._create_invoices(5)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(
+            invoices.mapped("name"),
+            ["000-001-01-%s" % str(number).zfill(8) for number in (1, 2, 3, 101, 102)],
+        )
+        self.assertEqual(set(invoices[3:].mapped("cai")), {next_range.cai})
+        self.assertEqual(set(invoices[3:].mapped("numeroInicial")), {"000-001-01-00000101"})
+        self.assertEqual(set(invoices[3:].mapped("numeroFinal")), {"000-001-01-00000200"})
+        self.assertEqual(next_range.date_from, self.today)
+        audit = self.env["kc_fiscal_hn.sequence.audit"].search(
+            [("sequence_id", "=", self.sequence.id), ("action", "=", "rollover")])
+        self.assertEqual((audit.old_number, audit.new_number), (3, 101))
+
+    def test_batch_post_rollover_keeps_authorized_dates(self):
+        self.date_range.rangoFinal = 3
+        future_from = fields.Date.add(self.today, days=366)
+        next_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": future_from,
+                "date_to": fields.Date.add(self.today, days=730),
+                "cai": "ABCDEF-123456-789012-345678-901234-57",
+                "rangoInicial": 101,
+                "rangoFinal": 200,
+                "number_next": 101,
+            }
+        )
+        invoices = self._create_invoices(5)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(set(invoices[3:].mapped("name")), {"/"})
+        self.assertEqual(next_range.date_from, future_from)
+        self.assertEqual(next_range.number_next_actual, 101)
+
+    def test_fiscal_number_lease(self):
+        info = self.sequence.lease_fiscal_numbers(4, device="Camión 7")
+        self.assertEqual((info["number_from"], info["number_to"]), (1, 4))
+        self.assertEqual(info["first_name"], "000-001-01-00000001")
+        self.assertEqual(self.date_range.number_next_actual, 5)
+        lease = self.env["kc_fiscal_hn.fiscal.lease"].browse(info["lease_id"])
+        lease.register_usage([1, 2])
+        lease.expires_at = fields.Datetime.subtract(fields.Datetime.now(), hours=1)
+        self.env["kc_fiscal_hn.fiscal.lease"]._cron_expire_fiscal_leases()
+        self.assertEqual(lease.state, "expired")
+        self.assertEqual(sorted(lease.ledger_ids.filtered("is_void").mapped("number")), [3, 4])
+        self.assertEqual(lease.used_count, 2)
+        self.assertEqual(info["numeroInicial"], self.date_range.numeroInicial)
+        self.assertEqual(info["numeroFinal"], self.date_range.numeroFinal)
+
+    def test_fiscal_number_lease_requires_account_manager(self):
+        user = new_test_user(self.env, login="kc_lease_invoicer", groups="account.group_account_invoice")
+        with self.assertRaises(ValidationError):
+            self.sequence.with_user(user).lease_fiscal_numbers(2)
+        self.assertEqual(self.date_range.number_next_actual, 1)
+        info = self.sequence.lease_fiscal_numbers(2)
+        lease = self.env["kc_fiscal_hn.fiscal.lease"].browse(info["lease_id"])
+        with self.assertRaises(ValidationError):
+            lease.with_user(user).register_usage([1])
+        self.assertFalse(lease.ledger_ids)
+
+    def test_fiscal_lease_void_names_exceed_padding(self):
+        self.sequence.padding = 1
+        info = self.sequence.lease_fiscal_numbers(10)
+        lease = self.env["kc_fiscal_hn.fiscal.lease"].browse(info["lease_id"])
+        lease.action_close()
+        void_names = dict(lease.ledger_ids.mapped(lambda line: (line.number, line.name)))
+        self.assertEqual(void_names[10], "000-001-01-10")
+        self.assertEqual(void_names[10], self.sequence._get_fiscal_names([10], date_range=self.date_range.date_from)[0])
+
+    def test_refresh_fiscal_usage_stats(self):
+        self.sequence.write({"fiscal_range_start": 1, "fiscal_range_end": 10})
+        self.sequence.flush_recordset()
+        # Simular la asignación no_gap, que avanza number_next por SQL
+        self.env.cr.execute("UPDATE ir_sequence SET number_next = 9 WHERE id = %s", [self.sequence.id])
+        self.assertIn(self.sequence, self.sequence._refresh_fiscal_usage_stats())
+        self.assertEqual(self.sequence.current_fiscal_number, 9)
+        self.assertEqual(self.sequence.fiscal_usage_count, 8)
+        self.assertAlmostEqual(self.sequence.fiscal_usage_percentage, 80.0)
+        self.assertEqual(self.sequence.fiscal_status, "warning")
+
+    def test_resequence_wizard_dry_run_and_apply(self):
+        invoices = self._create_invoices(3)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        invoices.flush_recordset()
+        # Simular datos dañados: un CAI incorrecto y una factura publicada sin número
+        self.env.cr.execute("UPDATE account_move SET cai_manual = 'CAI-ERRONEO' WHERE id = %s", [invoices[0].id])
+        self.env.cr.execute("UPDATE account_move SET name = '/' WHERE id = %s", [invoices[2].id])
+        invoices.invalidate_recordset(["name", "cai_manual"])
+        wizard = self.env["kc_fiscal_hn.wizard.resequence"].create(
+            {
+                "journal_id": self.journal.id,
+                "move_type": "out_invoice",
+                "date_from": self.today,
+                "date_to": self.today,
+            }
+        )
+        wizard.action_compute_diff()
+        self.assertEqual((wizard.metadata_count, wizard.number_count, wizard.unavailable_count), (1, 1, 0))
+        self.assertEqual(invoices[0].cai, "CAI-ERRONEO")
+        number_line = wizard.line_ids.filtered(lambda line: line.change_type == "number")
+        self.assertEqual(number_line.new_name, "000-001-01-00000004")
+
+        wizard.action_apply()
+        self.assertEqual(invoices[0].cai, self.date_range.cai)
+        self.assertEqual(invoices[2].name, "000-001-01-00000004")
+        audits = self.env["kc_fiscal_hn.sequence.audit"].search(
+            [("sequence_id", "=", self.sequence.id), ("action", "=", "repair")]
+        )
+        self.assertEqual(len(audits), 2)
+
+    def test_fiscal_post_blockers(self):
+        self.date_range.rangoFinal = 3
+        invoices = self._create_invoices(4)
+        blockers = invoices._get_fiscal_post_blockers()
+        self.assertEqual(list(blockers), [invoices[3].id])
+        self.assertIn("agotado", blockers[invoices[3].id][0])
+        self.assertEqual(self.date_range.number_next_actual, 1)
+
+    def _create_branch_journal(self):
+        branch_journal = self.env["account.journal"].create(
+            {
+                "name": "Test Fiscal Branch Journal",
+                "code": "TFBJ",
+                "type": "sale",
+                "company_id": self.company.id,
+                "document_fiscal": "client",
+            }
+        )
+        branch_journal.sequence_id.write({"is_fiscal": True, "prefix": "001-001-01-", "padding": 8})
+        self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": branch_journal.sequence_id.id,
+                "date_from": fields.Date.subtract(self.today, days=10),
+                "date_to": fields.Date.add(self.today, days=365),
+                "number_next": 1,
+                "cai": "ABCDEF-123456-789012-345678-901234-58",
+                "rangoInicial": 1,
+                "rangoFinal": 10,
+            }
+        )
+        return branch_journal
+
+    def test_post_fiscal_groups_parallel(self):
+        # En modo de prueba los hilos reciben cursores de prueba: se ejercita el camino con hilos
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        branch_journal = self._create_branch_journal()
+        invoices = self._create_invoices(2)
+        branch_invoices = self._create_invoices(2)
+        branch_invoices.journal_id = branch_journal
+        report = (invoices | branch_invoices)._post_fiscal_groups_parallel()
+        self.assertEqual(len(report), 2)
+        self.assertFalse(any(group["error"] for group in report))
+        self.assertTrue(all(group["committed"] for group in report))
+        self.assertEqual(invoices.mapped("name"), ["000-001-01-00000001", "000-001-01-00000002"])
+        self.assertEqual(branch_invoices.mapped("name"), ["001-001-01-00000001", "001-001-01-00000002"])
+
+    def test_post_fiscal_groups_parallel_partial_commit(self):
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        branch_journal = self._create_branch_journal()
+        invoices = self._create_invoices(2)
+        # Sin líneas la factura no se puede publicar: su grupo falla y se revierte
+        empty_invoice = self.env["account.move"].create(
+            {"move_type": "out_invoice", "journal_id": branch_journal.id, "partner_id": self.partner.id,
+             "invoice_date": self.today}
+        )
+        action = (invoices | empty_invoice).action_post_parallel()
+        self.assertEqual(set(invoices.mapped("state")), {"posted"})
+        self.assertEqual(empty_invoice.state, "draft")
+        self.assertEqual(action["params"]["type"], "warning")
+        self.assertIn("Publicación parcial", action["params"]["message"])
+
+    def test_emission_point_numbering(self):
+        point_sequence = self.env["ir.sequence"].create(
+            {
+                "name": "Punto 000-002",
+                "company_id": self.company.id,
+                "implementation": "no_gap",
+                "is_fiscal": True,
+                "use_date_range": True,
+                "prefix": "000-002-01-",
+                "padding": 8,
+            }
+        )
+        self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": point_sequence.id,
+                "date_from": fields.Date.subtract(self.today, days=10),
+                "date_to": fields.Date.add(self.today, days=365),
+                "number_next": 1,
+                "cai": "ABCDEF-123456-789012-345678-901234-59",
+                "rangoInicial": 1,
+                "rangoFinal": 10,
+            }
+        )
+        point = self.env["kc_fiscal_hn.emission.point"].create(
+            {
+                "name": "Caja 2",
+                "establishment": "000",
+                "point": "002",
+                "sequence_id": point_sequence.id,
+                "journal_ids": [(6, 0, self.journal.ids)],
+                "user_ids": [(6, 0, self.env.user.ids)],
+            }
+        )
+        invoices = self._create_invoices(2)
+        self.assertEqual(invoices.emission_point_id, point)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(invoices.mapped("name"), ["000-002-01-00000001", "000-002-01-00000002"])
+        self.assertEqual(set(invoices.mapped("cai")), {"ABCDEF-123456-789012-345678-901234-59"})
+        self.assertEqual(self.date_range.number_next_actual, 1)
+        # Sin secuencia de notas de crédito en el punto, las notas de crédito usan la del diario
+        refund = invoices[0]._reverse_moves()
+        self.assertEqual(refund.emission_point_id, point)
+        self.assertNotEqual(refund._get_fiscal_sequence_config()[1], point_sequence.id)
+        self.assertEqual(refund._get_fiscal_sequence_config(), self.journal._get_fiscal_sequence_config("out_refund"))
+        # Reasignar el punto invalida solo su asignación memorizada
+        point.user_ids = [(5, 0, 0)]
+        self.assertFalse(self._create_invoices(1).emission_point_id)
+
+    def test_move_references_cai_range(self):
+        self.assertEqual(self.date_range.numeroInicial, "000-001-01-00000001")
+        self.assertEqual(self.date_range.numeroFinal, "000-001-01-00000010")
+        invoices = self._create_invoices(2)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(invoices.fiscal_date_range_id, self.date_range)
+        self.assertFalse(any(invoices.mapped("cai_manual")))
+        self.assertEqual(invoices[0].numeroFinal, "000-001-01-00000010")
+        self.assertEqual(invoices[0].fechaLimiteEmision, self.date_range.date_to)
+        self.assertEqual(self.env["account.move"].search([("cai", "=", self.date_range.cai)]), invoices)
+
+    def test_prewarm_fiscal_ranges_with_pending_cai(self):
+        self.sequence.write(
+            {
+                "pending_cai": "ABCDEF-123456-789012-345678-901234-60",
+                "pending_rango_inicial": 11,
+                "pending_rango_final": 20,
+                "pending_cai_date_to": fields.Date.add(self.date_range.date_to, days=180),
+            }
+        )
+        today = fields.Date.subtract(self.date_range.date_to, days=3)
+        created = self.sequence._prewarm_fiscal_ranges(today=today)
+        self.assertEqual(created.date_from, fields.Date.add(self.date_range.date_to, days=1))
+        self.assertEqual((created.cai, created.rangoInicial, created.number_next_actual),
+                         ("ABCDEF-123456-789012-345678-901234-60", 11, 11))
+        self.assertFalse(self.sequence.pending_cai)
+        self.assertFalse(self.sequence._prewarm_fiscal_ranges(today=today))
+
+    def test_batch_picking_sar_numbering(self):
+        picking_type = self.env.ref("stock.picking_type_out")
+        picking_type.sequence_sar_id = self.sequence
+        product = self.env["product.product"].create({"name": "Producto Guía", "type": "consu"})
+        pickings = self.env["stock.picking"].create(
+            [
+                {
+                    "picking_type_id": picking_type.id,
+                    "location_id": picking_type.default_location_src_id.id,
+                    "location_dest_id": self.env.ref("stock.stock_location_customers").id,
+                    "move_ids": [
+                        (0, 0, {
+                            "name": product.name,
+                            "product_id": product.id,
+                            "product_uom_qty": 1,
+                            "location_id": picking_type.default_location_src_id.id,
+                            "location_dest_id": self.env.ref("stock.stock_location_customers").id,
+                        })
+                    ],
+                }
+                for _index in range(3)
+            ]
+        )
+        pickings.update_custom_fields()
+        self.assertEqual(
+            pickings.mapped("sar_name"),
+            ["000-001-01-%s" % str(number).zfill(8) for number in range(1, 4)],
+        )
+        self.assertEqual(pickings.fiscal_date_range_id, self.date_range)
+        self.assertEqual(set(pickings.mapped("cai")), {self.date_range.cai})
+        ledger = self.env["kc_fiscal_hn.fiscal.ledger"].search([("picking_id", "in", pickings.ids)])
+        self.assertEqual(sorted(ledger.mapped("number")), [1, 2, 3])
+
+        # Rango agotado: se registra y las guías sin número quedan pendientes, sin error
+        self.date_range.rangoFinal = 4
+        more_pickings = pickings[0].copy({"sar_name": False}) | pickings[1].copy({"sar_name": False})
+        more_pickings.update_custom_fields()
+        self.assertEqual(more_pickings.mapped("sar_name"), ["000-001-01-00000004", False])
+
+    def test_fiscal_name_prefix_pattern(self):
+        self.assertEqual(self.sequence._get_fiscal_name_pattern(), "000-001-01-%")
+        invoices = self._create_invoices(2)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        domain = self.sequence.action_view_fiscal_usage()["domain"]
+        self.assertEqual(self.env["account.move"].search(domain), invoices)
+        self.sequence.prefix = "GR_%(range_year)s/"
+        self.assertEqual(self.sequence._get_fiscal_name_pattern(), "GR\\_%")
+
+    def _create_tax(self, name, amount, tipo_impuesto):
+        group = self.env["account.tax.group"].create(
+            {"name": name, "company_id": self.company.id}
+        )
+        return self.env["account.tax"].create(
+            {
+                "name": name,
+                "amount": amount,
+                "amount_type": "percent",
+                "type_tax_use": "sale",
+                "tax_group_id": group.id,
+                "company_id": self.company.id,
+                "tipo_impuesto": tipo_impuesto,
+            }
+        )
+
+    def test_fiscal_amounts_single_pass(self):
+        isv15 = self._create_tax("ISV 15%", 15, "isv")
+        isv18 = self._create_tax("ISV 18%", 18, "isv")
+        exento = self._create_tax("Exento", 0, "exento")
+        exonerado = self._create_tax("Exonerado", 0, "exonerado")
+        lines = [
+            (1000.0, 10.0, isv15),
+            (500.0, 0.0, isv18),
+            (200.0, 0.0, exento),
+            (300.0, 0.0, exonerado),
+            (100.0, 0.0, self.env["account.tax"]),
+        ]
+        invoice = self.env["account.move"].create(
+            {
+                "move_type": "out_invoice",
+                "journal_id": self.journal.id,
+                "partner_id": self.partner.id,
+                "invoice_date": self.today,
+                "invoice_line_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "name": "Linea %s" % index,
+                            "account_id": self.account.id,
+                            "price_unit": price,
+                            "quantity": 1,
+                            "discount": discount,
+                            "tax_ids": [(6, 0, taxes.ids)],
+                        },
+                    )
+                    for index, (price, discount, taxes) in enumerate(lines)
+                ],
+            }
+        )
+        self.assertEqual(invoice.amount_discount, 100.0)
+        self.assertEqual(invoice.amount_exento, 300.0)
+        self.assertEqual(invoice.amount_exonerado, 300.0)
+        self.assertEqual(invoice.gravado_isv15, 900.0)
+        self.assertEqual(invoice.amount_isv15, 135.0)
+        self.assertEqual(invoice.gravado_isv18, 500.0)
+        self.assertEqual(invoice.amount_isv18, 90.0)
+        self.assertEqual(invoice.base_imponible_total, 1400.0)
+        self.assertEqual(invoice.isv_total, 225.0)
+
+    def test_tax_fiscal_class_map(self):
+        Tax = self.env["account.tax"]
+        exento = self._create_tax("Exento", 0, "exento")
+        isv15 = self._create_tax("ISV 15%", 15, "isv")
+        class_map = Tax._get_fiscal_class_map(self.company.id)
+        self.assertEqual(class_map[exento.id], "exento")
+        self.assertEqual(class_map[isv15.id], "isv15")
+
+        # Renombrar el grupo no cambia la clasificación ni los totales
+        exento.tax_group_id.name = "Gravado"
+        invoice = self._create_invoices(1)
+        invoice.invoice_line_ids.tax_ids = [(6, 0, exento.ids)]
+        self.assertEqual(invoice.amount_exento, 1000.0)
+        self.assertEqual(invoice.base_imponible_total, 0.0)
+
+        # Modificar el impuesto invalida el mapa cacheado
+        isv15.write({"tipo_impuesto": "retencion", "retencion_tipo": "isr"})
+        self.assertEqual(Tax._get_fiscal_class_map(self.company.id)[isv15.id], "retencion_isr")
+
+    def test_fiscal_line_facts_and_sql_backfill(self):
+        isv15 = self._create_tax("ISV 15%", 15, "isv")
+        exento = self._create_tax("Exento", 0, "exento")
+        invoice = self._create_invoices(1)
+        invoice.invoice_line_ids.write({"discount": 10.0, "tax_ids": [(6, 0, isv15.ids)]})
+        invoice.write({
+            "invoice_line_ids": [
+                (0, 0, {"name": "Exenta", "account_id": self.account.id, "price_unit": 200.0,
+                        "quantity": 2, "tax_ids": [(6, 0, exento.ids)]}),
+            ]
+        })
+        lines = invoice.invoice_line_ids.sorted("price_unit")
+        self.assertEqual(lines.mapped("fiscal_class"), ["exento", "isv15"])
+        self.assertEqual(lines[1].fiscal_isv_amount, 135.0)
+        self.assertEqual(lines[0].fiscal_exento_base, 400.0)
+        self.assertEqual(invoice.amount_isv15, 135.0)
+        self.assertEqual(invoice.amount_exento, 400.0)
+
+        fnames = ["fiscal_gross", "fiscal_discount", "fiscal_class", "fiscal_isv_amount",
+                  "fiscal_exento_base", "fiscal_exonerado_base", "fiscal_gravado_base"]
+        expected = lines.read(fnames)
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE account_move_line SET fiscal_class = NULL, fiscal_gross = NULL, fiscal_isv_amount = NULL"
+            " WHERE move_id = %s", [invoice.id]
+        )
+        self.env["account.move.line"].invalidate_model(fnames)
+        self.assertEqual(self.env["account.move.line"]._update_fiscal_facts_sql(invoice.ids), 2)
+        self.assertEqual(lines.read(fnames), expected)
+
+    def test_fiscal_line_with_isv15_and_isv18(self):
+        isv15 = self._create_tax("ISV 15%", 15, "isv")
+        isv18 = self._create_tax("ISV 18%", 18, "isv")
+        invoice = self._create_invoices(1)
+        invoice.invoice_line_ids.tax_ids = [(6, 0, (isv15 | isv18).ids)]
+        line = invoice.invoice_line_ids
+        # La línea cuenta una sola vez, como 15%, y no en ambos totales
+        self.assertEqual(line.fiscal_class, "isv15")
+        self.assertEqual((invoice.gravado_isv15, invoice.amount_isv15), (1000.0, 150.0))
+        self.assertEqual((invoice.gravado_isv18, invoice.amount_isv18), (0.0, 0.0))
+        self.assertEqual(invoice.base_imponible_total, 1000.0)
+        self.assertEqual(invoice.isv_total, 150.0)
+        self.env["account.move.line"].invalidate_model(["fiscal_class", "fiscal_isv_amount"])
+        self.env["account.move.line"]._update_fiscal_facts_sql(invoice.ids)
+        self.assertEqual((line.fiscal_class, line.fiscal_isv_amount), ("isv15", 150.0))
+
+    def test_recompute_fiscal_totals_sql(self):
+        isv15 = self._create_tax("ISV 15%", 15, "isv")
+        invoices = self._create_invoices(3)
+        invoices.invoice_line_ids.tax_ids = [(6, 0, isv15.ids)]
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE account_move SET amount_isv15 = 0, isv_total = 0 WHERE id = ANY(%s)", [invoices[:2].ids]
+        )
+        invoices.invalidate_recordset()
+
+        differences = invoices._verify_fiscal_totals()
+        self.assertEqual(set(differences), set(invoices[:2].ids))
+        self.assertEqual(differences[invoices[0].id]["amount_isv15"], (0.0, 150.0))
+        self.assertEqual(invoices[0].amount_isv15, 0.0, "La verificación no debe escribir")
+
+        wizard = self.env["kc_fiscal_hn.wizard.recompute_totals"].create(
+            {"company_id": self.company.id, "posted_only": False, "chunk_size": 2, "sample_size": 3,
+             "date_from": self.today, "date_to": self.today, "move_type": "out_invoice"}
+        )
+        wizard.action_recompute()
+        self.assertGreaterEqual(wizard.changed_count, 2)
+        self.assertEqual(wizard.mismatch_count, 0)
+        self.assertEqual(invoices.mapped("amount_isv15"), [150.0] * 3)
+        self.assertEqual(invoices.mapped("isv_total"), [150.0] * 3)
+
+    def test_batch_post_numbers_follow_document_date(self):
+        invoices = self._create_invoices(3)
+        invoices[0].invoice_date = self.today
+        invoices[1].invoice_date = fields.Date.subtract(self.today, days=2)
+        invoices[2].invoice_date = fields.Date.subtract(self.today, days=1)
+        invoices[::-1].with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(invoices[1].name, "000-001-01-00000001")
+        self.assertEqual(invoices[2].name, "000-001-01-00000002")
+        self.assertEqual(invoices[0].name, "000-001-01-00000003")
+
+    def test_deferred_numbering_stops_sequence_at_failure(self):
+        self.sequence.fiscal_numbering_mode = "deferred"
+        self.date_range.rangoFinal = 2
+        invoices = self._create_invoices(3)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        Move = self.env["account.move"]
+        Move._cron_assign_deferred_fiscal_numbers(batch_size=2, auto_commit=False)
+        self.assertEqual(invoices[:2].mapped("name"), ["000-001-01-00000001", "000-001-01-00000002"])
+        self.assertEqual(invoices[2].name, "/")
+        self.assertTrue(invoices[2].fiscal_number_pending)
+
+        later = self._create_invoices(1)
+        later.with_context(skip_fiscal_warning=True).action_post()
+        self.date_range.rangoFinal = 10
+        Move._cron_assign_deferred_fiscal_numbers(batch_size=2, auto_commit=False)
+        self.assertEqual(invoices[2].name, "000-001-01-00000003")
+        self.assertEqual(later.name, "000-001-01-00000004")
+
+    def test_counter_void_numbers_recorded(self):
+        self.sequence.fiscal_allocator = "counter"
+        numbers = self.date_range._reserve_counter_block(2, limit=self.date_range.rangoFinal)
+        self.assertEqual(numbers, [1, 2])
+        ledger = self.env["kc_fiscal_hn.fiscal.ledger"]._record_void_numbers(self.sequence, self.date_range, numbers)
+        self.assertTrue(all(ledger.mapped("is_void")))
+        self.assertEqual(ledger.mapped("name"), ["000-001-01-00000001", "000-001-01-00000002"])
+        invoices = self._create_invoices(1)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        self.assertEqual(invoices.name, "000-001-01-00000003")
+
+    def test_ledger_backfill_overlapping_ranges(self):
+        invoices = self._create_invoices(1)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        later_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": fields.Date.subtract(self.today, days=1),
+                "date_to": fields.Date.add(self.today, days=30),
+                "number_next": 1,
+                "cai": "ABCDEF-123456-789012-345678-901234-57",
+                "rangoInicial": 1,
+                "rangoFinal": 10,
+            }
+        )
+        self.env.cr.execute("DELETE FROM kc_fiscal_hn_fiscal_ledger WHERE move_id = %s", [invoices.id])
+        Ledger = self.env["kc_fiscal_hn.fiscal.ledger"]
+        Ledger.invalidate_model()
+        Ledger._backfill_from_moves()
+        ledger = Ledger.search([("move_id", "=", invoices.id)])
+        self.assertEqual(len(ledger), 1)
+        self.assertEqual(ledger.date_range_id, later_range)
+
+    def test_date_range_index_cache_version(self):
+        Version = self.env["kc_fiscal_hn.cache.version"]
+        key = "date_range_index.%s" % self.sequence.id
+        index = self.sequence._get_date_range_index()
+        self.assertIn(self.date_range.id, [entry.id for entry in index.entries])
+        version = Version._get_version(key)
+        self.date_range.number_next_actual = 5
+        self.assertEqual(Version._get_version(key), version)
+        self.date_range.date_from = fields.Date.subtract(self.today, days=20)
+        self.assertNotEqual(Version._get_version(key), version)
+        entry = self.sequence._get_date_range_entry(fields.Date.subtract(self.today, days=15))
+        self.assertEqual(entry.id, self.date_range.id)
+
+    def test_fiscal_sequence_config_cache_version(self):
+        self.assertEqual(self.journal._get_fiscal_sequence_config("out_invoice")[1:3], (self.sequence.id, True))
+        self.sequence.is_fiscal = False
+        self.assertEqual(self.journal._get_fiscal_sequence_config("out_invoice")[1:3], (self.sequence.id, False))
+        self.sequence.is_fiscal = True
+        self.journal.document_fiscal = False
+        self.assertFalse(self.journal.needs_fiscal_sequence("out_invoice"))
+
+    def test_resequence_wizard_appends_ledger_corrections(self):
+        invoices = self._create_invoices(1)
+        invoices.with_context(skip_fiscal_warning=True).action_post()
+        wrong_range = self.env["ir.sequence.date_range"].create(
+            {
+                "sequence_id": self.sequence.id,
+                "date_from": fields.Date.add(self.today, days=366),
+                "date_to": fields.Date.add(self.today, days=730),
+                "cai": "ABCDEF-123456-789012-345678-901234-57",
+                "rangoInicial": 101,
+                "rangoFinal": 200,
+            }
+        )
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE account_move SET fiscal_date_range_id = %s WHERE id = %s",
+                            [wrong_range.id, invoices.id])
+        self.env.cr.execute("UPDATE kc_fiscal_hn_fiscal_ledger SET date_range_id = %s, cai = %s WHERE move_id = %s",
+                            [wrong_range.id, wrong_range.cai, invoices.id])
+        self.env.invalidate_all()
+        wizard = self.env["kc_fiscal_hn.wizard.resequence"].create(
+            {"journal_id": self.journal.id, "move_type": "out_invoice", "date_from": self.today, "date_to": self.today}
+        )
+        wizard.action_compute_diff()
+        wizard.action_apply()
+        ledger = self.env["kc_fiscal_hn.fiscal.ledger"].search([("move_id", "=", invoices.id)], order="id")
+        self.assertEqual(ledger.mapped("is_void"), [True, False])
+        self.assertEqual(ledger.mapped("date_range_id"), wrong_range | self.date_range)
+        self.assertEqual(ledger[1].cai, self.date_range.cai)
+        check = self.env["kc_fiscal_hn.fiscal.range.check"].check_date_ranges(self.date_range)
+        self.assertEqual(check.used_count, 1)
+
+    def test_round_sar_matches_postgresql(self):
+        Move = self.env["account.move"]
+        amounts = [0.125, 2.675, 1.005, -0.125, 134.995]
+        self.env.cr.execute("SELECT ROUND(a, 2)::float FROM unnest(%s::numeric[]) AS a", [amounts])
+        self.assertEqual([Move._round_sar(amount) for amount in amounts], [row[0] for row in self.env.cr.fetchall()])
+        self.assertEqual(Move._round_sar(2.675), 2.68)
+        self.assertEqual(Move._round_sar(0.125), 0.13)
@@ -9,4 +9,6 @@ from . import report_purchases_sar
 from . import report_retentions_sar
 from . import report_exemptions_sar
 from . import reset_sequence
-from . import resolve_alert
\ No newline at end of file
+from . import resolve_alert
+from . import resequence_fiscal
+from . import recompute_fiscal_totals
\ No newline at end of file
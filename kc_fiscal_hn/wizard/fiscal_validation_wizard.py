@@ -109,9 +109,7 @@ class FiscalValidationWizard(models.TransientModel):
         for invoice in error_invoices:
             try:
                 # Intentar recalcular montos
-                invoice._compute_importe_gravado()
-                invoice._compute_base_imponible()
-                invoice._compute_isv_total()
+                invoice._compute_fiscal_amounts()
                 
                 # Revalidar
                 invoice._validate_fiscal_amounts()
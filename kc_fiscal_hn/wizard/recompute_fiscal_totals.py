@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+from ..models.account_move_line import FISCAL_FACTS_CHUNK_SIZE
+
+_logger = logging.getLogger(__name__)
+
+# Diferencias detalladas como máximo en el registro de la verificación
+VERIFY_LOG_LIMIT = 50
+
+
+class RecomputeFiscalTotalsWizard(models.TransientModel):
+    _name = 'kc_fiscal_hn.wizard.recompute_totals'
+    _description = 'Recálculo Masivo de Totales Fiscales'
+
+    company_id = fields.Many2one('res.company', string='Compañía', required=True,
+                                 default=lambda self: self.env.company)
+    move_type = fields.Selection([
+        ('out_invoice', 'Facturas de Cliente'),
+        ('out_refund', 'Notas de Crédito'),
+        ('in_invoice', 'Facturas de Proveedor'),
+        ('in_refund', 'Notas de Débito'),
+        ('in_receipt', 'Recibos de Compra'),
+    ], string='Tipo de Movimiento', help='Vacío: todos los tipos de factura')
+    date_from = fields.Date(string='Fecha Desde')
+    date_to = fields.Date(string='Fecha Hasta')
+    posted_only = fields.Boolean(string='Solo Publicadas', default=True)
+    refresh_lines = fields.Boolean(string='Recalcular Líneas', default=True,
+                                   help='Recalcular también la clase fiscal, ISV y bases de cada línea. '
+                                        'Necesario tras cambiar impuestos o el producto de descuento.')
+    chunk_size = fields.Integer(string='Facturas por Bloque', default=FISCAL_FACTS_CHUNK_SIZE, required=True)
+    sample_size = fields.Integer(string='Muestra de Verificación', default=200,
+                                 help='Facturas al azar que se comparan con el cálculo del ORM; 0 para omitir')
+
+    state = fields.Selection([
+        ('draft', 'Configuración'),
+        ('done', 'Terminado'),
+    ], string='Estado', default='draft', readonly=True)
+    move_count = fields.Integer(string='Facturas', readonly=True)
+    changed_count = fields.Integer(string='Totales Corregidos', readonly=True)
+    verified_count = fields.Integer(string='Facturas Verificadas', readonly=True)
+    mismatch_count = fields.Integer(string='Diferencias con el ORM', readonly=True)
+    log = fields.Text(string='Registro', readonly=True)
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        for wizard in self:
+            if wizard.date_from and wizard.date_to and wizard.date_from > wizard.date_to:
+                raise ValidationError(_('La fecha desde no puede ser mayor a la fecha hasta'))
+
+    @api.constrains('chunk_size', 'sample_size')
+    def _check_sizes(self):
+        for wizard in self:
+            if wizard.chunk_size <= 0 or wizard.sample_size < 0:
+                raise ValidationError(_('El tamaño de bloque debe ser positivo y la muestra no puede ser negativa'))
+
+    def _get_move_ids(self):
+        self.ensure_one()
+        domain = [('company_id', '=', self.company_id.id)]
+        if self.move_type:
+            domain.append(('move_type', '=', self.move_type))
+        else:
+            domain.append(('move_type', 'in', self.env['account.move'].get_invoice_types(include_receipts=True)))
+        if self.date_from:
+            domain.append(('date', '>=', self.date_from))
+        if self.date_to:
+            domain.append(('date', '<=', self.date_to))
+        if self.posted_only:
+            domain.append(('state', '=', 'posted'))
+        return self.env['account.move'].search(domain, order='id').ids
+
+    def _verify_sample(self, move_ids, log):
+        """Comparar una muestra al azar con el ORM; devuelve (verificadas, con diferencias)"""
+        if not self.sample_size or not move_ids:
+            return 0, 0
+        sample = self.env['account.move'].browse(random.sample(move_ids, min(self.sample_size, len(move_ids))))
+        differences = sample._verify_fiscal_totals()
+        log.append(_('Verificación: %s facturas comparadas con el ORM, %s con diferencias') % (
+            len(sample), len(differences)))
+        names = dict(sample.mapped(lambda move: (move.id, move.name)))
+        for move_id, fields_diff in list(differences.items())[:VERIFY_LOG_LIMIT]:
+            for fname, (stored_value, orm_value) in fields_diff.items():
+                log.append(_('  %s: %s almacenado %.2f, ORM %.2f') % (names[move_id], fname, stored_value, orm_value))
+        if differences:
+            _logger.warning("Verificación de totales fiscales: %d de %d facturas difieren del ORM",
+                            len(differences), len(sample))
+        return len(sample), len(differences)
+
+    def action_recompute(self):
+        """Recalcular en SQL los totales SAR almacenados y verificar una muestra contra el ORM"""
+        self.ensure_one()
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise ValidationError(_('Solo los administradores contables pueden recalcular los totales fiscales'))
+        move_ids = self._get_move_ids()
+        if not move_ids:
+            raise UserError(_('No hay facturas que cumplan los criterios seleccionados.'))
+
+        log = []
+        changed = self.env['account.move']._recompute_fiscal_totals_sql(
+            move_ids, refresh_lines=self.refresh_lines, chunk_size=self.chunk_size, progress=log)
+        verified, mismatches = self._verify_sample(move_ids, log)
+        _logger.info("Totales fiscales recalculados en SQL: %d facturas, %d corregidas", len(move_ids), changed)
+        self.write({
+            'state': 'done',
+            'move_count': len(move_ids),
+            'changed_count': changed,
+            'verified_count': verified,
+            'mismatch_count': mismatches,
+            'log': '\n'.join(log),
+        })
+        return self._reopen()
+
+    def action_verify(self):
+        """Solo verificar: comparar una muestra con el ORM sin modificar los totales almacenados"""
+        self.ensure_one()
+        move_ids = self._get_move_ids()
+        if not move_ids:
+            raise UserError(_('No hay facturas que cumplan los criterios seleccionados.'))
+        if not self.sample_size:
+            raise UserError(_('Indique el tamaño de la muestra de verificación.'))
+
+        log = []
+        verified, mismatches = self._verify_sample(move_ids, log)
+        self.write({
+            'state': 'done',
+            'move_count': len(move_ids),
+            'changed_count': 0,
+            'verified_count': verified,
+            'mismatch_count': mismatches,
+            'log': '\n'.join(log),
+        })
+        return self._reopen()
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
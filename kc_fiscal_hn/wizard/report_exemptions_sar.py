@@ -178,25 +178,26 @@ class ReportExemptionsSAR(models.TransientModel):
         
         # Datos de productos
         row = 1
-        for invoice in invoices:
-            for line in invoice.invoice_line_ids:
-                # Verificar si la línea tiene impuestos exentos o exonerados
-                has_exempt_tax = any(tax.tax_group_id.name == 'Exento' for tax in line.tax_ids)
-                has_exonerated_tax = any(tax.tax_group_id.name == 'Exonerado' for tax in line.tax_ids)
-                
-                if has_exempt_tax or has_exonerated_tax:
-                    exemption_type = 'Exento' if has_exempt_tax else 'Exonerado'
-                    exemption_amount = line.price_subtotal
-                    
-                    sheet_products.write(row, 0, invoice.name or 'N/A', detalle)
-                    sheet_products.write(row, 1, invoice.date.strftime('%d/%m/%Y') if invoice.date else 'N/A', detalle)
-                    sheet_products.write(row, 2, line.product_id.name or 'N/A', detalle)
-                    sheet_products.write(row, 3, line.quantity, detalle)
-                    sheet_products.write(row, 4, line.price_unit, detalle_moneda)
-                    sheet_products.write(row, 5, line.price_subtotal, detalle_moneda)
-                    sheet_products.write(row, 6, exemption_type, detalle)
-                    sheet_products.write(row, 7, exemption_amount, detalle_moneda)
-                    row += 1
+        # Líneas con impuestos exentos o exonerados, según la clase fiscal almacenada en la línea
+        exempt_lines = self.env['account.move.line'].search([
+            ('move_id', 'in', invoices.ids),
+            ('fiscal_class', 'in', ('exento', 'exonerado')),
+            ('tax_ids', '!=', False),
+        ], order='move_id, sequence, id')
+        for line in exempt_lines:
+            invoice = line.move_id
+            exemption_type = dict(line._fields['fiscal_class'].selection)[line.fiscal_class]
+            exemption_amount = line.price_subtotal
+
+            sheet_products.write(row, 0, invoice.name or 'N/A', detalle)
+            sheet_products.write(row, 1, invoice.date.strftime('%d/%m/%Y') if invoice.date else 'N/A', detalle)
+            sheet_products.write(row, 2, line.product_id.name or 'N/A', detalle)
+            sheet_products.write(row, 3, line.quantity, detalle)
+            sheet_products.write(row, 4, line.price_unit, detalle_moneda)
+            sheet_products.write(row, 5, line.price_subtotal, detalle_moneda)
+            sheet_products.write(row, 6, exemption_type, detalle)
+            sheet_products.write(row, 7, exemption_amount, detalle_moneda)
+            row += 1
         
         # Guardar archivo
         fp = io.BytesIO()
@@ -284,31 +284,26 @@ class ReportInvoiceDetails(models.TransientModel):
             descuento = (subtotal * line.discount) / 100 if line.discount else 0
             total = subtotal - descuento
 
-            # Determinar si la línea es exenta o exonerada basado en la lógica de _compute_exent
-            importe_exento = total if any(
-                tax.tax_group_id.name == 'Exento' for tax in line.tax_ids) else 0.00
-            importe_exonerado = total if any(
-                tax.tax_group_id.name == 'Exonerado' for tax in line.tax_ids) else 0.00
+            # Determinar si la línea es exenta o exonerada según la clase fiscal almacenada en la línea
+            fiscal_class = line.fiscal_class if line.tax_ids else False
+            importe_exento = total if fiscal_class == 'exento' else 0.00
+            importe_exonerado = total if fiscal_class == 'exonerado' else 0.00
 
             # Calcular ISV 15% si aplica (cuando no es exento ni exonerado)
-            importe_isv15 = ((total) * 15 / 100) if any(
-                tax.tax_group_id.name == '15%' for tax in
-                line.tax_ids) and not importe_exento and not importe_exonerado else 0.00
+            importe_isv15 = ((total) * 15 / 100) if fiscal_class == 'isv15' \
+                and not importe_exento and not importe_exonerado else 0.00
 
             # Calcular ISV 18% si aplica (cuando no es exento ni exonerado)
-            importe_isv18 = ((total) * 18 / 100) if any(
-                tax.tax_group_id.name == '18%' for tax in
-                line.tax_ids) and not importe_exento and not importe_exonerado else 0.00
+            importe_isv18 = ((total) * 18 / 100) if fiscal_class == 'isv18' \
+                and not importe_exento and not importe_exonerado else 0.00
 
             # Calcular ISV 15% si aplica (cuando no es exento ni exonerado)
-            isv15 = ((total) * 15) if any(
-                tax.tax_group_id.name == '15%' for tax in
-                line.tax_ids) and not importe_exento and not importe_exonerado else 0.00
+            isv15 = ((total) * 15) if fiscal_class == 'isv15' \
+                and not importe_exento and not importe_exonerado else 0.00
 
             # Calcular ISV 18% si aplica (cuando no es exento ni exonerado)
-            isv18 = ((total) * 18) if any(
-                tax.tax_group_id.name == '18%' for tax in
-                line.tax_ids) and not importe_exento and not importe_exonerado else 0.00
+            isv18 = ((total) * 18) if fiscal_class == 'isv18' \
+                and not importe_exento and not importe_exonerado else 0.00
 
             # Aplicar el signo a los impuestos
             importe_isv15 *= sign
@@ -374,31 +369,28 @@ class ReportInvoiceDetails(models.TransientModel):
             isv15 = 0
             isv18 = 0
 
-            # Verificar si la línea es exenta o exonerada
-            if any(tax.tax_group_id.name == 'Exento' for tax in line.tax_ids):
+            # Verificar si la línea es exenta o exonerada según la clase fiscal almacenada en la línea
+            fiscal_class = line.fiscal_class if line.tax_ids else False
+            if fiscal_class == 'exento':
                 importe_exento = total
 
-            if any(tax.tax_group_id.name == 'Exonerado' for tax in line.tax_ids):
+            if fiscal_class == 'exonerado':
                 importe_exonerado = total
 
             # Calcular ISV 15% si aplica
-            if any(tax.tax_group_id.name == '15%' for tax in
-                   line.tax_ids) and not importe_exento and not importe_exonerado:
+            if fiscal_class == 'isv15' and not importe_exento and not importe_exonerado:
                 importe_isv15 = (total * 15 / 100)
 
             # Calcular ISV 18% si aplica
-            if any(tax.tax_group_id.name == '18%' for tax in
-                   line.tax_ids) and not importe_exento and not importe_exonerado:
+            if fiscal_class == 'isv18' and not importe_exento and not importe_exonerado:
                 importe_isv18 = (total * 18 / 100)
 
             # Calcular ISV 15% si aplica
-            if any(tax.tax_group_id.name == '15%' for tax in
-                   line.tax_ids) and not importe_exento and not importe_exonerado:
+            if fiscal_class == 'isv15' and not importe_exento and not importe_exonerado:
                 isv15 = (total * 15)
 
             # Calcular ISV 18% si aplica
-            if any(tax.tax_group_id.name == '18%' for tax in
-                   line.tax_ids) and not importe_exento and not importe_exonerado:
+            if fiscal_class == 'isv18' and not importe_exento and not importe_exonerado:
                 isv18 = (total * 18)
 
             # Ajustar signos para impuestos
@@ -13,6 +13,12 @@ try:
 except ImportError:
     xlwt = None
 
+# Clases fiscales (account.tax._get_fiscal_class) que corresponden a cada tipo de retención del reporte
+RETENTION_TYPE_FISCAL_CLASSES = {
+    'isr': ('retencion_isr',),
+    'isv': ('retencion_isv', 'isv15', 'isv18'),
+}
+
 
 class ReportRetentionsSAR(models.TransientModel):
     _name = 'kc_fiscal_hn.wizard.retentions_sar'
@@ -212,11 +218,12 @@ class ReportRetentionsSAR(models.TransientModel):
             ('state', 'in', ['posted'])
         ]
         
-        # Filtrar por tipo de retención
-        if self.retention_type == 'isr':
-            domain.append(('invoice_line_ids.tax_ids.name', 'ilike', 'ISR'))
-        elif self.retention_type == 'isv':
-            domain.append(('invoice_line_ids.tax_ids.name', 'ilike', 'ISV'))
+        # Filtrar por tipo de retención según la clase fiscal del impuesto, no por su nombre
+        if self.retention_type in ('isr', 'isv'):
+            fiscal_classes = RETENTION_TYPE_FISCAL_CLASSES[self.retention_type]
+            class_map = self.env['account.tax']._get_fiscal_class_map(self.company_id.id)
+            tax_ids = [tax_id for tax_id, fiscal_class in class_map.items() if fiscal_class in fiscal_classes]
+            domain.append(('invoice_line_ids.tax_ids', 'in', tax_ids))
         
         return self.env['account.move'].search(domain)
     
@@ -229,16 +236,18 @@ class ReportRetentionsSAR(models.TransientModel):
             'amount': 0
         }
         
+        class_map = self.env['account.tax']._get_fiscal_class_map(invoice.company_id.id)
         for line in invoice.invoice_line_ids:
             if line.tax_ids:
                 retention_info['base'] += line.price_subtotal
                 
                 for tax in line.tax_ids:
-                    if 'ISR' in tax.name.upper():
+                    fiscal_class = class_map.get(tax.id)
+                    if fiscal_class in RETENTION_TYPE_FISCAL_CLASSES['isr']:
                         retention_info['type'] = 'ISR'
                         retention_info['rate'] = tax.amount
                         retention_info['amount'] += tax.amount
-                    elif 'ISV' in tax.name.upper():
+                    elif fiscal_class in RETENTION_TYPE_FISCAL_CLASSES['isv']:
                         retention_info['type'] = 'ISV'
                         retention_info['rate'] = tax.amount
                         retention_info['amount'] += tax.amount
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+
+_logger = logging.getLogger(__name__)
+
+
+class ResequenceFiscalWizard(models.TransientModel):
+    _name = 'kc_fiscal_hn.wizard.resequence'
+    _description = 'Reparación Masiva de Numeración Fiscal'
+
+    journal_id = fields.Many2one('account.journal', string='Diario', required=True,
+                                 domain=[('document_fiscal', '!=', False)])
+    move_type = fields.Selection([
+        ('out_invoice', 'Facturas de Cliente'),
+        ('out_refund', 'Notas de Crédito'),
+        ('in_invoice', 'Facturas de Proveedor'),
+        ('in_refund', 'Notas de Débito'),
+        ('in_receipt', 'Recibos de Compra'),
+    ], string='Tipo de Movimiento', default='out_invoice', required=True)
+    emission_point_id = fields.Many2one('kc_fiscal_hn.emission.point', string='Punto de Emisión',
+                                        domain="[('journal_ids', 'in', journal_id)]",
+                                        help='Vacío: documentos del diario sin punto de emisión')
+    date_from = fields.Date(string='Fecha Desde', required=True, default=fields.Date.today)
+    date_to = fields.Date(string='Fecha Hasta', required=True, default=fields.Date.today)
+    sequence_id = fields.Many2one('ir.sequence', string='Secuencia Fiscal', readonly=True)
+    reason = fields.Text(string='Motivo de la Reparación')
+
+    state = fields.Selection([
+        ('draft', 'Configuración'),
+        ('diff', 'Vista Previa'),
+        ('done', 'Aplicado'),
+    ], string='Estado', default='draft', readonly=True)
+    line_ids = fields.One2many('kc_fiscal_hn.wizard.resequence.line', 'wizard_id', string='Cambios', readonly=True)
+    number_count = fields.Integer(string='Por Numerar', readonly=True)
+    metadata_count = fields.Integer(string='CAI a Corregir', readonly=True)
+    unavailable_count = fields.Integer(string='Sin Números Disponibles', readonly=True)
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        for wizard in self:
+            if wizard.date_from > wizard.date_to:
+                raise ValidationError(_('La fecha desde no puede ser mayor a la fecha hasta'))
+
+    def _get_fiscal_sequence(self):
+        self.ensure_one()
+        if self.emission_point_id:
+            sequence_id = self.emission_point_id._get_fiscal_sequence_config(self.move_type)[1]
+        else:
+            sequence_id = self.journal_id._get_fiscal_sequence_config(self.move_type)[1]
+        sequence = self.env['ir.sequence'].browse(sequence_id)
+        if not sequence or not sequence.is_fiscal or not sequence.use_date_range:
+            raise UserError(_('El diario %s no tiene una secuencia fiscal con rangos CAI para este tipo de documento.')
+                            % self.journal_id.display_name)
+        return sequence
+
+    def action_compute_diff(self):
+        """
+        Vista previa: calcular en SQL el número y los datos del CAI que corresponden a cada movimiento.
+        - Movimientos publicados con "/": número previsto del rango CAI vigente en su fecha, con el
+          prefijo interpolado por fecha de documento igual que al numerar.
+        - Movimientos numerados con datos de otro CAI: CAI, fecha límite y rango autorizado del
+          rango al que pertenece su número.
+        """
+        self.ensure_one()
+        sequence = self._get_fiscal_sequence()
+        self.line_ids.unlink()
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("""
+            WITH moves AS (
+                SELECT m.id, m.name, COALESCE(m.cai_manual, cur.cai) AS cai, m.fiscal_date_range_id,
+                       num_nonnulls(m.cai_manual, m.fecha_limite_manual, m.numero_inicial_manual,
+                                    m.numero_final_manual) > 0 AS has_manual,
+                       COALESCE(m.invoice_date, m.date) AS doc_date,
+                       CASE WHEN m.name ~ '\\d' THEN substring(m.name from '(\\d+)\\D*$')::bigint END AS number
+                  FROM account_move m
+             LEFT JOIN ir_sequence_date_range cur ON cur.id = m.fiscal_date_range_id
+                 WHERE m.journal_id = %(journal)s
+                   AND m.move_type = %(move_type)s
+                   AND m.emission_point_id IS NOT DISTINCT FROM %(emission_point)s
+                   AND m.state = 'posted'
+                   AND NOT COALESCE(m.is_import, FALSE)
+                   AND COALESCE(m.invoice_date, m.date) BETWEEN %(date_from)s AND %(date_to)s
+            ), numbered AS (
+                SELECT mv.*, dr.id AS range_id, dr.cai AS range_cai
+                  FROM moves mv
+            CROSS JOIN LATERAL (
+                        SELECT r.* FROM ir_sequence_date_range r
+                         WHERE r.sequence_id = %(sequence)s
+                           AND mv.number BETWEEN r."rangoInicial" AND r."rangoFinal"
+                      ORDER BY (mv.doc_date BETWEEN r.date_from AND r.date_to) DESC, r.date_from DESC
+                         LIMIT 1
+                   ) dr
+                 WHERE mv.name != '/'
+            ), pending AS (
+                SELECT mv.*, dr.id AS range_id, dr.cai AS range_cai, dr."rangoFinal" AS range_end,
+                       COALESCE(c.number_next, dr.number_next)
+                           + ROW_NUMBER() OVER (PARTITION BY dr.id ORDER BY mv.doc_date, mv.id) - 1 AS predicted
+                  FROM moves mv
+            CROSS JOIN LATERAL (
+                        SELECT r.* FROM ir_sequence_date_range r
+                         WHERE r.sequence_id = %(sequence)s
+                           AND mv.doc_date BETWEEN r.date_from AND r.date_to
+                           AND COALESCE(r.cai, '') != ''
+                      ORDER BY r.date_from, r.id
+                         LIMIT 1
+                   ) dr
+             LEFT JOIN kc_fiscal_hn_fiscal_counter c ON c.date_range_id = dr.id
+                 WHERE mv.name = '/'
+            )
+            INSERT INTO kc_fiscal_hn_wizard_resequence_line
+                   (wizard_id, move_id, change_type, document_date, old_name, new_name, old_number, new_number,
+                    old_cai, new_cai, date_range_id, create_uid, write_uid, create_date, write_date)
+            SELECT %(wizard)s, n.id, 'metadata', n.doc_date, n.name, n.name, n.number, n.number,
+                   n.cai, n.range_cai, n.range_id, %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM numbered n
+             WHERE n.fiscal_date_range_id IS DISTINCT FROM n.range_id OR n.has_manual
+             UNION ALL
+            SELECT %(wizard)s, p.id,
+                   CASE WHEN p.predicted <= p.range_end THEN 'number' ELSE 'unavailable' END,
+                   p.doc_date, p.name, NULL, NULL, CASE WHEN p.predicted <= p.range_end THEN p.predicted END,
+                   p.cai, p.range_cai, p.range_id, %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM pending p
+        """, {
+            'wizard': self.id,
+            'uid': self.env.uid,
+            'journal': self.journal_id.id,
+            'move_type': self.move_type,
+            'emission_point': self.emission_point_id.id or None,
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'sequence': sequence.id,
+        })
+
+        # Nombre previsto: el prefijo se interpola una vez por (fecha de documento, rango), como al numerar
+        cr.execute("""
+            SELECT DISTINCT l.document_date, r.date_from
+              FROM kc_fiscal_hn_wizard_resequence_line l
+              JOIN ir_sequence_date_range r ON r.id = l.date_range_id
+             WHERE l.wizard_id = %s AND l.change_type = 'number'
+        """, [self.id])
+        keys = cr.fetchall()
+        if keys:
+            affixes = [sequence._get_prefix_suffix(date=doc_date, date_range=range_from) for doc_date, range_from in keys]
+            cr.execute("""
+                UPDATE kc_fiscal_hn_wizard_resequence_line l
+                   SET new_name = a.prefix || lpad(l.new_number::text, GREATEST(%(padding)s, length(l.new_number::text)), '0')
+                                  || a.suffix
+                  FROM ir_sequence_date_range r,
+                       unnest(%(dates)s::date[], %(range_froms)s::date[], %(prefixes)s::varchar[], %(suffixes)s::varchar[])
+                           AS a(doc_date, range_from, prefix, suffix)
+                 WHERE l.wizard_id = %(wizard)s AND l.change_type = 'number'
+                   AND r.id = l.date_range_id
+                   AND a.doc_date = l.document_date AND a.range_from = r.date_from
+            """, {
+                'padding': sequence.padding,
+                'dates': [doc_date for doc_date, _range_from in keys],
+                'range_froms': [range_from for _doc_date, range_from in keys],
+                'prefixes': [prefix for prefix, _suffix in affixes],
+                'suffixes': [suffix for _prefix, suffix in affixes],
+                'wizard': self.id,
+            })
+        self.env['kc_fiscal_hn.wizard.resequence.line'].invalidate_model()
+        self.invalidate_recordset(['line_ids'])
+        self._update_counts()
+        self.write({'sequence_id': sequence.id, 'state': 'diff'})
+        return self._reopen()
+
+    def action_apply(self):
+        """Aplicar todos los cambios de la vista previa en una sola transacción, con auditoría"""
+        self.ensure_one()
+        if self.state != 'diff':
+            raise UserError(_('Primero debe calcular la vista previa de los cambios.'))
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise ValidationError(_('Solo los administradores contables pueden reparar la numeración fiscal'))
+        sequence = self._get_fiscal_sequence()
+        Line = self.env['kc_fiscal_hn.wizard.resequence.line']
+        self.env.flush_all()
+        cr = self.env.cr
+
+        # 1. Rango CAI de los movimientos ya numerados. El libro fiscal es de solo anexado: los
+        #    registros con otro rango o CAI se anulan y se anexan registros con los datos corregidos
+        cr.execute("""
+            SELECT l.date_range_id, array_agg(l.move_id ORDER BY l.move_id), array_agg(l.new_number ORDER BY l.move_id)
+              FROM kc_fiscal_hn_wizard_resequence_line l
+             WHERE l.wizard_id = %s AND l.change_type = 'metadata'
+               AND EXISTS (SELECT 1 FROM kc_fiscal_hn_fiscal_ledger g
+                            WHERE g.move_id = l.move_id AND NOT g.is_void
+                              AND (g.date_range_id IS DISTINCT FROM l.date_range_id OR g.cai IS DISTINCT FROM l.new_cai))
+          GROUP BY l.date_range_id
+        """, [self.id])
+        ledger_fixes = cr.fetchall()
+        cr.execute("""
+            UPDATE account_move m
+               SET fiscal_date_range_id = l.date_range_id,
+                   cai_manual = NULL, fecha_limite_manual = NULL,
+                   numero_inicial_manual = NULL, numero_final_manual = NULL
+              FROM kc_fiscal_hn_wizard_resequence_line l
+             WHERE l.wizard_id = %s AND l.change_type = 'metadata' AND m.id = l.move_id
+        """, [self.id])
+        self.env['account.move'].invalidate_model([
+            'fiscal_date_range_id', 'cai_manual', 'fecha_limite_manual', 'numero_inicial_manual', 'numero_final_manual',
+        ])
+        Ledger = self.env['kc_fiscal_hn.fiscal.ledger']
+        for range_id, move_ids, numbers in ledger_fixes:
+            Ledger.sudo().search([('move_id', 'in', move_ids), ('is_void', '=', False)]).write({'is_void': True})
+            Ledger._record_moves(self.env['account.move'].browse(move_ids), sequence,
+                                 self.env['ir.sequence.date_range'].browse(range_id), numbers)
+
+        # 2. Números de los movimientos con "/", un bloque por rango CAI
+        cr.execute("""
+            SELECT l.date_range_id, array_agg(l.move_id ORDER BY l.document_date, l.move_id)
+              FROM kc_fiscal_hn_wizard_resequence_line l
+             WHERE l.wizard_id = %s AND l.change_type = 'number'
+          GROUP BY l.date_range_id
+        """, [self.id])
+        for range_id, move_ids in cr.fetchall():
+            moves = self.env['account.move'].browse(move_ids).filtered(lambda m: m.name == '/')
+            if moves:
+                moves._assign_fiscal_numbers_group(sequence, self.env['ir.sequence.date_range'].browse(range_id))
+        self.env.flush_all()
+
+        # 3. Resultado real en las líneas y auditoría, en bloque
+        cr.execute("""
+            UPDATE kc_fiscal_hn_wizard_resequence_line l
+               SET new_name = m.name,
+                   new_number = CASE WHEN m.name ~ '\\d' THEN substring(m.name from '(\\d+)\\D*$')::bigint END,
+                   new_cai = COALESCE(m.cai_manual, r.cai)
+              FROM account_move m
+         LEFT JOIN ir_sequence_date_range r ON r.id = m.fiscal_date_range_id
+             WHERE l.wizard_id = %s AND l.change_type = 'number' AND m.id = l.move_id
+        """, [self.id])
+        reason = self.reason or _('Reparación masiva de numeración fiscal')
+        cr.execute("""
+            INSERT INTO kc_fiscal_hn_sequence_audit
+                   (sequence_id, action, old_number, new_number, reason, user_id, company_id,
+                    ip_address, session_id, create_uid, write_uid, create_date, write_date)
+            SELECT %(sequence)s, 'repair', COALESCE(l.old_number, 0), COALESCE(l.new_number, 0),
+                   %(reason)s || ': ' || COALESCE(l.old_name, '') || ' → ' || COALESCE(l.new_name, '')
+                       || ' (CAI ' || COALESCE(l.old_cai, '-') || ' → ' || COALESCE(l.new_cai, '-') || ')',
+                   %(uid)s, %(company)s, %(ip)s, %(session)s,
+                   %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM kc_fiscal_hn_wizard_resequence_line l
+             WHERE l.wizard_id = %(wizard)s
+               AND (l.change_type = 'metadata' OR (l.change_type = 'number' AND l.new_name != '/'))
+        """, {
+            'sequence': sequence.id,
+            'reason': reason,
+            'uid': self.env.uid,
+            'company': self.journal_id.company_id.id,
+            'ip': self.env.context.get('ip_address', 'N/A'),
+            'session': self.env.context.get('session_id', 'N/A'),
+            'wizard': self.id,
+        })
+        audit_count = cr.rowcount
+        Line.invalidate_model()
+        self.env['kc_fiscal_hn.sequence.audit'].invalidate_model()
+        sequence._refresh_fiscal_usage_stats()
+        _logger.info("Reparación de numeración fiscal en %s: %d cambios auditados", sequence.name, audit_count)
+        self.write({'state': 'done'})
+        self._update_counts()
+        return self._reopen()
+
+    def _update_counts(self):
+        self.ensure_one()
+        counts = dict(self.env['kc_fiscal_hn.wizard.resequence.line']._read_group(
+            [('wizard_id', '=', self.id)], ['change_type'], ['__count']))
+        self.write({
+            'number_count': counts.get('number', 0),
+            'metadata_count': counts.get('metadata', 0),
+            'unavailable_count': counts.get('unavailable', 0),
+        })
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class ResequenceFiscalWizardLine(models.TransientModel):
+    _name = 'kc_fiscal_hn.wizard.resequence.line'
+    _description = 'Cambio de la Reparación de Numeración Fiscal'
+    _order = 'document_date, move_id'
+
+    wizard_id = fields.Many2one('kc_fiscal_hn.wizard.resequence', required=True, ondelete='cascade', index=True)
+    move_id = fields.Many2one('account.move', string='Movimiento', required=True, ondelete='cascade')
+    change_type = fields.Selection([
+        ('number', 'Asignar Número'),
+        ('metadata', 'Corregir CAI'),
+        ('unavailable', 'Sin Números Disponibles'),
+    ], string='Cambio', required=True)
+    document_date = fields.Date(string='Fecha')
+    old_name = fields.Char(string='Número Actual')
+    new_name = fields.Char(string='Número Nuevo')
+    old_number = fields.Integer(string='Correlativo Actual')
+    new_number = fields.Integer(string='Correlativo Nuevo')
+    old_cai = fields.Char(string='CAI Actual')
+    new_cai = fields.Char(string='CAI Nuevo')
+    date_range_id = fields.Many2one('ir.sequence.date_range', string='Rango CAI')